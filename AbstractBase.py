@@ -1,16 +1,347 @@
-from typing import List, Dict, Union, Optional
+from typing import List, Dict, Set, Union, Optional
 import os
 import json
+import sys
+import time
+import base64
+import hashlib
+import mmap
+import gzip
+import zlib
+from array import array
+from collections import OrderedDict, deque
 from datetime import datetime
+from functools import partial
 load_parallel = True
 try:
-    from threading import Thread
+    from threading import Thread, Lock, local
     from queue import *
     from multiprocessing import cpu_count
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 except ImportError:
     print("Unable to potentially load data in parallel")
     load_parallel = False
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+"""
+Version 1 files nested every child object as an escaped json string inside of its parent
+Version 2 files are a single native json document, marked by FORMAT_VERSION_KEY at the top level
+"""
+JSON_FORMAT_VERSION = 2
+FORMAT_VERSION_KEY = '__format_version__'
+"""
+Float buffers (numpy arrays, or array.array without numpy) are written as {ARRAY_KEY: base64, 'dtype', 'shape'}
+"""
+ARRAY_KEY = '__ndarray__'
+ARRAY_TYPES = (array,) if np is None else (array, np.ndarray)
+
+
+def write_file_atomic(file_path: Union[str, bytes, os.PathLike], text: Union[str, bytes]):
+    """
+    Write next to the destination and rename into place, a crash leaves the old file or none, never half of one
+    """
+    temp_file_path = os.fspath(file_path) + '.tmp'
+    try:
+        with open(temp_file_path, 'wb' if isinstance(text, bytes) else 'w') as out_file:
+            out_file.write(text)
+        os.replace(temp_file_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        raise
+
+
+"""
+Patient, header and QCL files may be compressed, 'gz' or 'xz' after the '.json' of the name says how
+Everything that pairs or derives file names works on the stem (the name without that suffix), so a patient's files
+keep the compression they were written with
+"""
+COMPRESSIONS = ('gz', 'xz')
+JSON_FILE_SUFFIXES = ('.json', '.json.gz', '.json.xz')
+"""
+Levels for files written once and read many times over a share, gzip's own default of 9 is slow for little gain
+"""
+DEFAULT_COMPRESSION_LEVELS = {'gz': 6, 'xz': 3}
+"""
+What reading a damaged file can raise: bad json, or a truncated or corrupt gzip or xz stream
+"""
+FILE_READ_ERRORS = (ValueError, OSError, EOFError, zlib.error) + ((lzma.LZMAError,) if lzma is not None else ())
+"""
+Pack files (see PatientPack) bundle the json files of many patients, a file in one is addressed as if the pack were a
+folder: <database folder>/Pack_000001.pack/<file name>
+"""
+PACK_SUFFIX = '.pack'
+
+
+def return_compression(file_name: Union[str, os.PathLike]) -> Optional[str]:
+    file_name = os.fspath(file_name)
+    for compression in COMPRESSIONS:
+        if file_name.endswith('.json.' + compression):
+            return compression
+    return None
+
+
+def return_json_stem(file_name: str) -> str:
+    """
+    The name without its compression suffix, 'A_2023.1.1.10.0_Header.json.gz' -> 'A_2023.1.1.10.0_Header.json'
+    """
+    compression = return_compression(file_name)
+    if compression is None:
+        return file_name
+    return file_name[:-len(compression) - 1]
+
+
+def check_compression(compression: Optional[str]):
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression}, expected one of {', '.join(COMPRESSIONS)}")
+
+
+def return_compressed_file_name(file_name: str, compression: Optional[str] = None) -> str:
+    """
+    :param file_name: a json file name or path, compressed or not
+    :param compression: None, 'gz', or 'xz'
+    :return: the name of the same file written with that compression
+    """
+    check_compression(compression)
+    stem = return_json_stem(file_name)
+    return stem if compression is None else stem + '.' + compression
+
+
+def compress_bytes(data: bytes, compression: Optional[str], compression_level: Optional[int] = None) -> bytes:
+    if compression is None:
+        return data
+    if compression_level is None:
+        compression_level = DEFAULT_COMPRESSION_LEVELS[compression]
+    if compression == 'gz':
+        """
+        mtime is fixed so the same document always compresses to the same bytes, and syncs as unchanged
+        """
+        return gzip.compress(data, compresslevel=compression_level, mtime=0)
+    if lzma is None:
+        raise ValueError("The lzma module is not available, xz files cannot be written")
+    return lzma.compress(data, preset=compression_level)
+
+
+def decompress_bytes(data: bytes, compression: Optional[str]) -> bytes:
+    if compression is None:
+        return data
+    if compression == 'gz':
+        return gzip.decompress(data)
+    if lzma is None:
+        raise ValueError("The lzma module is not available, xz files cannot be read")
+    return lzma.decompress(data)
+
+
+def remove_other_compressions(file_path: str):
+    """
+    Remove the copies of file_path written with a different compression, so a folder never holds two of one file
+    """
+    for other_path in {return_compressed_file_name(file_path, i) for i in (None,) + COMPRESSIONS}:
+        if other_path != file_path:
+            try:
+                os.remove(other_path)
+            except FileNotFoundError:
+                pass
+
+
+"""
+Json codecs by name, every file read or written by the BaseMethod classes goes through one
+'auto' parses with the fastest library installed (orjson, then ujson, then json), and writes with the fastest one that
+keeps NaN and Infinity. orjson writes those as null, so it only writes files when asked for by name
+"""
+DEFAULT_JSON_CODEC = 'auto'
+MMAP_MIN_BYTES = 4 * 1024 * 1024
+
+
+def _json_loads(data):
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def _json_dumps(data) -> bytes:
+    return json.dumps(data).encode('utf-8')
+
+
+def _orjson_loads(data):
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        """
+        NaN and Infinity literals, and integers past 64 bits, are valid to the json module only
+        """
+        return _json_loads(data)
+
+
+def _orjson_dumps(data) -> bytes:
+    try:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    except orjson.JSONEncodeError:
+        return _json_dumps(data)
+
+
+def _ujson_loads(data):
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    try:
+        return ujson.loads(data)
+    except ValueError:
+        return json.loads(data)
+
+
+def _ujson_dumps(data) -> bytes:
+    try:
+        return ujson.dumps(data).encode('utf-8')
+    except OverflowError:
+        return _json_dumps(data)
+
+
+class JsonCodec(object):
+    """
+    :param name: the name return_json_codec knows it by
+    :param loads: bytes (or str) to the decoded data
+    :param dumps: decoded data to utf-8 bytes
+    :param reads_buffers: loads takes a memoryview, so large files can be parsed straight from a memory map
+    """
+    def __init__(self, name: str, loads, dumps, reads_buffers: bool = False):
+        self.Name = name
+        self.loads = loads
+        self.dumps = dumps
+        self.ReadsBuffers = reads_buffers
+
+    def read_file(self, file_path: Union[str, os.PathLike]):
+        """
+        Decode the first line of a file, read as bytes rather than text, and decompressed if its name says so
+        """
+        file_path = os.fspath(file_path)
+        pack_path, file_name = os.path.split(file_path)
+        if pack_path.endswith(PACK_SUFFIX):
+            from .PatientPack import read_packed_file
+            return self.loads(read_packed_file(pack_path, file_name))
+        compression = return_compression(file_path)
+        with open(file_path, 'rb') as json_file:
+            if (compression is None and self.ReadsBuffers
+                    and os.fstat(json_file.fileno()).st_size >= MMAP_MIN_BYTES):
+                with mmap.mmap(json_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    end = mapped.find(b'\n')
+                    with memoryview(mapped) as view, view[:end if end >= 0 else len(view)] as line:
+                        return self.loads(line)
+            data = decompress_bytes(json_file.read(), compression)
+        end = data.find(b'\n')
+        return self.loads(data[:end] if end >= 0 else data)
+
+    def write_file(self, file_path: Union[str, os.PathLike], data, compression_level: Optional[int] = None):
+        """
+        Compressed if the name ends in a compression suffix, see return_compressed_file_name
+        """
+        write_file_atomic(file_path, compress_bytes(self.dumps(data), return_compression(file_path),
+                                                    compression_level))
+
+    def __reduce__(self):
+        return return_json_codec, (self.Name,)
+
+    def __repr__(self):
+        return f"JsonCodec({self.Name})"
+
+
+def return_available_json_codecs() -> Dict[str, JsonCodec]:
+    """
+    The codecs whose library is installed, fastest parser first
+    """
+    codecs = {}
+    if orjson is not None:
+        codecs['orjson'] = JsonCodec('orjson', _orjson_loads, _orjson_dumps, reads_buffers=True)
+    if ujson is not None:
+        codecs['ujson'] = JsonCodec('ujson', _ujson_loads, _ujson_dumps)
+    codecs['json'] = JsonCodec('json', _json_loads, _json_dumps)
+    return codecs
+
+
+JSON_CODECS = return_available_json_codecs()
+_auto_reader = next(iter(JSON_CODECS.values()))
+_auto_writer = JSON_CODECS.get('ujson', JSON_CODECS['json'])
+JSON_CODECS['auto'] = JsonCodec('auto', _auto_reader.loads, _auto_writer.dumps, _auto_reader.ReadsBuffers)
+
+
+def return_json_codec(codec: Optional[Union[str, JsonCodec]] = None) -> JsonCodec:
+    """
+    :param codec: a JsonCodec, the name of one, or None for DEFAULT_JSON_CODEC
+    :return:
+    """
+    if isinstance(codec, JsonCodec):
+        return codec
+    name = DEFAULT_JSON_CODEC if codec is None else codec
+    if name not in JSON_CODECS:
+        raise ValueError(f"No json codec {name}, the installed ones are {', '.join(JSON_CODECS)}")
+    return JSON_CODECS[name]
+
+
+def set_default_json_codec(codec: str):
+    """
+    The codec used wherever none is passed, in this process. Workers of the 'process' load mode only inherit it
+    where processes are forked, give databases their own codec to be sure
+    """
+    global DEFAULT_JSON_CODEC
+    return_json_codec(codec)
+    DEFAULT_JSON_CODEC = codec
+
+
+def return_float_array(values, dtype: str = 'float64'):
+    """
+    :param values: a list of floats, or an existing buffer
+    :param dtype: 'float32' or 'float64'
+    :return: a contiguous numpy array, or array.array if numpy is not installed
+    """
+    if np is not None:
+        return np.ascontiguousarray(values, dtype=dtype)
+    return array('f' if dtype == 'float32' else 'd', values)
+
+
+def encode_array(values) -> dict:
+    if np is not None and isinstance(values, np.ndarray):
+        dtype = values.dtype.name
+        shape = list(values.shape)
+        raw = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder('<')).tobytes()
+    else:
+        dtype = 'float32' if values.typecode == 'f' else 'float64'
+        shape = [len(values)]
+        if sys.byteorder == 'big':
+            values = array(values.typecode, values)
+            values.byteswap()
+        raw = values.tobytes()
+    return {ARRAY_KEY: base64.b64encode(raw).decode('ascii'), 'dtype': dtype, 'shape': shape}
+
+
+def decode_array(data: dict):
+    raw = base64.b64decode(data[ARRAY_KEY])
+    if np is not None:
+        little_endian = '<f4' if data['dtype'] == 'float32' else '<f8'
+        return np.frombuffer(raw, dtype=little_endian).astype(data['dtype']).reshape(data['shape'])
+    values = array('f' if data['dtype'] == 'float32' else 'd')
+    values.frombytes(raw)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
 
 def compare_dicts(dict1, dict2):
     # Check if both arguments are dictionaries
@@ -35,7 +366,32 @@ def compare_dicts(dict1, dict2):
     return True
 
 
+"""
+Bookkeeping kept in an object's __dict__ that is not part of what it holds
+"""
+UNCOMPARED_ATTRIBUTES = ('_projection',)
+
+
+def return_attribute_dict(value) -> Optional[dict]:
+    """
+    The attributes set on an object, from __dict__ or, for the slotted leaf classes, from their __slots__
+    :return: None for values that hold no attributes (numbers, strings, None)
+    """
+    if hasattr(value, '__dict__'):
+        if any(key in value.__dict__ for key in UNCOMPARED_ATTRIBUTES):
+            return {key: i for key, i in value.__dict__.items() if key not in UNCOMPARED_ATTRIBUTES}
+        return value.__dict__
+    slots = [slot for cls in type(value).__mro__ for slot in cls.__dict__.get('__slots__', ())]
+    if not slots:
+        return None
+    return {slot: getattr(value, slot) for slot in slots if hasattr(value, slot)}
+
+
 def compare_values(value1, value2):
+    if isinstance(value1, ARRAY_TYPES):
+        value1 = value1.tolist()
+    if isinstance(value2, ARRAY_TYPES):
+        value2 = value2.tolist()
     if isinstance(value1, list) and isinstance(value2, list):
         if len(value1) != len(value2):
             print(value1)
@@ -46,72 +402,434 @@ def compare_values(value1, value2):
         return True
     elif isinstance(value1, dict) and isinstance(value2, dict):
         return compare_dicts(value1, value2)
-    elif hasattr(value1, '__dict__') and hasattr(value2, '__dict__'):
-        return compare_dicts(value1.__dict__, value2.__dict__)
+    attributes1 = return_attribute_dict(value1)
+    attributes2 = return_attribute_dict(value2)
+    if attributes1 is not None and attributes2 is not None:
+        return compare_dicts(attributes1, attributes2)
+    return value1 == value2
+
+
+"""
+Keys that say where or how an object was stored rather than what it holds, left out of content hashes
+"""
+CONTENT_HASH_EXCLUDE = ('FilePath', 'ContentHash', FORMAT_VERSION_KEY)
+
+
+def _return_scalar_bytes(value) -> bytes:
+    """
+    NaN encodes equal to NaN and 1.0 equal to 1, the same things compare_values treats as equal
+    """
+    if value is None:
+        return b'n'
+    if value is True or value is False:
+        return b't' if value else b'f'
+    if isinstance(value, float):
+        if value != value:
+            return b'NaN'
+        if value.is_integer():
+            return b'i%d' % int(value)
+        return b'r' + repr(value).encode('ascii')
+    if isinstance(value, int):
+        return b'i%d' % value
+    if isinstance(value, str):
+        encoded = value.encode('utf-8')
+        return b's%d:' % len(encoded) + encoded
+    return b'j' + json.dumps(value).encode('utf-8')
+
+
+"""
+Integers below this size are exact as doubles (2 ** 53 + 1 rounds to 2 ** 53), a list reaching it is not hashed as
+packed doubles
+"""
+MAX_EXACT_DOUBLE_INTEGER = 2 ** 53
+
+
+def _return_packed_list(value: list) -> Optional[array]:
+    """
+    The list as doubles when that is exact and compares as compare_values does: only ints and floats (no bools), no
+    NaN, nothing as large as MAX_EXACT_DOUBLE_INTEGER. None otherwise
+    """
+    if not all(type(i) is float or type(i) is int for i in value):
+        return None
+    try:
+        packed = array('d', value)
+    except OverflowError:
+        return None
+    if packed != packed or (packed and max(-min(packed), max(packed)) >= MAX_EXACT_DOUBLE_INTEGER):
+        return None
+    return packed
+
+
+def _return_digest(value, memo: Optional[dict] = None) -> bytes:
+    """
+    Merkle digest of an encoded (to_dict) value: scalar lists are hashed in one piece, dictionaries by their sorted
+    keys and the digests of their values, so equal subtrees give equal digests wherever they sit
+    Numeric lists that doubles hold exactly are hashed as packed little endian doubles, which is what keeps DVHs
+    cheap, other scalar lists by their joined scalar encodings, under a tag of their own
+    :param memo: id(value) to digest, reused by content_diff while walking the same trees
+    """
+    value_id = id(value)
+    if memo is not None:
+        digest = memo.get(value_id)
+        if digest is not None:
+            return digest
+    if isinstance(value, dict) and ARRAY_KEY in value:
+        value = decode_array(value).tolist()
+    if isinstance(value, dict):
+        content_hash = hashlib.sha1(b'd')
+        for key in sorted(value):
+            if key in CONTENT_HASH_EXCLUDE:
+                continue
+            content_hash.update(_return_scalar_bytes(key))
+            item = value[key]
+            if isinstance(item, (dict, list)):
+                content_hash.update(b'h' + _return_digest(item, memo))
+            else:
+                item = _return_scalar_bytes(item)
+                content_hash.update(b'%d:' % len(item) + item)
+        digest = content_hash.digest()
+    elif isinstance(value, list):
+        packed = _return_packed_list(value)
+        if packed is not None:
+            if sys.byteorder == 'big':
+                packed.byteswap()
+            digest = hashlib.sha1(b'a' + packed.tobytes()).digest()
+        elif not any(isinstance(i, (dict, list)) for i in value):
+            digest = hashlib.sha1(b'c' + b','.join([_return_scalar_bytes(i) for i in value])).digest()
+        else:
+            content_hash = hashlib.sha1(b'l')
+            for i in value:
+                content_hash.update(_return_digest(i, memo))
+            digest = content_hash.digest()
     else:
-        return value1 == value2
-
-
-def add_patient(a):
-    patient_dictionary: PatientDatabase.Patients
-    q: Queue
-    q, pbar, patient_dictionary = a
-    update = False
-    if pbar is not None:
-        update = True
-    while True:
-        file = q.get()
-        if file is None:
-            break
-        if update:
-            pbar.update()
-        patient = PatientClass.from_json_file(file)
-        patient.FilePath = file
-        patient_dictionary[patient.RS_UID] = patient
-        q.task_done()
+        digest = hashlib.sha1(b'v' + _return_scalar_bytes(value)).digest()
+    if memo is not None:
+        memo[value_id] = digest
+    return digest
 
 
-def load_qcls(a):
+def return_content_hash(encoded_value) -> str:
     """
-    This works for both header and patient dictionaries, so keep it vague
-    :param a:
-    :return:
+    Stable hex digest of what a to_dict (or loaded json) value holds, independent of key order and file location
     """
-    q: Queue
-    q, pbar, patient_dict = a
-    update = False
-    if pbar is not None:
-        update = True
-    while True:
-        mrn = q.get()
-        if mrn is None:
-            break
-        if update:
-            pbar.update()
-        patient_dict[mrn].load_qcls()
-        q.task_done()
-
-
-def add_patient_header(a):
-    patient_header_dictionary: PatientHeaderDatabase.PatientHeaders
-    q: Queue
-    q, pbar, patient_header_dictionary = a
-    update = False
-    if pbar is not None:
-        update = True
-    while True:
-        file = q.get()
-        if file is None:
-            break
-        if update:
-            pbar.update()
-        patient_header = PatientHeader.from_json_file(file)
-        patient_header.FilePath = file
-        patient_header_dictionary[patient_header.RS_UID] = patient_header
-        q.task_done()
+    return _return_digest(encoded_value).hex()
+
+
+def return_content_diff(encoded_value1, encoded_value2, path: str = '', memo: Optional[dict] = None) -> List[str]:
+    """
+    Paths ('Cases[0].TreatmentPlans[1].Review') of the smallest subtrees that differ, only descending where digests
+    differ
+    """
+    if memo is None:
+        memo = {}
+    if _return_digest(encoded_value1, memo) == _return_digest(encoded_value2, memo):
+        return []
+    if isinstance(encoded_value1, dict) and isinstance(encoded_value2, dict) and \
+            ARRAY_KEY not in encoded_value1 and ARRAY_KEY not in encoded_value2:
+        differences = []
+        for key in sorted(set(encoded_value1) | set(encoded_value2)):
+            if key in CONTENT_HASH_EXCLUDE:
+                continue
+            key_path = f"{path}.{key}" if path else key
+            if key not in encoded_value1 or key not in encoded_value2:
+                differences.append(key_path)
+            else:
+                differences += return_content_diff(encoded_value1[key], encoded_value2[key], key_path, memo)
+        return differences
+    if isinstance(encoded_value1, list) and isinstance(encoded_value2, list) and \
+            len(encoded_value1) == len(encoded_value2) and \
+            any(isinstance(i, (dict, list)) for i in encoded_value1 + encoded_value2):
+        differences = []
+        for index, (value1, value2) in enumerate(zip(encoded_value1, encoded_value2)):
+            differences += return_content_diff(value1, value2, f"{path}[{index}]", memo)
+        return differences
+    return [path]
+
+
+def _encode_value(attribute_value):
+    """
+    Runtime fallback used when a value does not match its annotation
+    """
+    if isinstance(attribute_value, list):
+        return [element.to_dict() if hasattr(element, 'to_dict') else element for element in attribute_value]
+    elif isinstance(attribute_value, dict):
+        out_dict = {}
+        for key, value in attribute_value.items():
+            if hasattr(key, 'to_json'):
+                key = key.to_json()
+            if hasattr(value, 'to_dict'):
+                value = value.to_dict()
+            out_dict[key] = value
+        return out_dict
+    elif hasattr(attribute_value, 'to_dict'):
+        return attribute_value.to_dict()
+    elif isinstance(attribute_value, ARRAY_TYPES):
+        return encode_array(attribute_value)
+    return attribute_value
+
+
+def _encode_plain(attribute_value):
+    if isinstance(attribute_value, (list, dict, BaseMethod)):
+        return _encode_value(attribute_value)
+    elif isinstance(attribute_value, ARRAY_TYPES):
+        return encode_array(attribute_value)
+    return attribute_value
+
+
+def _decode_plain_list(value):
+    if isinstance(value, dict):
+        return decode_array(value)
+    return value
+
+
+def _encode_object(attribute_value):
+    if isinstance(attribute_value, BaseMethod):
+        return attribute_value.to_dict()
+    return _encode_value(attribute_value)
+
+
+def _encode_object_list(attribute_value):
+    if isinstance(attribute_value, list):
+        return [element.to_dict() if isinstance(element, BaseMethod) else _encode_value(element)
+                for element in attribute_value]
+    return _encode_value(attribute_value)
+
+
+"""
+Decoder modes held in a SerializerPlan
+"""
+DECODE_SET = 0  # set the json value as is
+DECODE_CONVERT = 1  # set converter(json value), None stays None
+DECODE_UPDATE_DICT = 2  # update the dictionary made by __init__ with converted keys and values
+DECODE_INTERN = 3  # a categorical string (or list of them), shared through the active SymbolTable
+
+
+class SymbolTable(object):
+    """
+    One shared str per distinct value of the categorical fields of a database (ROI names and types, machines, beam
+    qualities, modalities, approval status, staff), so millions of repeats hold one string and compare by identity.
+    Each value also has a small integer code, which is what the binary formats store
+    """
+    Values: List[str]
+    Codes: Dict[str, int]
+
+    def __init__(self, values: Optional[List[str]] = None):
+        self.Values = []
+        self.Codes = {}
+        self._lock = Lock()
+        for value in values or []:
+            self.add(value)
+
+    def add(self, value: str) -> int:
+        with self._lock:
+            code = self.Codes.get(value)
+            if code is None:
+                code = len(self.Values)
+                self.Values.append(value)
+                self.Codes[value] = code
+            return code
+
+    def intern(self, value):
+        """
+        :return: the shared copy of value, anything that is not a str is returned as is
+        """
+        if type(value) is not str:
+            if isinstance(value, list):
+                return [self.intern(i) for i in value]
+            return value
+        code = self.Codes.get(value)
+        if code is None:
+            code = self.add(value)
+        return self.Values[code]
+
+    def return_code(self, value: Optional[str]) -> int:
+        """
+        :return: the code of value, -1 for None
+        """
+        if value is None:
+            return -1
+        code = self.Codes.get(value)
+        if code is None:
+            code = self.add(value)
+        return code
+
+    def return_value(self, code: int) -> Optional[str]:
+        if code < 0:
+            return None
+        return self.Values[code]
+
+    def intern_object(self, value):
+        """
+        Walk an already decoded object (for example one returned by a worker process) and intern its categorical
+        attributes in place
+        """
+        if isinstance(value, list):
+            for i in value:
+                self.intern_object(i)
+            return None
+        if isinstance(value, dict):
+            for i in value.values():
+                self.intern_object(i)
+            return None
+        if not isinstance(value, BaseMethod):
+            return None
+        for attribute, mode, converter in value.return_serializer_plan().Decoders:
+            if not hasattr(value, attribute):
+                continue
+            if mode == DECODE_INTERN:
+                setattr(value, attribute, self.intern(getattr(value, attribute)))
+            elif mode == DECODE_UPDATE_DICT or (mode == DECODE_CONVERT and converter is not _decode_plain_list):
+                self.intern_object(getattr(value, attribute))
+
+    def __len__(self):
+        return len(self.Values)
+
+
+_decode_context = local()
+
+
+def set_decode_symbol_table(symbol_table: Optional[SymbolTable]) -> Optional[SymbolTable]:
+    """
+    Intern the categorical fields of everything from_json decodes on this thread into symbol_table, None to stop
+    :return: the table that was active before, to put back afterwards
+    """
+    previous = getattr(_decode_context, 'SymbolTable', None)
+    _decode_context.SymbolTable = symbol_table
+    return previous
+
+
+class SerializerPlan:
+    """
+    The annotation walk for a BaseMethod class, done once and cached on the class by return_serializer_plan
+    """
+    def __init__(self, cls):
+        self.Marker = '__' + cls.__name__ + '__'
+        self.Encoders = []
+        self.Decoders = []
+        self.SubTypes = {}  # attribute to the BaseMethod class it holds (or holds a list of), for FieldProjection
+        self.Collections = set()  # attributes holding a list of BaseMethod objects, or a dictionary
+        interned_attributes = cls.__dict__.get('_interned_attributes', ())
+        for attribute, attribute_type in cls.__annotations__.items():
+            if attribute in interned_attributes:
+                self.Encoders.append((attribute, _encode_plain))
+                self.Decoders.append((attribute, DECODE_INTERN, None))
+                continue
+            if hasattr(attribute_type, "__origin__"):
+                if attribute_type.__origin__ == list or attribute_type.__origin__ is List:
+                    sub_type = attribute_type.__args__[0]
+                    if hasattr(sub_type, "from_json"):
+                        self.SubTypes[attribute] = sub_type
+                        self.Collections.add(attribute)
+                        self.Encoders.append((attribute, _encode_object_list))
+                        self.Decoders.append((attribute, DECODE_CONVERT, _list_decoder(sub_type.from_json)))
+                    else:
+                        self.Encoders.append((attribute, _encode_plain))
+                        self.Decoders.append((attribute, DECODE_CONVERT, _decode_plain_list))
+                elif attribute_type.__origin__ == dict or attribute_type.__origin__ is Dict:
+                    key_type = attribute_type.__args__[0]
+                    value_type = attribute_type.__args__[1]
+                    key_converter = key_type.from_json if hasattr(key_type, "from_json") else key_type
+                    value_converter = value_type.from_json if hasattr(value_type, "from_json") else value_type
+                    self.Collections.add(attribute)
+                    self.Encoders.append((attribute, _encode_value))
+                    self.Decoders.append((attribute, DECODE_UPDATE_DICT, (key_converter, value_converter)))
+                else:
+                    """
+                    Union types (FilePath) are written, but never read back
+                    """
+                    self.Encoders.append((attribute, _encode_plain))
+            elif hasattr(attribute_type, "from_json"):
+                self.SubTypes[attribute] = attribute_type
+                self.Encoders.append((attribute, _encode_object))
+                self.Decoders.append((attribute, DECODE_CONVERT, attribute_type.from_json))
+            else:
+                self.Encoders.append((attribute, _encode_plain))
+                self.Decoders.append((attribute, DECODE_SET, None))
+
+
+class FieldProjection(object):
+    """
+    Which attributes from_json builds, from attribute paths through the object tree (lists are stepped through)
+    'Cases.TreatmentPlans.BeamSets.Beams' includes a subtree: along the path only the named lists (and dictionaries)
+    of objects are built, plain values and single child objects (dates, Review, FractionDose) at each step are kept
+    '!Cases.TreatmentPlans.BeamSets.FractionDose' excludes any attribute, and wins over includes
+    Skipped subtrees are never instantiated, and nested json strings in version 1 files are never decoded
+    :param fields: the paths
+    :param cls: the class the paths start from, paths are checked against its annotations
+    """
+    def __init__(self, fields: Optional[List[str]] = None, cls=None):
+        self.Children = {}
+        self.Included = set()
+        self.Excluded = set()
+        self.Everything = True
+        for field in fields or []:
+            excluded = field.startswith('!')
+            path = field.lstrip('!').split('.')
+            if cls is not None:
+                check_field_path(cls, path)
+            node = self
+            for index, attribute in enumerate(path):
+                if index == len(path) - 1 and excluded:
+                    node.Excluded.add(attribute)
+                    break
+                if not excluded:
+                    node.Included.add(attribute)
+                node = node.Children.setdefault(attribute, FieldProjection())
+        self.set_everything()
+
+    def set_everything(self) -> bool:
+        """
+        Mark the nodes that keep their whole subtree, from_json is used as is below those
+        """
+        children_everything = [i.set_everything() for i in self.Children.values()]
+        self.Everything = not self.Included and not self.Excluded and all(children_everything)
+        return self.Everything
+
+    def keeps(self, attribute: str, plan: SerializerPlan) -> bool:
+        if attribute in self.Excluded:
+            return False
+        return not self.Included or attribute in self.Included or attribute not in plan.Collections
+
+
+def check_field_path(cls, path: List[str]):
+    for index, attribute in enumerate(path):
+        plan = cls.return_serializer_plan()
+        if attribute not in cls.__annotations__:
+            raise ValueError(f"{cls.__name__} has no attribute {attribute} in {'.'.join(path)}")
+        if index < len(path) - 1:
+            if attribute not in plan.SubTypes:
+                raise ValueError(f"Cannot project into {cls.__name__}.{attribute} in {'.'.join(path)}")
+            cls = plan.SubTypes[attribute]
+
+
+def return_field_projection(fields, cls) -> Optional[FieldProjection]:
+    """
+    :param fields: None, a list of paths, or an already built FieldProjection
+    :return: None when everything is kept
+    """
+    if fields is None or isinstance(fields, FieldProjection):
+        projection = fields
+    else:
+        projection = FieldProjection(fields, cls)
+    if projection is None or projection.Everything:
+        return None
+    return projection
+
+
+def _list_decoder(from_json):
+    def decode_list(values):
+        return [from_json(i) for i in values]
+    return decode_list
 
 
 class BaseMethod:
+    """
+    Empty __slots__ so the high count leaf classes (ROIs, POIs, DVHs, beams, dates) can declare their own and hold no
+    __dict__, every other subclass still gets one
+    """
+    __slots__ = ()
+    _content_hash_exclude = ()
+
     def build(self, *args, **kwargs):
         pass
 
@@ -121,99 +839,150 @@ class BaseMethod:
     def __setitem__(self, key, value):
         setattr(self, key, value)
 
-    def to_json_file(self, json_file_path, exclude=None):
-        json_str = self.to_json(exclude=exclude)
-        with open(json_file_path, 'w') as json_file:
-            json_file.write(json_str)
+    def to_json_file(self, json_file_path, exclude=None, codec: Optional[Union[str, JsonCodec]] = None,
+                     compression_level: Optional[int] = None):
+        """
+        :param json_file_path: ending in '.json.gz' or '.json.xz' writes a compressed file
+        """
+        json_dict = self.to_dict(exclude=exclude)
+        json_dict[FORMAT_VERSION_KEY] = JSON_FORMAT_VERSION
+        return_json_codec(codec).write_file(json_file_path, json_dict, compression_level)
+
+    @classmethod
+    def return_serializer_plan(cls) -> SerializerPlan:
+        """
+        Built on first use, and stored on the class itself so subclasses never share their parent's plan
+        """
+        plan = cls.__dict__.get('_serializer_plan')
+        if plan is None:
+            plan = SerializerPlan(cls)
+            cls._serializer_plan = plan
+        return plan
 
-    def to_json(self, exclude=None):
-        if exclude is None:
-            exclude = []
-        json_dict = {'__' + self.__class__.__name__ + '__': True}
-        for attribute, attribute_type in self.__annotations__.items():
-            if attribute in exclude:
+    def to_dict(self, exclude=None):
+        """
+        Build a native nested dictionary of this object, child objects are nested as dictionaries as well
+        :param exclude: attributes to leave out
+        :return:
+        """
+        plan = self.return_serializer_plan()
+        json_dict = {plan.Marker: True}
+        for attribute, encoder in plan.Encoders:
+            if exclude and attribute in exclude:
                 # Skip excluded attributes
                 continue
-            if not hasattr(self, attribute):
+            try:
+                attribute_value = getattr(self, attribute)
+            except AttributeError:
                 continue
-            attribute_value = getattr(self, attribute)
-            # Check if attribute is a list
-            if isinstance(attribute_value, list):
-                out_list = []
-                for element in attribute_value:
-                    if hasattr(element, 'to_json'):
-                        out_list.append(element.to_json())
-                    else:
-                        out_list.append(element)
-                json_dict[attribute] = out_list
-
-            # Check if attribute is a dictionary
-            elif isinstance(attribute_value, dict):
-                out_dict = {}
-                for key, value in attribute_value.items():
-                    if hasattr(key, 'to_json'):
-                        key = key.to_json()
-                    if hasattr(value, 'to_json'):
-                        value = value.to_json()
-                    out_dict[key] = value
-                json_dict[attribute] = out_dict
-
-            # Handle other types
-            else:
-                if hasattr(attribute_value, "to_json"):
-                    json_dict[attribute] = attribute_value.to_json()
-                else:
-                    json_dict[attribute] = attribute_value
+            json_dict[attribute] = encoder(attribute_value)
+        return json_dict
+
+    def content_hash(self, exclude=None) -> str:
+        """
+        Canonical digest of this object and everything under it, equal for objects compare_values finds equal
+        Computed from to_dict on every call, nothing is cached as the objects are edited in place
+        :param exclude: attributes to leave out, as for to_dict, defaults to the class _content_hash_exclude
+        :return:
+        """
+        if exclude is None:
+            exclude = self._content_hash_exclude
+        return return_content_hash(self.to_dict(exclude=exclude))
+
+    def content_diff(self, other, exclude=None) -> List[str]:
+        """
+        Attribute paths of the subtrees that differ between self and other, empty if the contents are equal
+        """
+        if exclude is None:
+            exclude = self._content_hash_exclude
+        return return_content_diff(self.to_dict(exclude=exclude), other.to_dict(exclude=exclude))
 
-        return json.dumps(json_dict)
+    def to_json(self, exclude=None, codec: Optional[Union[str, JsonCodec]] = None):
+        json_dict = self.to_dict(exclude=exclude)
+        json_dict[FORMAT_VERSION_KEY] = JSON_FORMAT_VERSION
+        return return_json_codec(codec).dumps(json_dict).decode('utf-8')
 
     @classmethod
-    def from_json_file(cls, json_file_path):
-        with open(json_file_path, 'r') as json_file:
-            json_str = json_file.readlines()[0]
-        return cls().from_json(json_str)
+    def from_json_file(cls, json_file_path, fields=None, codec: Optional[Union[str, JsonCodec]] = None):
+        return cls.from_json(return_json_codec(codec).read_file(json_file_path), fields)
 
     @classmethod
-    def from_json(cls, json_str):
-        data = json.loads(json_str)
-        if '__' + cls.__name__ + '__' in data:
+    def from_json(cls, json_str, fields=None, codec: Optional[Union[str, JsonCodec]] = None):
+        """
+        :param json_str: a json string, or an already decoded dictionary. Version 1 files nest every child object
+        as its own json string, those are decoded here as they are reached
+        :param fields: attribute paths to include or ('!' prefixed) exclude, or a FieldProjection
+        :param codec: the JsonCodec (or its name) that decodes json_str
+        :return:
+        """
+        if isinstance(json_str, (str, bytes)):
+            data = return_json_codec(codec).loads(json_str)
+        else:
+            data = json_str
+        plan = cls.return_serializer_plan()
+        if fields is not None:
+            projection = return_field_projection(fields, cls)
+            if projection is not None:
+                return cls._from_json_projected(data, plan, projection)
+        if plan.Marker in data:
             temp = cls()
-            for attribute, attribute_type in temp.__annotations__.items():
-                if attribute in data:
-                    if hasattr(attribute_type, "__origin__"):
-                        if attribute_type.__origin__ == list or attribute_type.__origin__ is List:
-                            sub_type = attribute_type.__args__[0]
-                            if hasattr(sub_type, "from_json"):
-                                setattr(temp, attribute, [sub_type.from_json(i) for i in data[attribute]])
-                            else:
-                                setattr(temp, attribute, data[attribute])
-                        elif attribute_type.__origin__ == dict or attribute_type.__origin__ is Dict:
-                            key_type = attribute_type.__args__[0]
-                            value_type = attribute_type.__args__[1]
-                            for key, value in data[attribute].items():
-                                if hasattr(key_type, "from_json"):
-                                    key_value = key_type.from_json(key)
-                                else:
-                                    key_value = key_type(key)
-                                if hasattr(value_type, "from_json"):
-                                    value_value = value_type.from_json(value)
-                                else:
-                                    value_value = value_type(value)
-                                getattr(temp, attribute).update({key_value: value_value})
-                    elif hasattr(attribute_type, "from_json"):
-                        if data[attribute] is not None:
-                            setattr(temp, attribute, attribute_type.from_json(data[attribute]))
-                        else:
-                            setattr(temp, attribute, data[attribute])
-                    else:
-                        setattr(temp, attribute, data[attribute])
+            symbol_table = getattr(_decode_context, 'SymbolTable', None)
+            for attribute, mode, converter in plan.Decoders:
+                if attribute not in data:
+                    continue
+                value = data[attribute]
+                if mode == DECODE_SET:
+                    setattr(temp, attribute, value)
+                elif mode == DECODE_INTERN:
+                    setattr(temp, attribute, symbol_table.intern(value) if symbol_table is not None else value)
+                elif mode == DECODE_CONVERT:
+                    setattr(temp, attribute, converter(value) if value is not None else value)
+                else:
+                    key_converter, value_converter = converter
+                    getattr(temp, attribute).update({key_converter(key): value_converter(dict_value)
+                                                     for key, dict_value in value.items()})
             return temp
         else:
             x = 1
             # raise ValueError("JSON")
 
+    @classmethod
+    def _from_json_projected(cls, data, plan: SerializerPlan, projection: FieldProjection):
+        """
+        from_json limited to what projection keeps, kept subtrees without further restrictions use plain from_json
+        """
+        if plan.Marker not in data:
+            return None
+        temp = cls()
+        symbol_table = getattr(_decode_context, 'SymbolTable', None)
+        for attribute, mode, converter in plan.Decoders:
+            if attribute not in data or not projection.keeps(attribute, plan):
+                continue
+            value = data[attribute]
+            child = projection.Children.get(attribute)
+            if child is not None and value is not None and not child.Everything:
+                sub_type = plan.SubTypes[attribute]
+                sub_plan = sub_type.return_serializer_plan()
+                if isinstance(value, list):
+                    value = [sub_type._from_json_projected(_return_decoded(i), sub_plan, child) for i in value]
+                else:
+                    value = sub_type._from_json_projected(_return_decoded(value), sub_plan, child)
+                setattr(temp, attribute, value)
+            elif mode == DECODE_SET:
+                setattr(temp, attribute, value)
+            elif mode == DECODE_INTERN:
+                setattr(temp, attribute, symbol_table.intern(value) if symbol_table is not None else value)
+            elif mode == DECODE_CONVERT:
+                setattr(temp, attribute, converter(value) if value is not None else value)
+            else:
+                key_converter, value_converter = converter
+                getattr(temp, attribute).update({key_converter(key): value_converter(dict_value)
+                                                 for key, dict_value in value.items()})
+        return temp
+
 
 class DateTimeClass(BaseMethod):
+    __slots__ = ('year', 'month', 'day', 'hour', 'minute', 'second')
     year: int
     month: int
     day: int
@@ -231,7 +1000,7 @@ class DateTimeClass(BaseMethod):
 
     def __eq__(self, other):
         if isinstance(other, DateTimeClass):
-            if self.__dict__ == other.__dict__:
+            if return_attribute_dict(self) == return_attribute_dict(other):
                 return True
         return False
 
@@ -289,6 +1058,7 @@ class DateTimeClass(BaseMethod):
 
 
 class ReducedDateTimeClass(BaseMethod):
+    __slots__ = ('year', 'month', 'day')
     year: int
     month: int
     day: int
@@ -300,7 +1070,7 @@ class ReducedDateTimeClass(BaseMethod):
 
     def __eq__(self, other):
         if isinstance(other, ReducedDateTimeClass):
-            if self.__dict__ == other.__dict__:
+            if return_attribute_dict(self) == return_attribute_dict(other):
                 return True
         return False
 
@@ -376,6 +1146,7 @@ class OrganDataClass(BaseMethod):
 
 
 class RegionOfInterestBase(BaseMethod):
+    _interned_attributes = ('Name', 'Type')
     Name: str
     RS_Number: int  # A Raystation integer unique within the treatment case
     Type: str
@@ -389,6 +1160,7 @@ class RegionOfInterestBase(BaseMethod):
 
 
 class PointOfInterestBase(BaseMethod):
+    _interned_attributes = ('Name', 'Type', 'OrganType')
     Name: str
     RS_Number: int  # A Raystation integer unique within the treatment case
     Type: str
@@ -402,33 +1174,44 @@ class PointOfInterestBase(BaseMethod):
 
 
 class PointOfInterest(BaseMethod):
+    __slots__ = ('Name', 'RS_Number', 'Defined', 'POI_UID', 'x', 'y', 'z')
+    _interned_attributes = ('Name',)
     Name: str
     RS_Number: int  # A Raystation integer unique within the treatment case
     Defined: bool
-    POI_UID: int = 0
+    POI_UID: int
     x: float
     y: float
     z: float
 
+    def __init__(self):
+        self.POI_UID = 0
+
     def __repr__(self):
         return self.Name
 
 
 class RegionOfInterest(BaseMethod):
+    __slots__ = ('Name', 'RS_Number', 'ROI_UID', 'Volume', 'HU_Min', 'HU_Max', 'HU_Average', 'Defined')
+    _interned_attributes = ('Name',)
     Name: str
     RS_Number: int  # A Raystation integer unique within the treatment case
-    ROI_UID: int = 0
+    ROI_UID: int
     Volume: float
     HU_Min: float
     HU_Max: float
     HU_Average: float
     Defined: bool
 
+    def __init__(self):
+        self.ROI_UID = 0
+
     def __repr__(self):
         return self.Name
 
 
 class EquipmentInfoClass(BaseMethod):
+    _interned_attributes = ('Modality',)
     FrameOfReference: str
     Modality: str
 
@@ -456,29 +1239,58 @@ class ExaminationClass(BaseMethod):
 
 
 class RegionOfInterestDose(BaseMethod):
+    __slots__ = ('AbsoluteDose', 'RelativeVolumes', 'Dose_Min_cGy', 'Dose_Max_cGy', 'Dose_Average_cGy',
+                 'Dose_ROI_UID', 'RS_Number', 'Name', 'ScalingFactor', 'Defined', 'dvh_step', 'AttemptedUpdate')
+    _interned_attributes = ('Name',)
     AbsoluteDose: List[float]  # DVH will be the dose at relative volume from 1-100%
     RelativeVolumes: List[float]  # DVH volumes won't be exactly 0-100%, these are picked up from the voxels
-    Dose_Min_cGy: float = 0.0
-    Dose_Max_cGy: float = 0.0
-    Dose_Average_cGy: float = 0.0
-    Dose_ROI_UID: int = 0
+    Dose_Min_cGy: float
+    Dose_Max_cGy: float
+    Dose_Average_cGy: float
+    Dose_ROI_UID: int
     RS_Number: int
     Name: str
-    ScalingFactor: int = 1
-    Defined: bool = False
-    dvh_step: float = 0.01
-    AttemptedUpdate: bool = False
+    ScalingFactor: int
+    Defined: bool
+    dvh_step: float
+    AttemptedUpdate: bool
+
+    def __init__(self):
+        self.Dose_Min_cGy = 0.0
+        self.Dose_Max_cGy = 0.0
+        self.Dose_Average_cGy = 0.0
+        self.Dose_ROI_UID = 0
+        self.ScalingFactor = 1
+        self.Defined = False
+        self.dvh_step = 0.01
+        self.AttemptedUpdate = False
+
+    def to_arrays(self, dtype: str = 'float64'):
+        """
+        Hold the DVH as contiguous float buffers, which are written to json as base64 rather than lists of numbers
+        :param dtype: 'float32' or 'float64'
+        :return:
+        """
+        for attribute in ('AbsoluteDose', 'RelativeVolumes'):
+            if hasattr(self, attribute):
+                setattr(self, attribute, return_float_array(getattr(self, attribute), dtype))
 
     def __repr__(self):
         return self.Name
 
 
 class PointOfInterestDose(BaseMethod):
+    __slots__ = ('Dose_cGy', 'Name', 'Dose_POI_UID', 'RS_Number', 'ScalingFactor')
+    _interned_attributes = ('Name',)
     Dose_cGy: float
     Name: str
-    Dose_POI_UID: int = 0
+    Dose_POI_UID: int
     RS_Number: int
-    ScalingFactor: int = 1
+    ScalingFactor: int
+
+    def __init__(self):
+        self.Dose_POI_UID = 0
+        self.ScalingFactor = 1
 
     def __repr__(self):
         return self.Name
@@ -495,6 +1307,7 @@ class DoseSpecificationPointClass(BaseMethod):
 
 
 class PrescriptionClass(BaseMethod):
+    _interned_attributes = ('PrescriptionType',)
     Prescription_UID: int = 0
     DoseAbsoluteVolume_cc: float
     DoseValue_cGy: float
@@ -509,6 +1322,10 @@ class PrescriptionClass(BaseMethod):
 
 
 class BeamClass(BaseMethod):
+    __slots__ = ('ArcRotationDirection', 'ArcStopGantryAngle', 'CollimatorAngle', 'BeamMU', 'BeamQualityId',
+                 'CouchRotationAngle', 'DeliveryTechnique', 'Description', 'GantryAngle', 'PlanGenerationTechnique',
+                 'BeamName', 'RS_BeamNumber', 'BeamNumber_UID', 'SSD')
+    _interned_attributes = ('ArcRotationDirection', 'BeamQualityId', 'DeliveryTechnique', 'PlanGenerationTechnique')
     ArcRotationDirection: str or None
     ArcStopGantryAngle: float
     CollimatorAngle: float
@@ -521,14 +1338,19 @@ class BeamClass(BaseMethod):
     PlanGenerationTechnique: str
     BeamName: str
     RS_BeamNumber: int
-    BeamNumber_UID: int = 0
-    SSD: float = -1.0  # Defaults to -1, can only be defined if an external ROI is present
+    BeamNumber_UID: int
+    SSD: float  # Defaults to -1, can only be defined if an external ROI is present
+
+    def __init__(self):
+        self.BeamNumber_UID = 0
+        self.SSD = -1.0
 
     def __repr__(self):
         return self.Description
 
 
 class MachineReferenceClass(BaseMethod):
+    _interned_attributes = ('MachineName',)
     MachineName: str
     CommissioningTime: DateTimeClass or None
 
@@ -551,6 +1373,7 @@ class FractionDoseClass(BaseMethod):
 
 
 class BeamSetClass(BaseMethod):
+    _interned_attributes = ('PlanIntent', 'PlanGenerationTechnique', 'Modality')
     NumberOfFractions: int = 1
     RS_BeamNumber: int  # The number of beam held in RS, starts in each plan
     BeamSetUID: int = 0
@@ -583,6 +1406,7 @@ class PlanOptimizationClass(BaseMethod):
 
 
 class ReviewClass(BaseMethod):
+    _interned_attributes = ('ApprovalStatus', 'ReviewerName')
     ApprovalStatus: str  # Approval status
     ReviewerName: str  # The credentials of the reviewer
     ReviewTime: DateTimeClass  # The datetime when the review was performed
@@ -592,6 +1416,7 @@ class ReviewClass(BaseMethod):
 
 
 class TreatmentPlanClass(BaseMethod):
+    _interned_attributes = ('PlannedBy',)
     PlanName: str
     PlannedBy: str or None
     TreatmentPlan_UID: int = 0
@@ -615,6 +1440,7 @@ class RegistrationClass(BaseMethod):
 
 
 class CaseClass(BaseMethod):
+    _interned_attributes = ('BodySite',)
     CaseName: str
     Case_UID: int = 0
     BodySite: str
@@ -634,14 +1460,8 @@ class CaseClass(BaseMethod):
         self.HadDeformableReg = False
 
     def delete_unapproved_plans(self):
-        for tp in self.TreatmentPlans[:]:
-            if tp.Review is None:
-                self.TreatmentPlans.remove(tp)
-            else:
-                review: ReviewClass
-                review = tp.Review
-                if review.ApprovalStatus != "Approved":
-                    self.TreatmentPlans.remove(tp)
+        self.TreatmentPlans = [tp for tp in self.TreatmentPlans
+                               if tp.Review is not None and tp.Review.ApprovalStatus == "Approved"]
 
     def add_all_treatment_plans(self, rs_case):
         pass
@@ -651,6 +1471,7 @@ class CaseClass(BaseMethod):
 
 
 class TreatmentNoteClass(BaseMethod):
+    _interned_attributes = ('StaffFirstName', 'StaffLastName')
     DateLastEdited: ReducedDateTimeClass
     Note: str
     StaffFirstName: str
@@ -661,6 +1482,7 @@ class TreatmentNoteClass(BaseMethod):
 
 
 class QCLClass(BaseMethod):
+    _interned_attributes = ('ResponsibleStaff', 'CompletedStaff')
     Description: str
     CreatedTime: ReducedDateTimeClass
     CompletedTime: ReducedDateTimeClass or None
@@ -692,6 +1514,7 @@ class PatientClass(BaseMethod):
     TreatmentNotes: List[TreatmentNoteClass]
     FilePath: Union[str, bytes, os.PathLike]
     QCL_List: QCLListClass
+    _content_hash_exclude = ("QCLs", "QCL_List")  # the QCLs live in their own file, see save_to_directory
 
     def __init__(self):
         self.Name_First = ''
@@ -720,12 +1543,10 @@ class PatientClass(BaseMethod):
         """
         for case in self.Cases:
             case.delete_unapproved_plans()
-        for case in self.Cases[:]:
-            """
-            If the case has no treatment plans left, means there are none that are approved, delete
-            """
-            if len(case.TreatmentPlans) == 0:
-                self.Cases.remove(case)
+        """
+        If the case has no treatment plans left, means there are none that are approved, delete
+        """
+        self.Cases = [case for case in self.Cases if len(case.TreatmentPlans) > 0]
 
     def save_header_to_directory(self, directory_path):
         patient_header = PatientHeader()
@@ -740,30 +1561,68 @@ class PatientClass(BaseMethod):
         out_file_name = f"{self.RS_UID}_{self.return_date_time_string_last_modified()}.json"
         return out_file_name
 
-    def save_to_directory(self, directory_path):
-        out_file_name = self.return_out_file_name()
+    def save_to_directory(self, directory_path, skip_unchanged: bool = False,
+                          codec: Optional[Union[str, JsonCodec]] = None, compression: Optional[str] = None,
+                          compression_level: Optional[int] = None) -> bool:
+        """
+        :param directory_path:
+        :param skip_unchanged: leave the patient and header files alone if the header already there carries the same
+        ContentHash (QCLs are still written)
+        :param codec: the JsonCodec (or its name) writing the files
+        :param compression: None, 'gz', or 'xz' for all three files, copies written with another compression are removed
+        :param compression_level: defaults to DEFAULT_COMPRESSION_LEVELS
+        :return: False if the patient was skipped as unchanged
+        """
+        codec = return_json_codec(codec)
+        if self.__dict__.get('_projection') is not None:
+            raise ValueError(f"{self.RS_UID} was loaded with only some fields, saving it would lose the rest")
+        out_file_name = return_compressed_file_name(self.return_out_file_name(), compression)
         out_file = os.path.join(directory_path, out_file_name)
-        self.to_json_file(out_file, exclude=["QCLs", "QCL_List"])
+        header_file = out_file.replace('.json', '_Header.json')
+        patient_dict = self.to_dict(exclude=["QCLs", "QCL_List"])
+        patient_dict[FORMAT_VERSION_KEY] = JSON_FORMAT_VERSION
+        """
+        The header is cut from this dictionary instead of building a PatientHeader from the objects
+        """
+        header_dict = return_header_dict(patient_dict)
+        header_dict['ContentHash'] = return_content_hash(patient_dict)
+        written = True
+        if skip_unchanged and os.path.exists(out_file) and os.path.exists(header_file):
+            try:
+                written = codec.read_file(header_file).get('ContentHash') != header_dict['ContentHash']
+            except FILE_READ_ERRORS:
+                pass  # A damaged header counts as changed, the files are rewritten
+        if written:
+            codec.write_file(out_file, patient_dict, compression_level)
+            remove_other_compressions(out_file)
         if hasattr(self, 'QCLs'):
             for qcl in self.QCLs:
                 self.QCL_List.QCLs.append(qcl)
         if self.QCL_List.QCLs:
-            out_file_name = out_file_name.replace('.json', 'QCLs.json')
-            self.QCL_List.to_json_file(os.path.join(directory_path, out_file_name))
-        self.save_header_to_directory(directory_path)
-        if os.path.exists(out_file.replace(".json", ".txt")):
-            os.remove(out_file.replace(".json", ".txt"))
-
-    def load_qcls(self):
-        json_file = self.FilePath.replace('.json', 'QCLs.json')
-        if os.path.exists(json_file):
-            self.QCL_List = QCLListClass.from_json_file(json_file)
+            qcl_file = os.path.join(directory_path, out_file_name.replace('.json', 'QCLs.json'))
+            self.QCL_List.to_json_file(qcl_file, codec=codec, compression_level=compression_level)
+            remove_other_compressions(qcl_file)
+        if written:
+            codec.write_file(header_file, header_dict, compression_level)
+            remove_other_compressions(header_file)
+        text_file = return_json_stem(out_file).replace(".json", ".txt")
+        if os.path.exists(text_file):
+            os.remove(text_file)
+        return written
+
+    def return_qcl_file_path(self):
+        return self.FilePath.replace('.json', 'QCLs.json')
+
+    def load_qcls(self, codec: Optional[Union[str, JsonCodec]] = None):
+        for json_file in return_existing_files([self.return_qcl_file_path()], any_compression=True):
+            self.QCL_List = QCLListClass.from_json_file(json_file, codec=codec)
 
     def __repr__(self):
         return self.MRN
 
 
 class StrippedDownPlan(BaseMethod):
+    _interned_attributes = ('PlannedBy',)
     PlanName: str
     PlannedBy: str or None
     Review: ReviewClass or None
@@ -780,6 +1639,8 @@ class StrippedDownPlan(BaseMethod):
 
 
 class StrippedDownRegionOfInterest(BaseMethod):
+    __slots__ = ('Name', 'Type')
+    _interned_attributes = ('Name', 'Type')
     Name: str
     Type: str
 
@@ -788,6 +1649,7 @@ class StrippedDownRegionOfInterest(BaseMethod):
 
 
 class StrippedDownCase(BaseMethod):
+    _interned_attributes = ('BodySite', 'POIS')
     CaseName: str
     BodySite: str
     ROIS: List[StrippedDownRegionOfInterest]
@@ -800,14 +1662,8 @@ class StrippedDownCase(BaseMethod):
         self.TreatmentPlans = []
 
     def delete_unapproved_plans(self):
-        for tp in self.TreatmentPlans[:]:
-            if tp.Review is None:
-                self.TreatmentPlans.remove(tp)
-            else:
-                review: ReviewClass
-                review = tp.Review
-                if review.ApprovalStatus != "Approved":
-                    self.TreatmentPlans.remove(tp)
+        self.TreatmentPlans = [tp for tp in self.TreatmentPlans
+                               if tp.Review is not None and tp.Review.ApprovalStatus == "Approved"]
 
     def build(self, case: CaseClass):
         self.CaseName = case.CaseName
@@ -839,6 +1695,7 @@ class PatientHeader(BaseMethod):
     TreatmentNotes: List[TreatmentNoteClass]
     QCL_List: QCLListClass
     DateOfBirth: DateTimeClass
+    ContentHash: str  # content_hash of the patient file this header was cut from, see PatientClass.save_to_directory
 
     def __init__(self):
         self.Cases = []
@@ -866,28 +1723,30 @@ class PatientHeader(BaseMethod):
         """
         for case in self.Cases:
             case.delete_unapproved_plans()
-        for case in self.Cases[:]:
-            """
-            If the case has no treatment plans left, means there are none that are approved, delete
-            """
-            if len(case.TreatmentPlans) == 0:
-                self.Cases.remove(case)
+        """
+        If the case has no treatment plans left, means there are none that are approved, delete
+        """
+        self.Cases = [case for case in self.Cases if len(case.TreatmentPlans) > 0]
 
-    def save_to_directory(self, directory_path):
+    def save_to_directory(self, directory_path, codec: Optional[Union[str, JsonCodec]] = None,
+                          compression: Optional[str] = None, compression_level: Optional[int] = None):
         last_mod = self.DateLastModified
         out_file_name = (f"{self.RS_UID}_"
                          f"{last_mod.year}.{last_mod.month}.{last_mod.day}.{last_mod.hour}.{last_mod.minute}")
         out_file_name += "_Header.json"
-        out_file = os.path.join(directory_path, out_file_name)
-        self.to_json_file(out_file, exclude=["QCLs", "QCL_List"])
+        out_file = os.path.join(directory_path, return_compressed_file_name(out_file_name, compression))
+        self.to_json_file(out_file, exclude=["QCLs", "QCL_List"], codec=codec, compression_level=compression_level)
+        remove_other_compressions(out_file)
         """
         Exclude this from the json file as well, specifically load if wanted
         """
 
-    def load_qcls(self):
-        json_file = self.FilePath.replace('_Header.json', 'QCLs.json')
-        if os.path.exists(json_file):
-            self.QCL_List = QCLListClass.from_json_file(json_file)
+    def return_qcl_file_path(self):
+        return self.FilePath.replace('_Header.json', 'QCLs.json')
+
+    def load_qcls(self, codec: Optional[Union[str, JsonCodec]] = None):
+        for json_file in return_existing_files([self.return_qcl_file_path()], any_compression=True):
+            self.QCL_List = QCLListClass.from_json_file(json_file, codec=codec)
 
     def build(self, patient: PatientClass):
         self.MRN = patient.MRN
@@ -915,15 +1774,886 @@ class PatientHeader(BaseMethod):
         return self.MRN
 
 
+def _project_dict(cls, source_dict: dict) -> dict:
+    """
+    The attributes of cls found in an encoded dictionary of another class, in the order cls would write them
+    """
+    plan = cls.return_serializer_plan()
+    projected_dict = {plan.Marker: True}
+    for attribute, encoder in plan.Encoders:
+        if attribute in source_dict:
+            projected_dict[attribute] = source_dict[attribute]
+    return projected_dict
+
+
+def return_header_dict(patient_dict: dict) -> dict:
+    """
+    The encoded PatientHeader of an encoded PatientClass, what PatientHeader.build followed by to_json would
+    give for the same patient (without QCLs, which the header file never holds)
+    :param patient_dict: PatientClass.to_dict output
+    :return:
+    """
+    header_dict = _project_dict(PatientHeader, patient_dict)
+    header_dict.pop('FilePath', None)
+    header_dict.pop('QCL_List', None)
+    cases = []
+    for case_dict in patient_dict.get('Cases', []):
+        stripped_case = _project_dict(StrippedDownCase, case_dict)
+        stripped_case['ROIS'] = [_project_dict(StrippedDownRegionOfInterest, i) for i in case_dict['Base_ROIs']]
+        stripped_case['POIS'] = [i['Name'] for i in case_dict['Base_POIs']]
+        stripped_case['TreatmentPlans'] = [_project_dict(StrippedDownPlan, i) for i in case_dict['TreatmentPlans']]
+        cases.append(stripped_case)
+    header_dict['Cases'] = cases
+    header_dict['TreatmentNotes'] = [_project_dict(TreatmentNoteClass, i)
+                                     for i in patient_dict.get('TreatmentNotes', [])]
+    header_dict[FORMAT_VERSION_KEY] = JSON_FORMAT_VERSION
+    return header_dict
+
+
+class LoadReport(BaseMethod):
+    """
+    What a run_pipeline call did, Failures maps each failed item (usually a file path) to its error
+    """
+    Description: str
+    WorkerKind: str
+    WorkerCount: int
+    Total: int
+    Succeeded: int
+    Failures: Dict[str, str]
+    Seconds: float
+    Rejected: int  # Read without error but turned away by a LoadPredicate, counted in Succeeded as well
+
+    def __init__(self, description: str = ''):
+        self.Description = description
+        self.WorkerKind = 'serial'
+        self.WorkerCount = 1
+        self.Total = 0
+        self.Succeeded = 0
+        self.Failures = {}
+        self.Seconds = 0.0
+        self.Rejected = 0
+
+    def add_failure(self, item, error):
+        self.Failures[str(item)] = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+
+    def merge(self, other: 'LoadReport') -> 'LoadReport':
+        """
+        Add the counts, failures, and time of other, a report of further items of the same load, to this one
+        """
+        self.Total += other.Total
+        self.Succeeded += other.Succeeded
+        self.Rejected += other.Rejected
+        self.Failures.update(other.Failures)
+        self.Seconds += other.Seconds
+        if other.Total and other.WorkerCount >= self.WorkerCount:
+            self.WorkerKind = other.WorkerKind
+            self.WorkerCount = other.WorkerCount
+        return self
+
+    def return_throughput(self) -> float:
+        if self.Seconds == 0:
+            return 0.0
+        return self.Succeeded / self.Seconds
+
+    def __repr__(self):
+        return (f"{self.Description}: {self.Succeeded} of {self.Total} in {self.Seconds:.1f}s "
+                f"({self.return_throughput():.1f}/s, {self.WorkerCount} {self.WorkerKind}), "
+                f"{len(self.Failures)} failed" + (f", {self.Rejected} rejected" if self.Rejected else ""))
+
+
+def return_worker_count():
+    return max([int(cpu_count() * 0.8 - 1), 1])
+
+
+def _run_pipeline_chunk(work_function, chunk: list) -> list:
+    """
+    Runs inside of a worker process, errors are sent back as text so one bad file does not lose the chunk
+    """
+    results = []
+    for item in chunk:
+        try:
+            results.append((True, work_function(item)))
+        except Exception as e:
+            results.append((False, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def run_pipeline(items: list, work_function, result_function=None, worker_count: Optional[int] = None,
+                 worker_kind: str = 'thread', queue_size: Optional[int] = None, chunk_size: int = 32, pbar=None,
+                 description: str = '') -> LoadReport:
+    """
+    The one producer/consumer loop used by the loaders, QCL readers, and file copies
+    :param items: work items, usually file paths
+    :param work_function: called with each item, returns a result. For 'process' it must be a module level function
+    :param result_function: called with (item, result) in this process, for example to place a patient in a dict
+    :param worker_count: defaults to 80% of the cpu count, at least 1
+    :param worker_kind: 'thread', 'process', or 'serial'
+    :param queue_size: most items (threads) or chunks (processes) waiting at once, defaults to twice the workers
+    :param chunk_size: items sent to a worker process at a time
+    :param pbar: a tqdm progress bar, updated per item
+    :param description:
+    :return: a LoadReport with the counts, time, and every failure
+    """
+    report = LoadReport(description)
+    report.Total = len(items)
+    if not load_parallel:
+        worker_kind = 'serial'
+    if worker_kind == 'serial':
+        worker_count = 1
+    elif worker_count is None:
+        worker_count = return_worker_count()
+    if queue_size is None:
+        queue_size = 2 * worker_count
+    report.WorkerKind = worker_kind
+    report.WorkerCount = worker_count
+    start_time = time.time()
+    if worker_kind == 'serial':
+        for item in items:
+            try:
+                result = work_function(item)
+                if result_function is not None:
+                    result_function(item, result)
+                report.Succeeded += 1
+            except Exception as e:
+                report.add_failure(item, e)
+            if pbar is not None:
+                pbar.update()
+    elif worker_kind == 'thread':
+        q = Queue(maxsize=queue_size)
+        lock = Lock()
+
+        def worker():
+            while True:
+                work_item = q.get()
+                if work_item is None:
+                    q.task_done()
+                    break
+                try:
+                    work_result = work_function(work_item)
+                    with lock:
+                        if result_function is not None:
+                            result_function(work_item, work_result)
+                        report.Succeeded += 1
+                except Exception as error:
+                    with lock:
+                        report.add_failure(work_item, error)
+                finally:
+                    if pbar is not None:
+                        with lock:
+                            pbar.update()
+                    q.task_done()
+
+        threads = []
+        for _ in range(worker_count):
+            t = Thread(target=worker)
+            t.start()
+            threads.append(t)
+        for item in items:
+            q.put(item)
+        for _ in range(worker_count):
+            q.put(None)
+        for t in threads:
+            t.join()
+    elif worker_kind == 'process':
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        with ProcessPoolExecutor(max_workers=worker_count) as executor:
+            pending = {}
+            chunk_index = 0
+            while chunk_index < len(chunks) or pending:
+                while chunk_index < len(chunks) and len(pending) < queue_size:
+                    future = executor.submit(_run_pipeline_chunk, work_function, chunks[chunk_index])
+                    pending[future] = chunks[chunk_index]
+                    chunk_index += 1
+                done, _ = wait(list(pending.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = pending.pop(future)
+                    try:
+                        chunk_results = future.result()
+                    except Exception as e:
+                        chunk_results = [(False, f"{type(e).__name__}: {e}")] * len(chunk)
+                    for item, (succeeded, result) in zip(chunk, chunk_results):
+                        if succeeded:
+                            try:
+                                if result_function is not None:
+                                    result_function(item, result)
+                                report.Succeeded += 1
+                            except Exception as e:
+                                report.add_failure(item, e)
+                        else:
+                            report.add_failure(item, result)
+                    if pbar is not None:
+                        pbar.update(len(chunk))
+    else:
+        raise ValueError(f"worker_kind must be 'thread', 'process', or 'serial', not {worker_kind}")
+    report.Seconds = time.time() - start_time
+    if report.Failures:
+        print(report)
+    return report
+
+
+def iterate_pipeline(items: list, work_function, worker_count: Optional[int] = None, worker_kind: str = 'thread',
+                     prefetch: Optional[int] = None, chunk_size: int = 8, report: Optional[LoadReport] = None):
+    """
+    run_pipeline as a generator, results come back in the order of items with at most prefetch of them read ahead,
+    so a full pass over a cohort holds only a handful of patients at a time
+    :param items: work items, usually file paths
+    :param work_function: called with each item. For 'process' it must be a module level function
+    :param worker_count: defaults to 80% of the cpu count, at least 1
+    :param worker_kind: 'thread', 'process', or 'serial'
+    :param prefetch: most results read ahead of the consumer, defaults to twice the workers
+    :param chunk_size: items sent to a worker process at a time
+    :param report: optional LoadReport, filled in as the generator runs; failed items are recorded and skipped
+    :return: a generator of (item, result)
+    """
+    if report is None:
+        report = LoadReport()
+    report.Total = len(items)
+    if not load_parallel:
+        worker_kind = 'serial'
+    if worker_kind == 'serial':
+        worker_count = 1
+    elif worker_count is None:
+        worker_count = return_worker_count()
+    if prefetch is None:
+        prefetch = 2 * worker_count
+    report.WorkerKind = worker_kind
+    report.WorkerCount = worker_count
+    start_time = time.time()
+    if worker_kind == 'serial':
+        for item in items:
+            try:
+                result = work_function(item)
+            except Exception as e:
+                report.add_failure(item, e)
+                continue
+            report.Succeeded += 1
+            report.Seconds = time.time() - start_time
+            yield item, result
+        return None
+    if worker_kind == 'thread':
+        executor = ThreadPoolExecutor(max_workers=worker_count)
+        chunks = [[i] for i in items]
+        in_flight = max([prefetch, 1])
+    elif worker_kind == 'process':
+        executor = ProcessPoolExecutor(max_workers=worker_count)
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        in_flight = max([prefetch // chunk_size, 1])
+    else:
+        raise ValueError(f"worker_kind must be 'thread', 'process', or 'serial', not {worker_kind}")
+    pending = deque()
+    chunk_index = 0
+    try:
+        while chunk_index < len(chunks) or pending:
+            while chunk_index < len(chunks) and len(pending) < in_flight:
+                pending.append((chunks[chunk_index],
+                                executor.submit(_run_pipeline_chunk, work_function, chunks[chunk_index])))
+                chunk_index += 1
+            chunk, future = pending.popleft()
+            try:
+                chunk_results = future.result()
+            except Exception as e:
+                chunk_results = [(False, f"{type(e).__name__}: {e}")] * len(chunk)
+            for item, (succeeded, result) in zip(chunk, chunk_results):
+                if not succeeded:
+                    report.add_failure(item, result)
+                    continue
+                report.Succeeded += 1
+                report.Seconds = time.time() - start_time
+                yield item, result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def return_database_directories(path_to_database_directories: Union[str, bytes, os.PathLike],
+                                specific_folders: Optional[List[str]] = None) -> List[str]:
+    database_directories = []
+    for root, database_directories, files in os.walk(path_to_database_directories):
+        break
+    if specific_folders:
+        database_directories = [i for i in database_directories if i in specific_folders]
+    return database_directories
+
+
+def return_date_tuple(date_time) -> Optional[tuple]:
+    """
+    (year, month, day, hour, minute, second) of a DateTimeClass, datetime, its encoded dictionary, or a tuple
+    """
+    if date_time is None:
+        return None
+    if isinstance(date_time, (str, bytes)):
+        date_time = json.loads(date_time)
+    if isinstance(date_time, (tuple, list)):
+        return tuple(date_time) + (0, 1, 1, 0, 0, 0)[len(date_time):]
+    if isinstance(date_time, dict):
+        return (date_time.get('year', 0), date_time.get('month', 1), date_time.get('day', 1),
+                date_time.get('hour', 0), date_time.get('minute', 0), date_time.get('second', 0))
+    return (getattr(date_time, 'year', 0), getattr(date_time, 'month', 1), getattr(date_time, 'day', 1),
+            getattr(date_time, 'hour', 0), getattr(date_time, 'minute', 0), getattr(date_time, 'second', 0))
+
+
+def _return_decoded(value):
+    """
+    Version 1 files nest child objects as json strings
+    """
+    if isinstance(value, (str, bytes)):
+        return json.loads(value)
+    return value
+
+
+class LoadPredicate(object):
+    """
+    Which patients, cases, and plans a load keeps, checked against the header file before the patient file is read,
+    and against the decoded json before any object is built, so rejected cases and plans are never constructed
+    :param approved_only: keep only approved plans, and the cases that have one
+    :param body_sites: keep only cases with one of these body sites, any case
+    :param modified_after: keep only patients whose DateLastModified is on or after this (DateTimeClass, datetime,
+    or a tuple starting with the year)
+    :param modified_before: keep only patients whose DateLastModified is on or before this
+    :param roi_names: keep only cases that have every one of these ROI names, any case
+    A patient left without cases by approved_only, body_sites, or roi_names is rejected
+    """
+    def __init__(self, approved_only: bool = False, body_sites: Optional[List[str]] = None,
+                 modified_after=None, modified_before=None, roi_names: Optional[List[str]] = None):
+        self.ApprovedOnly = approved_only
+        self.BodySites = None if body_sites is None else {i.lower() for i in body_sites}
+        self.ModifiedAfter = return_date_tuple(modified_after)
+        self.ModifiedBefore = return_date_tuple(modified_before)
+        self.ROINames = None if roi_names is None else {i.lower() for i in roi_names}
+
+    def filters_cases(self) -> bool:
+        return self.ApprovedOnly or self.BodySites is not None or self.ROINames is not None
+
+    def accepts_date(self, date_values: Optional[tuple]) -> bool:
+        if date_values is None:
+            return self.ModifiedAfter is None and self.ModifiedBefore is None
+        if self.ModifiedAfter is not None and date_values < self.ModifiedAfter:
+            return False
+        if self.ModifiedBefore is not None and date_values > self.ModifiedBefore:
+            return False
+        return True
+
+    def _accepts_case(self, body_site: Optional[str], roi_names) -> bool:
+        if self.BodySites is not None and (body_site or '').lower() not in self.BodySites:
+            return False
+        if self.ROINames is not None and not self.ROINames.issubset({(i or '').lower() for i in roi_names}):
+            return False
+        return True
+
+    def filter_data(self, data: dict) -> Optional[dict]:
+        """
+        Prune the decoded json of a patient or header in place
+        :return: data, or None if the patient is rejected
+        """
+        if not self.accepts_date(return_date_tuple(data.get('DateLastModified'))):
+            return None
+        if not self.filters_cases() or 'Cases' not in data:
+            return data
+        cases = []
+        for case in data['Cases']:
+            case = _return_decoded(case)
+            rois = case.get('Base_ROIs', case.get('ROIS')) or []
+            if not self._accepts_case(case.get('BodySite'), [_return_decoded(i).get('Name') for i in rois]):
+                continue
+            if self.ApprovedOnly:
+                plans = []
+                for plan in case.get('TreatmentPlans') or []:
+                    plan = _return_decoded(plan)
+                    review = _return_decoded(plan.get('Review'))
+                    if review is not None and review.get('ApprovalStatus') == "Approved":
+                        plans.append(plan)
+                if not plans:
+                    continue
+                case['TreatmentPlans'] = plans
+            cases.append(case)
+        if not cases:
+            return None
+        data['Cases'] = cases
+        return data
+
+    def filter_object(self, patient: PatientClass or PatientHeader) -> bool:
+        """
+        The same pruning on an already built patient or header, for loads that do not go through json
+        :return: False if the patient is rejected
+        """
+        if not self.accepts_date(return_date_tuple(getattr(patient, 'DateLastModified', None))):
+            return False
+        if not self.filters_cases():
+            return True
+        cases = []
+        for case in patient.Cases:
+            rois = case.Base_ROIs if hasattr(case, 'Base_ROIs') else case.ROIS
+            if not self._accepts_case(getattr(case, 'BodySite', None), [getattr(i, 'Name', None) for i in rois]):
+                continue
+            if self.ApprovedOnly:
+                case.delete_unapproved_plans()
+                if not case.TreatmentPlans:
+                    continue
+            cases.append(case)
+        patient.Cases = cases
+        return len(cases) > 0
+
+
+def _load_json_file(file: str, cls, symbol_table: Optional[SymbolTable], predicate: Optional[LoadPredicate],
+                    description: str, fields=None, codec: Optional[Union[str, JsonCodec]] = None):
+    """
+    :return: the object, or None if the predicate rejected it
+    """
+    data = return_json_codec(codec).read_file(file)
+    if predicate is not None:
+        data = predicate.filter_data(data)
+        if data is None:
+            return None
+    previous = set_decode_symbol_table(symbol_table)
+    try:
+        loaded = cls.from_json(data, fields)
+    finally:
+        set_decode_symbol_table(previous)
+    if loaded is None:
+        raise ValueError(f"{file} is not a {description}")
+    loaded.FilePath = file
+    if fields is not None:
+        loaded.__dict__['_projection'] = fields  # Partial objects must not be saved over their file
+    return loaded
+
+
+def load_patient_file(file: str, symbol_table: Optional[SymbolTable] = None,
+                      predicate: Optional[LoadPredicate] = None, fields=None,
+                      codec: Optional[Union[str, JsonCodec]] = None) -> Optional[PatientClass]:
+    """
+    :param file:
+    :param symbol_table:
+    :param predicate: checked against the patient's header file first, if it has one, then against the patient json
+    :param fields: attribute paths (or a FieldProjection) limiting what is built, see FieldProjection
+    :param codec: the JsonCodec (or its name) reading the files
+    :return: the patient, or None if the predicate rejected it
+    """
+    if predicate is not None:
+        try:
+            header_data = return_json_codec(codec).read_file(file.replace('.json', '_Header.json'))
+        except FileNotFoundError:
+            header_data = None
+        if header_data is not None and predicate.filter_data(header_data) is None:
+            return None
+    return _load_json_file(file, PatientClass, symbol_table, predicate, 'patient file', fields, codec)
+
+
+def load_patient_header_file(file: str, symbol_table: Optional[SymbolTable] = None,
+                             predicate: Optional[LoadPredicate] = None,
+                             codec: Optional[Union[str, JsonCodec]] = None) -> Optional[PatientHeader]:
+    return _load_json_file(file, PatientHeader, symbol_table, predicate, 'patient header file', codec=codec)
+
+
+def return_interning_loader(load_function, symbol_table: SymbolTable, load_mode: str, **load_arguments):
+    """
+    load_function bound to symbol_table, except for processes, whose results are interned once back in this process
+    rather than shipping the table to every worker
+    :param load_arguments: further keywords to bind (predicate, fields, codec), None values are left out
+    """
+    load_arguments = {key: value for key, value in load_arguments.items() if value is not None}
+    if load_mode != 'process':
+        load_arguments['symbol_table'] = symbol_table
+    if not load_arguments:
+        return load_function
+    return partial(load_function, **load_arguments)
+
+
+def save_patient_to_directory(patient: PatientClass, directory_path: Union[str, bytes, os.PathLike],
+                              skip_unchanged: bool = False, codec: Optional[Union[str, JsonCodec]] = None,
+                              compression: Optional[str] = None, compression_level: Optional[int] = None) -> bool:
+    return patient.save_to_directory(directory_path, skip_unchanged, codec, compression, compression_level)
+
+
+def load_qcl_file(file: str, codec: Optional[Union[str, JsonCodec]] = None) -> Optional[QCLListClass]:
+    try:
+        return QCLListClass.from_json_file(file, codec=codec)
+    except FileNotFoundError:
+        return None
+
+
+def return_canonical_mrn(mrn) -> str:
+    """
+    MRNs are stored zero padded to different widths, '00012345', '012345' and '12345' are the same patient
+    """
+    mrn = str(mrn).strip()
+    return mrn.lstrip('0') or mrn[:1]
+
+
+def return_file_date_key(file_name: str) -> tuple:
+    """
+    (year, month, day, hour, minute) from a '<RS_UID>_<year.month.day.hour.minute>...' file name, for ordering the
+    versions of a patient: the parts are not zero padded, so the names do not sort by date as strings
+    """
+    date_string = return_json_stem(os.path.basename(file_name)).replace('QCLs.json', '').replace('_Header.json', '')
+    date_string = date_string.replace('.json', '').split('_')[-1]
+    try:
+        return tuple(int(i) for i in date_string.split('.'))
+    except ValueError:
+        return ()
+
+
+class DirectoryCatalog(object):
+    """
+    One os.scandir pass over a database folder: the size and modification time of every json file (compressed or
+    not) and pack file, and the patient, header and QCL files of each patient paired by name and keyed by canonical MRN
+    Pairing goes by the stem of each name, so a compressed header finds its patient file whatever its compression
+    A pack file gets a catalog of its own, listing the files inside of it
+    Every load, QCL, and sync path asks the catalog instead of listing or stating the folder itself
+    """
+    DirectoryPath: str
+    DirectoryMTime: int
+    Files: Dict[str, tuple]
+    PackFiles: Dict[str, tuple]
+    Stems: Dict[str, str]
+    PatientFiles: Dict[str, List[str]]
+    HeaderFiles: Dict[str, List[str]]
+    QCLFiles: Set[str]
+
+    def __init__(self, directory_path: Union[str, bytes, os.PathLike], files: Optional[Dict[str, tuple]] = None):
+        """
+        :param directory_path:
+        :param files: name to (size, modification time) of the files, given instead of scanning the folder
+        """
+        self.DirectoryPath = os.fspath(directory_path)
+        self.DirectoryMTime = os.stat(self.DirectoryPath).st_mtime_ns
+        self.Files = {}
+        self.PackFiles = {}
+        if files is not None:
+            self.Files = dict(files)
+        else:
+            with os.scandir(self.DirectoryPath) as entries:
+                for entry in entries:
+                    if entry.name.endswith(JSON_FILE_SUFFIXES) and entry.is_file():
+                        stat = entry.stat()
+                        self.Files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                    elif entry.name.endswith(PACK_SUFFIX) and entry.is_file():
+                        stat = entry.stat()
+                        self.PackFiles[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        """
+        Two compressions of one file only coexist if a save was interrupted, the newer one is the one to read
+        """
+        self.Stems = {}
+        for file_name, (size, mtime) in self.Files.items():
+            stem = return_json_stem(file_name)
+            current = self.Stems.get(stem)
+            if current is None or mtime > self.Files[current][1]:
+                self.Stems[stem] = file_name
+        self.PatientFiles = {}
+        self.HeaderFiles = {}
+        self.QCLFiles = set()
+        for stem in sorted(self.Stems):
+            file_name = self.Stems[stem]
+            if stem.endswith('QCLs.json'):
+                self.QCLFiles.add(file_name)
+            if not stem.endswith('_Header.json'):
+                continue
+            mrn = return_canonical_mrn("_".join(stem.split('_')[:-2]))
+            self.HeaderFiles.setdefault(mrn, []).append(file_name)
+            patient_file = self.Stems.get(stem.replace('_Header.json', '.json'))
+            if patient_file is not None:
+                self.PatientFiles.setdefault(mrn, []).append(patient_file)
+        """
+        The versions of each patient oldest first by the date in their names
+        """
+        for files_by_mrn in (self.HeaderFiles, self.PatientFiles):
+            for file_names in files_by_mrn.values():
+                file_names.sort(key=return_file_date_key)
+
+    def is_current(self) -> bool:
+        """
+        True while no file was added, renamed or removed, edits in place do not change the folder time
+        """
+        try:
+            return os.stat(self.DirectoryPath).st_mtime_ns == self.DirectoryMTime
+        except OSError:
+            return False
+
+    def __contains__(self, file_name: str) -> bool:
+        return file_name in self.Files
+
+    def return_size(self, file_name: str) -> Optional[int]:
+        if file_name in self.Files:
+            return self.Files[file_name][0]
+        return None
+
+    def return_mtime(self, file_name: str) -> Optional[int]:
+        if file_name in self.Files:
+            return self.Files[file_name][1]
+        return None
+
+    def return_file_name(self, file_name: str) -> Optional[str]:
+        """
+        The name in the folder of file_name under whichever compression it was written with, None if absent
+        """
+        return self.Stems.get(return_json_stem(file_name))
+
+    @staticmethod
+    def _select(files_by_mrn: Dict[str, List[str]], specific_mrns: Optional[List[str]]) -> List[str]:
+        if not specific_mrns:
+            return [file_name for file_names in files_by_mrn.values() for file_name in file_names]
+        wanted_mrns = set(return_canonical_mrn(i) for i in specific_mrns)
+        return [file_name for mrn, file_names in files_by_mrn.items() if mrn in wanted_mrns
+                for file_name in file_names]
+
+    def _select_with_packs(self, attribute: str, specific_mrns: Optional[List[str]]) -> List[str]:
+        """
+        The loose files first, then those in packs (as 'Pack_000001.pack/<name>') of patients with no loose header
+        A patient saved after it was packed is read from its loose files, and a newer pack wins over an older one
+        """
+        file_names = self._select(getattr(self, attribute), specific_mrns)
+        packed_mrns = set(self.HeaderFiles)
+        for pack_name in sorted(self.PackFiles, reverse=True):
+            try:
+                pack_catalog = return_directory_catalog(os.path.join(self.DirectoryPath, pack_name))
+            except (OSError, ValueError) as error:
+                print(f"Skipping {pack_name}: {error}")
+                continue
+            files_by_mrn = {mrn: names for mrn, names in getattr(pack_catalog, attribute).items()
+                            if mrn not in packed_mrns}
+            file_names += [os.path.join(pack_name, i) for i in self._select(files_by_mrn, specific_mrns)]
+            packed_mrns.update(pack_catalog.HeaderFiles)
+        return file_names
+
+    def return_patient_files(self, specific_mrns: Optional[List[str]] = None) -> List[str]:
+        """
+        Names of the patient files that have a header, limited to specific_mrns if given, packed ones included
+        """
+        return self._select_with_packs('PatientFiles', specific_mrns)
+
+    def return_header_files(self, specific_mrns: Optional[List[str]] = None) -> List[str]:
+        return self._select_with_packs('HeaderFiles', specific_mrns)
+
+
+_directory_catalogs: Dict[str, DirectoryCatalog] = {}
+_directory_catalog_lock = Lock()
+
+
+def return_directory_catalog(directory_path: Union[str, bytes, os.PathLike],
+                             refresh: bool = False) -> DirectoryCatalog:
+    """
+    The DirectoryCatalog of a folder (or of a pack file), reused until a file is added, renamed or removed in the folder
+    :param directory_path:
+    :param refresh: scan again even if the folder looks unchanged, for callers that need current sizes and times
+    :return:
+    """
+    key = os.path.abspath(os.fspath(directory_path))
+    if not refresh:
+        with _directory_catalog_lock:
+            catalog = _directory_catalogs.get(key)
+        if catalog is not None and catalog.is_current():
+            return catalog
+    if key.endswith(PACK_SUFFIX):
+        from .PatientPack import return_pack_files
+        catalog = DirectoryCatalog(key, return_pack_files(key))
+    else:
+        catalog = DirectoryCatalog(key)
+    with _directory_catalog_lock:
+        _directory_catalogs[key] = catalog
+    return catalog
+
+
+def clear_directory_catalogs():
+    """
+    Forget every cached DirectoryCatalog, so the next load scans its folders again (cold start timings)
+    """
+    with _directory_catalog_lock:
+        _directory_catalogs.clear()
+
+
+def return_existing_files(file_paths: List[str], any_compression: bool = False) -> List[str]:
+    """
+    The file_paths that exist, answered from the catalog of each folder instead of one stat per file
+    :param file_paths:
+    :param any_compression: also accept the file written with another compression, and return that path instead
+    :return:
+    """
+    catalogs = {}
+    existing_files = []
+    for file_path in file_paths:
+        directory_path, file_name = os.path.split(file_path)
+        if directory_path not in catalogs:
+            try:
+                catalogs[directory_path] = return_directory_catalog(directory_path or '.')
+            except OSError:
+                catalogs[directory_path] = None
+        catalog = catalogs[directory_path]
+        if catalog is None:
+            continue
+        if file_name in catalog:
+            existing_files.append(file_path)
+        elif any_compression and catalog.return_file_name(file_name) is not None:
+            existing_files.append(os.path.join(directory_path, catalog.return_file_name(file_name)))
+    return existing_files
+
+
+class LoadedPatientCache(object):
+    """
+    A least recently used record of which PatientProxy objects currently hold a parsed PatientClass
+    The size of each patient is estimated by the size of its file on disk
+    """
+    def __init__(self, max_patients: Optional[int] = None, max_file_bytes: Optional[int] = None):
+        self.MaxPatients = max_patients
+        self.MaxFileBytes = max_file_bytes
+        self.FileBytes = 0
+        self._proxies = OrderedDict()
+        self._lock = Lock()
+
+    def touch(self, proxy):
+        with self._lock:
+            if id(proxy) in self._proxies:
+                self._proxies.move_to_end(id(proxy))
+                return None
+            self._proxies[id(proxy)] = proxy
+            self.FileBytes += proxy.FileBytes
+            while len(self._proxies) > 1 and self._over_budget():
+                _, evicted = self._proxies.popitem(last=False)
+                self.FileBytes -= evicted.FileBytes
+                evicted.unload()
+
+    def _over_budget(self):
+        if self.MaxPatients is not None and len(self._proxies) > self.MaxPatients:
+            return True
+        if self.MaxFileBytes is not None and self.FileBytes > self.MaxFileBytes:
+            return True
+        return False
+
+    def __len__(self):
+        return len(self._proxies)
+
+
+class PatientProxy(object):
+    """
+    Stands in for a PatientClass in PatientDatabase.Patients, only the file path and header fields are held until
+    anything else is asked for, then the full patient is parsed
+    Changes made to a loaded patient are lost if the LoadedPatientCache evicts it, save them before moving on
+    QCLs set by load_qcls are held by the proxy itself, so they neither load the patient nor go with an eviction
+    A pickled proxy (save_mode='process') takes its parsed patient along, not its lock, cache, or SymbolTable
+    """
+    HeaderAttributes = ('MRN', 'RS_UID', 'Name_First', 'Name_Last', 'Gender', 'DateLastModified', 'DateOfBirth')
+
+    def __init__(self, file_path: Union[str, bytes, os.PathLike], patient_header: Optional[PatientHeader] = None,
+                 loaded_cache: Optional[LoadedPatientCache] = None, symbol_table: Optional[SymbolTable] = None,
+                 fields: Optional[FieldProjection] = None, codec: Optional[Union[str, JsonCodec]] = None):
+        object.__setattr__(self, 'FilePath', file_path)
+        object.__setattr__(self, 'SymbolTable', symbol_table)
+        object.__setattr__(self, 'Fields', fields)
+        object.__setattr__(self, 'Codec', codec)
+        object.__setattr__(self, 'PatientHeader', patient_header)
+        object.__setattr__(self, 'LoadedCache', loaded_cache)
+        file_bytes = 0
+        if loaded_cache is not None:
+            directory_path, file_name = os.path.split(file_path)
+            file_bytes = return_directory_catalog(directory_path or '.').return_size(file_name) or 0
+        object.__setattr__(self, 'FileBytes', file_bytes)
+        object.__setattr__(self, '_patient', None)
+        object.__setattr__(self, '_qcl_list', None)
+        object.__setattr__(self, '_lock', Lock())
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_lock')
+        state['LoadedCache'] = None
+        state['SymbolTable'] = None  # interning is only of use within one process
+        return state
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            object.__setattr__(self, key, value)
+        object.__setattr__(self, '_lock', Lock())
+
+    def is_loaded(self):
+        return self._patient is not None
+
+    def load(self) -> PatientClass:
+        with self._lock:
+            patient = self._patient
+            if patient is None:
+                patient = load_patient_file(self.FilePath, self.SymbolTable, fields=self.Fields, codec=self.Codec)
+                if self._qcl_list is not None:
+                    patient.QCL_List = self._qcl_list
+                object.__setattr__(self, '_patient', patient)
+        if self.LoadedCache is not None:
+            self.LoadedCache.touch(self)
+        return patient
+
+    def unload(self):
+        object.__setattr__(self, '_patient', None)
+
+    def return_qcl_file_path(self):
+        return self.FilePath.replace('.json', 'QCLs.json')
+
+    def content_hash(self, exclude=None) -> str:
+        """
+        Taken from the header when it has one and the patient was not loaded (so could not have been edited), unchanged
+        patients are recognised without being parsed
+        """
+        content_hash = getattr(self.PatientHeader, 'ContentHash', None)
+        if self._patient is None and exclude is None and content_hash:
+            return content_hash
+        return self.load().content_hash(exclude)
+
+    def load_case(self, case_index: int) -> CaseClass:
+        """
+        Return a single case, without building the rest of the patient if it is not already loaded
+        The case is projected by the proxy's Fields and interned into its SymbolTable, as load would build it
+        """
+        if self._patient is not None:
+            return self._patient.Cases[case_index]
+        fields = None
+        projection = return_field_projection(self.Fields, PatientClass)
+        if projection is not None:
+            if not projection.keeps('Cases', PatientClass.return_serializer_plan()):
+                raise IndexError(f"Cases are not among the fields of {self.FilePath}")
+            fields = projection.Children.get('Cases')
+        data = return_json_codec(self.Codec).read_file(self.FilePath)
+        previous = set_decode_symbol_table(self.SymbolTable)
+        try:
+            return CaseClass.from_json(data['Cases'][case_index], fields, self.Codec)
+        finally:
+            set_decode_symbol_table(previous)
+
+    def __getattr__(self, item):
+        """
+        Only reached for attributes the proxy does not hold itself
+        """
+        if item.startswith('__'):
+            raise AttributeError(item)
+        if self._patient is None and self.PatientHeader is not None and item in self.HeaderAttributes:
+            return getattr(self.PatientHeader, item)
+        if self._patient is None and item == 'QCL_List' and self._qcl_list is not None:
+            return self._qcl_list
+        return getattr(self.load(), item)
+
+    def __setattr__(self, key, value):
+        if key == 'QCL_List':
+            object.__setattr__(self, '_qcl_list', value)
+            if self._patient is not None:
+                self._patient.QCL_List = value
+            return None
+        setattr(self.load(), key, value)
+
+    def __repr__(self):
+        if self.PatientHeader is not None:
+            return self.PatientHeader.MRN
+        return os.path.basename(self.FilePath)
+
+
 class PatientDatabase(BaseMethod):
     DBName: str
     Patients: Dict[str, PatientClass]
     Updated: bool
 
-    def __init__(self, dbname):
+    def __init__(self, dbname, codec: Optional[Union[str, JsonCodec]] = None):
+        """
+        :param dbname:
+        :param codec: the JsonCodec (or its name) for every file this database reads and writes, None for the default
+        """
         self.DBName = dbname
         self.Updated = False
         self.Patients = {}
+        self.LoadedCache = None  # Set for lazy databases, see PatientProxy
+        self.LastLoadReport = None
+        self.SymbolTable = SymbolTable()
+        self.Codec = codec
 
     def delete_unapproved_patients(self):
         for key in list(self.Patients.keys()):
@@ -932,99 +2662,122 @@ class PatientDatabase(BaseMethod):
             if len(patient.Cases) == 0:
                 self.Patients.pop(key)
 
-    def load_files(self, potential_files: List[str], tqdm=None):
+    def load_files(self, potential_files: List[str], tqdm=None, load_mode: str = 'thread',
+                   worker_count: Optional[int] = None, predicate: Optional[LoadPredicate] = None,
+                   fields: Optional[List[str]] = None) -> LoadReport:
         """
 
         :param potential_files: A list of full paths to a patient file
         :param tqdm:
-        :return:
+        :param load_mode: 'thread', 'process', or 'serial', processes parse in parallel while threads share the GIL
+        :param worker_count: defaults to 80% of the cpu count
+        :param predicate: patients, cases, and plans to keep, the rest are never built
+        :param fields: attribute paths to include or ('!') exclude, skipped subtrees are never built, and the
+        patients loaded cannot be saved
+        :return: a LoadReport, also kept as LastLoadReport
         """
         pbar = None
         print("Loading from " + self.DBName)
         if tqdm is not None:
             pbar = tqdm(total=len(potential_files), desc='Adding patients from ' + self.DBName)
-        if load_parallel:
-            thread_count = int(cpu_count() * 0.8 - 1)
-            q = Queue(maxsize=thread_count)
-            threads = []
-            a = (q, pbar, self.Patients)
-            for worker in range(thread_count):
-                t = Thread(target=add_patient, args=(a,))
-                t.start()
-                threads.append(t)
-            for file in potential_files:
-                q.put(file)
-            for _ in range(thread_count):
-                q.put(None)
-            for t in threads:
-                t.join()
-        else:
-            for file in potential_files:
-                try:
-                    patient = PatientClass.from_json_file(file)
-                    patient.FilePath = file
-                    self.Patients[patient.RS_UID] = patient
-                except:
-                    continue
-                if pbar is not None:
-                    pbar.update()
-        return None
-
-    def load_qcls(self, tqdm=None):
+        rejected = []
+
+        def add_patient(file, patient: Optional[PatientClass]):
+            if patient is None:
+                rejected.append(file)
+                return None
+            if load_mode == 'process':
+                self.SymbolTable.intern_object(patient)
+            self.Patients[patient.RS_UID] = patient
+
+        self.LastLoadReport = run_pipeline(potential_files,
+                                           return_interning_loader(load_patient_file, self.SymbolTable, load_mode,
+                                                                   predicate=predicate,
+                                                                   fields=return_field_projection(fields,
+                                                                                                  PatientClass),
+                                                                   codec=self.Codec),
+                                           add_patient, worker_count=worker_count, worker_kind=load_mode, pbar=pbar,
+                                           description='Adding patients from ' + self.DBName)
+        self.LastLoadReport.Rejected = len(rejected)
+        return self.LastLoadReport
+
+    def load_qcls(self, tqdm=None, load_mode: str = 'thread') -> LoadReport:
         pbar = None
         if tqdm is not None:
             pbar = tqdm(total=len(self.Patients), desc='Loading QCLs...')
-        if load_parallel:
-            thread_count = int(cpu_count() * 0.8 - 1)
-            q = Queue(maxsize=thread_count)
-            threads = []
-            a = (q, pbar, self.Patients)
-            for worker in range(thread_count):
-                t = Thread(target=load_qcls, args=(a,))
-                t.start()
-                threads.append(t)
-            for mrn in self.Patients.keys():
-                q.put(mrn)
-            for _ in range(thread_count):
-                q.put(None)
-            for t in threads:
-                t.join()
-        else:
-            for pat in self.Patients.values():
-                try:
-                    pat.load_qcls()
-                except:
-                    continue
-                if pbar is not None:
-                    pbar.update()
+        rs_uids = {return_json_stem(pat.return_qcl_file_path()): rs_uid for rs_uid, pat in self.Patients.items()}
 
-    def load_from_directory(self, directory_path: Union[str, bytes, os.PathLike], specific_mrns: List[str] = None,
-                            tqdm=None):
-        patient: PatientClass
-        all_files = [i for i in os.listdir(directory_path) if i.endswith(".json")]
-        header_files = [i for i in all_files if i.endswith('_Header.json')]
-        potential_files = [i.replace('_Header.json', '.json') for i in header_files
-                           if i.replace('_Header.json', '.json') in all_files]
-        if specific_mrns:
-            """
-            If we have a list of specific MRNs to load, just load those patients
-            """
-            wanted_files = []
-            for potential_file in potential_files:
-                pat_mrn = "_".join(potential_file.split('_')[:-1])
-                if pat_mrn in specific_mrns:
-                    wanted_files.append(potential_file)
-                elif pat_mrn.strip('0') in specific_mrns:
-                    wanted_files.append(potential_file)
-                elif max([pat_mrn.zfill(i) in specific_mrns for i in range(len(pat_mrn), max([len(pat_mrn) + 3, 10]))]):
-                    wanted_files.append(potential_file)
-            potential_files = wanted_files
-        potential_files = [os.path.join(directory_path, i) for i in potential_files]
-        self.load_files(potential_files=potential_files, tqdm=tqdm)
+        def set_qcls(file, qcl_list: Optional[QCLListClass]):
+            if qcl_list is not None:
+                self.Patients[rs_uids[return_json_stem(file)]].QCL_List = qcl_list
+
+        return run_pipeline(return_existing_files(list(rs_uids.keys()), any_compression=True),
+                            partial(load_qcl_file, codec=self.Codec),
+                            set_qcls,
+                            worker_kind=load_mode, pbar=pbar,
+                            description='Loading QCLs for ' + self.DBName)
 
-    def save_to_directory(self, directory_path: Union[str, bytes, os.PathLike]):
-        for patient in self.Patients.values():
-            patient.save_to_directory(directory_path)
+    def return_patient_files(self, directory_path: Union[str, bytes, os.PathLike],
+                             specific_mrns: List[str] = None) -> List[str]:
+        """
+        Full paths of the patient files in a folder that have a header, limited to specific_mrns if given
+        """
+        potential_files = return_directory_catalog(directory_path).return_patient_files(specific_mrns)
+        return [os.path.join(directory_path, i) for i in potential_files]
+
+    def load_from_directory(self, directory_path: Union[str, bytes, os.PathLike], specific_mrns: List[str] = None,
+                            tqdm=None, load_mode: str = 'thread', predicate: Optional[LoadPredicate] = None,
+                            fields: Optional[List[str]] = None):
+        potential_files = self.return_patient_files(directory_path, specific_mrns)
+        return self.load_files(potential_files=potential_files, tqdm=tqdm, load_mode=load_mode, predicate=predicate,
+                               fields=fields)
+
+    def iter_patients(self, directory_path: Union[str, bytes, os.PathLike], specific_mrns: List[str] = None,
+                      load_mode: str = 'thread', prefetch: Optional[int] = None, worker_count: Optional[int] = None,
+                      report: Optional[LoadReport] = None):
+        """
+        Visit each patient of a folder once without adding it to Patients, memory stays at about prefetch patients
+        :param directory_path:
+        :param specific_mrns:
+        :param load_mode: 'thread', 'process', or 'serial'
+        :param prefetch: patients parsed ahead of the loop, defaults to twice the workers
+        :param worker_count:
+        :param report: optional LoadReport to collect counts and failures
+        :return: a generator of PatientClass
+        """
+        potential_files = self.return_patient_files(directory_path, specific_mrns)
+        for file, patient in iterate_pipeline(potential_files, partial(load_patient_file, codec=self.Codec),
+                                              worker_count=worker_count, worker_kind=load_mode, prefetch=prefetch,
+                                              report=report):
+            yield patient
+
+    def save_to_directory(self, directory_path: Union[str, bytes, os.PathLike], tqdm=None,
+                          save_mode: str = 'thread', worker_count: Optional[int] = None,
+                          skip_unchanged: bool = False, compression: Optional[str] = None,
+                          compression_level: Optional[int] = None) -> LoadReport:
+        """
+        Write every patient with its QCL and header files, each file is renamed into place once fully written
+        :param directory_path:
+        :param tqdm:
+        :param save_mode: 'thread', 'process', or 'serial', gzip and lzma let go of the GIL so threads compress
+        in parallel
+        :param worker_count:
+        :param skip_unchanged: do not rewrite patients whose header on disk has the same ContentHash
+        :param compression: None, 'gz', or 'xz'
+        :param compression_level: defaults to DEFAULT_COMPRESSION_LEVELS
+        :return: a LoadReport of the patients written and the ones that failed
+        """
+        check_compression(compression)
+        pbar = None
+        if tqdm is not None:
+            pbar = tqdm(total=len(self.Patients), desc='Writing ' + self.DBName)
+        return run_pipeline(list(self.Patients.values()), partial(save_patient_to_directory,
+                                                                  directory_path=directory_path,
+                                                                  skip_unchanged=skip_unchanged,
+                                                                  codec=self.Codec, compression=compression,
+                                                                  compression_level=compression_level),
+                            worker_count=worker_count, worker_kind=save_mode, pbar=pbar,
+                            description='Writing ' + self.DBName)
 
     def __repr__(self):
         return f"{self.DBName} with {len(self.Patients)}"
@@ -1033,9 +2786,17 @@ class PatientHeaderDatabase(BaseMethod):
     DBName: str
     PatientHeaders: Dict[str, PatientHeader]
 
-    def __init__(self, dbname):
+    def __init__(self, dbname, codec: Optional[Union[str, JsonCodec]] = None):
+        """
+        :param dbname:
+        :param codec: the JsonCodec (or its name) for the header files, and for the patients of
+        return_patient_database
+        """
         self.DBName = dbname
         self.PatientHeaders = {}
+        self.LastLoadReport = None
+        self.SymbolTable = SymbolTable()
+        self.Codec = codec
 
     def delete_unapproved_patients(self):
         for key in list(self.PatientHeaders.keys()):
@@ -1044,97 +2805,152 @@ class PatientHeaderDatabase(BaseMethod):
             if len(patient.Cases) == 0:
                 self.PatientHeaders.pop(key)
 
-    def load_files(self, potential_files: List[str], tqdm=None):
+    def load_files(self, potential_files: List[str], tqdm=None, load_mode: str = 'thread',
+                   worker_count: Optional[int] = None, predicate: Optional[LoadPredicate] = None) -> LoadReport:
         pbar = None
         if tqdm is not None:
             pbar = tqdm(total=len(potential_files), desc='Adding patients from ' + self.DBName)
-        if load_parallel:
-            thread_count = int(cpu_count() * 0.8 - 1)
-            q = Queue(maxsize=thread_count)
-            threads = []
-            a = (q, pbar, self.PatientHeaders)
-            for worker in range(thread_count):
-                t = Thread(target=add_patient_header, args=(a,))
-                t.start()
-                threads.append(t)
-            for file in potential_files:
-                q.put(file)
-            for _ in range(thread_count):
-                q.put(None)
-            for t in threads:
-                t.join()
-        else:
-            for file in potential_files:
-                try:
-                    patient_header = PatientHeader.from_json_file(file)
-                    patient_header.FilePath = file
-                    self.PatientHeaders[patient_header.RS_UID] = patient_header
-                except:
-                    continue
-                if pbar is not None:
-                    pbar.update()
+        rejected = []
+
+        def add_patient_header(file, patient_header: Optional[PatientHeader]):
+            if patient_header is None:
+                rejected.append(file)
+                return None
+            if load_mode == 'process':
+                self.SymbolTable.intern_object(patient_header)
+            self.PatientHeaders[patient_header.RS_UID] = patient_header
+
+        self.LastLoadReport = run_pipeline(potential_files, return_interning_loader(load_patient_header_file,
+                                                                                    self.SymbolTable, load_mode,
+                                                                                    predicate=predicate,
+                                                                                    codec=self.Codec),
+                                           add_patient_header, worker_count=worker_count, worker_kind=load_mode,
+                                           pbar=pbar,
+                                           description='Adding patient headers from ' + self.DBName)
+        self.LastLoadReport.Rejected = len(rejected)
+        return self.LastLoadReport
 
     def load_from_directory(self, directory_path: Union[str, bytes, os.PathLike],
-                            specific_mrns: List[str] = None, tqdm=None):
-        patient: PatientHeader
-        potential_files = [i for i in os.listdir(directory_path) if i.endswith("_Header.json")]
-        if specific_mrns:
-            specific_mrns = [str(i) for i in specific_mrns]
+                            specific_mrns: List[str] = None, tqdm=None, load_mode: str = 'thread',
+                            use_cache: bool = False, cache_directory: Optional[Union[str, bytes, os.PathLike]] = None,
+                            predicate: Optional[LoadPredicate] = None):
+        """
+        :param directory_path:
+        :param specific_mrns:
+        :param tqdm:
+        :param load_mode: 'thread', 'process', or 'serial'
+        :param use_cache: read the headers from the binary HeaderCache, re-parsing only new or modified headers
+        :param cache_directory: where to keep the cache, defaults to the database folder itself
+        :param predicate: patients, cases, and plans to keep
+        :return: a LoadReport, also kept as LastLoadReport
+        """
+        potential_files = self.return_header_file_names(directory_path, specific_mrns)
+        print("Loading from " + self.DBName)
+        if use_cache:
+            from .HeaderCache import load_header_database_from_cache
+            load_report = load_header_database_from_cache(self, directory_path, wanted_files=potential_files,
+                                                          cache_directory=cache_directory, tqdm=tqdm,
+                                                          predicate=predicate)
             """
-            If we have a list of specific MRNs to load, just load those patients
+            The cache only holds loose header files, packed ones are read from their packs
             """
-            wanted_files = []
-            for potential_file in potential_files:
-                pat_mrn = "_".join(potential_file.split('_')[:-2])
-                if pat_mrn in specific_mrns:
-                    wanted_files.append(potential_file)
-                elif pat_mrn.strip('0') in specific_mrns or pat_mrn.lstrip('0') in specific_mrns:
-                    wanted_files.append(potential_file)
-                elif max([pat_mrn.zfill(i) in specific_mrns for i in range(len(pat_mrn), max([len(pat_mrn) + 3, 10]))]):
-                    wanted_files.append(potential_file)
-            potential_files = wanted_files
-        print("Loading from " + self.DBName)
+            packed_files = [os.path.join(directory_path, i) for i in potential_files if os.path.dirname(i)]
+            if packed_files:
+                load_report.merge(self.load_files(potential_files=packed_files, tqdm=tqdm, load_mode=load_mode,
+                                                  predicate=predicate))
+            self.LastLoadReport = load_report
+            return load_report
         potential_files = [os.path.join(directory_path, i) for i in potential_files]
-        self.load_files(potential_files=potential_files, tqdm=tqdm)
+        return self.load_files(potential_files=potential_files, tqdm=tqdm, load_mode=load_mode, predicate=predicate)
+
+    def return_header_file_names(self, directory_path: Union[str, bytes, os.PathLike],
+                                 specific_mrns: List[str] = None) -> List[str]:
+        return return_directory_catalog(directory_path).return_header_files(specific_mrns)
 
-    def load_qcls(self, tqdm=None):
+    def iter_headers(self, directory_path: Union[str, bytes, os.PathLike], specific_mrns: List[str] = None,
+                     load_mode: str = 'thread', prefetch: Optional[int] = None, worker_count: Optional[int] = None,
+                     report: Optional[LoadReport] = None):
+        """
+        Visit each header of a folder once without adding it to PatientHeaders, see PatientDatabase.iter_patients
+        """
+        potential_files = [os.path.join(directory_path, i)
+                           for i in self.return_header_file_names(directory_path, specific_mrns)]
+        for file, patient_header in iterate_pipeline(potential_files,
+                                                     partial(load_patient_header_file, codec=self.Codec),
+                                                     worker_count=worker_count, worker_kind=load_mode,
+                                                     prefetch=prefetch, report=report):
+            yield patient_header
+
+    def iter_patients(self, specific_mrns: List[str] = None, load_mode: str = 'thread',
+                      prefetch: Optional[int] = None, worker_count: Optional[int] = None,
+                      report: Optional[LoadReport] = None):
+        """
+        Stream the full patient of each loaded header, the streaming version of return_patient_database
+        :param specific_mrns: only patients whose header MRN is in this list, compared as canonical MRNs
+        """
+        patient_headers = self.PatientHeaders.values()
+        if specific_mrns:
+            specific_mrns = {return_canonical_mrn(i) for i in specific_mrns}
+            patient_headers = [i for i in patient_headers if return_canonical_mrn(i.MRN) in specific_mrns]
+        pat_files = [i.FilePath.replace("_Header.json", ".json") for i in patient_headers]
+        potential_files = return_existing_files(pat_files, any_compression=True)
+        for file, patient in iterate_pipeline(potential_files, partial(load_patient_file, codec=self.Codec),
+                                              worker_count=worker_count, worker_kind=load_mode, prefetch=prefetch,
+                                              report=report):
+            yield patient
+
+    def load_qcls(self, tqdm=None, load_mode: str = 'thread') -> LoadReport:
         pbar = None
         if tqdm is not None:
             pbar = tqdm(total=len(self.PatientHeaders), desc='Loading QCLs...')
-        if load_parallel:
-            thread_count = int(cpu_count() * 0.8 - 1)
-            q = Queue(maxsize=thread_count)
-            threads = []
-            a = (q, pbar, self.PatientHeaders)
-            for worker in range(thread_count):
-                t = Thread(target=load_qcls, args=(a,))
-                t.start()
-                threads.append(t)
-            for mrn in self.PatientHeaders.keys():
-                q.put(mrn)
-            for _ in range(thread_count):
-                q.put(None)
-            for t in threads:
-                t.join()
-        else:
-            for pat in self.PatientHeaders.values():
-                try:
-                    pat.load_qcls()
-                except:
-                    continue
-                if pbar is not None:
-                    pbar.update()
-
-    def return_patient_database(self, tqdm=None) -> PatientDatabase:
+        rs_uids = {return_json_stem(pat.return_qcl_file_path()): rs_uid for rs_uid, pat in self.PatientHeaders.items()}
+
+        def set_qcls(file, qcl_list: Optional[QCLListClass]):
+            if qcl_list is not None:
+                self.PatientHeaders[rs_uids[return_json_stem(file)]].QCL_List = qcl_list
+
+        return run_pipeline(return_existing_files(list(rs_uids.keys()), any_compression=True),
+                            partial(load_qcl_file, codec=self.Codec),
+                            set_qcls,
+                            worker_kind=load_mode, pbar=pbar,
+                            description='Loading QCLs for ' + self.DBName)
+
+    def return_patient_database(self, tqdm=None, load_mode: str = 'thread', lazy: bool = False,
+                                max_loaded_patients: Optional[int] = None,
+                                max_loaded_file_bytes: Optional[int] = None,
+                                fields: Optional[List[str]] = None) -> PatientDatabase:
         """
         This is meant to return a full patient database from the header files present
+        :param tqdm:
+        :param load_mode: 'thread', 'process', or 'serial'
+        :param lazy: fill Patients with PatientProxy objects that parse their file on first access
+        :param max_loaded_patients: with lazy, the most patients held parsed at once, least recently used go first
+        :param max_loaded_file_bytes: with lazy, the most bytes of patient files held parsed at once
+        :param fields: attribute paths to include or ('!') exclude, see FieldProjection
         :return:
         """
+        if lazy:
+            patient_database = PatientDatabase(self.DBName, self.Codec)
+            patient_database.SymbolTable = self.SymbolTable
+            loaded_cache = None
+            if max_loaded_patients is not None or max_loaded_file_bytes is not None:
+                loaded_cache = LoadedPatientCache(max_loaded_patients, max_loaded_file_bytes)
+            patient_database.LoadedCache = loaded_cache
+            projection = return_field_projection(fields, PatientClass)
+            pat_files = {return_json_stem(patient_header.FilePath.replace("_Header.json", ".json")): patient_header
+                         for patient_header in self.PatientHeaders.values()}
+            for pat_file in return_existing_files(list(pat_files.keys()), any_compression=True):
+                patient_header = pat_files[return_json_stem(pat_file)]
+                patient_database.Patients[patient_header.RS_UID] = PatientProxy(pat_file, patient_header,
+                                                                                loaded_cache, self.SymbolTable,
+                                                                                projection, self.Codec)
+            return patient_database
         header_files = [i.FilePath for i in self.PatientHeaders.values()]
         pat_files = [i.replace("_Header.json", ".json") for i in header_files]
-        potential_files = [i for i in pat_files if os.path.exists(i)]
-        patient_database = PatientDatabase(self.DBName)
-        patient_database.load_files(potential_files, tqdm=tqdm)
+        potential_files = return_existing_files(pat_files, any_compression=True)
+        patient_database = PatientDatabase(self.DBName, self.Codec)
+        patient_database.SymbolTable = self.SymbolTable
+        patient_database.load_files(potential_files, tqdm=tqdm, load_mode=load_mode, fields=fields)
         return patient_database
 
     def __repr__(self):
@@ -1154,34 +2970,52 @@ class PatientDatabases(BaseMethod):
         for db in self.Databases.values():
             db.delete_unapproved_patients()
 
-    def save(self, database_path: Union[str, bytes, os.PathLike]):
+    def save(self, database_path: Union[str, bytes, os.PathLike], tqdm=None, save_mode: str = 'thread',
+             worker_count: Optional[int] = None, skip_unchanged: bool = False, compression: Optional[str] = None,
+             compression_level: Optional[int] = None) -> Dict[str, LoadReport]:
         if not os.path.exists(database_path):
             os.makedirs(database_path)
+        save_reports = {}
         for db in self.Databases.values():
             print(f"Writing {db.DBName}")
             db_path = os.path.join(database_path, db.DBName)
             if not os.path.exists(db_path):
                 os.makedirs(db_path)
-            db.save_to_directory(db_path)
+            save_reports[db.DBName] = db.save_to_directory(db_path, tqdm, save_mode, worker_count,
+                                                           skip_unchanged, compression, compression_level)
+            print(save_reports[db.DBName])
+        return save_reports
 
     def build_from_folder(self, path_to_database_directories: Union[str, bytes, os.PathLike],
                           specific_mrns: Optional[List[str]] = None, tqdm=None,
-                          specific_folders: Optional[List[str]] = None):
-        database_directories = []
-        for root, database_directories, files in os.walk(path_to_database_directories):
-            break
-        for database_directory in database_directories:
-            if specific_folders:
-                if database_directory not in specific_folders:
-                    continue
-            database = PatientDatabase(database_directory)
-            database.load_from_directory(os.path.join(path_to_database_directories, database_directory),
-                                         specific_mrns, tqdm)
+                          specific_folders: Optional[List[str]] = None, load_mode: str = 'thread',
+                          predicate: Optional[LoadPredicate] = None, fields: Optional[List[str]] = None,
+                          codec: Optional[Union[str, JsonCodec]] = None):
+        load_reports = {}
+        for database_directory in return_database_directories(path_to_database_directories, specific_folders):
+            database = PatientDatabase(database_directory, codec)
+            load_reports[database_directory] = database.load_from_directory(
+                os.path.join(path_to_database_directories, database_directory), specific_mrns, tqdm, load_mode,
+                predicate, fields)
             self.Databases[database_directory] = database
+        return load_reports
 
-    def load_qcls(self, tqdm=None):
-        for db in self.Databases.values():
-            db.load_qcls(tqdm)
+    def iter_patients(self, path_to_database_directories: Union[str, bytes, os.PathLike],
+                      specific_mrns: Optional[List[str]] = None, specific_folders: Optional[List[str]] = None,
+                      load_mode: str = 'thread', prefetch: Optional[int] = None, worker_count: Optional[int] = None,
+                      codec: Optional[Union[str, JsonCodec]] = None):
+        """
+        Stream every patient of every database folder, nothing is added to Databases
+        :return: a generator of (database name, PatientClass)
+        """
+        for database_directory in return_database_directories(path_to_database_directories, specific_folders):
+            database = PatientDatabase(database_directory, codec)
+            for patient in database.iter_patients(os.path.join(path_to_database_directories, database_directory),
+                                                  specific_mrns, load_mode, prefetch, worker_count):
+                yield database_directory, patient
+
+    def load_qcls(self, tqdm=None, load_mode: str = 'thread') -> Dict[str, LoadReport]:
+        return {db.DBName: db.load_qcls(tqdm, load_mode) for db in self.Databases.values()}
 
 
 class PatientHeaderDatabases(BaseMethod):
@@ -1194,35 +3028,220 @@ class PatientHeaderDatabases(BaseMethod):
         for db in self.HeaderDatabases.values():
             db.delete_unapproved_patients()
 
-    def return_patient_databases(self, tqdm=None) -> PatientDatabases:
+    def return_patient_databases(self, tqdm=None, load_mode: str = 'thread', lazy: bool = False,
+                                 max_loaded_patients: Optional[int] = None,
+                                 max_loaded_file_bytes: Optional[int] = None,
+                                 fields: Optional[List[str]] = None) -> PatientDatabases:
+        """
+        With lazy, the loaded patient limits apply to each database separately
+        """
         out_databases = PatientDatabases()
         for db in self.HeaderDatabases.values():
-            out_databases.add_database(db.return_patient_database(tqdm))
+            out_databases.add_database(db.return_patient_database(tqdm, load_mode, lazy, max_loaded_patients,
+                                                                  max_loaded_file_bytes, fields))
         return out_databases
 
     def build_from_folder(self, path_to_database_directories: Union[str, bytes, os.PathLike],
                           specific_mrns: Optional[List[str]] = None, tqdm=None,
-                          specific_folders: Optional[List[str]] = None):
-        database_directories = []
-        for root, database_directories, files in os.walk(path_to_database_directories):
-            break
-        for database_directory in database_directories:
-            if specific_folders:
-                if database_directory not in specific_folders:
-                    continue
-            header_database = PatientHeaderDatabase(database_directory)
-            header_database.load_from_directory(os.path.join(path_to_database_directories, database_directory),
-                                                specific_mrns, tqdm)
+                          specific_folders: Optional[List[str]] = None, load_mode: str = 'thread',
+                          use_cache: bool = False, cache_directory: Optional[Union[str, bytes, os.PathLike]] = None,
+                          predicate: Optional[LoadPredicate] = None, codec: Optional[Union[str, JsonCodec]] = None):
+        load_reports = {}
+        for database_directory in return_database_directories(path_to_database_directories, specific_folders):
+            header_database = PatientHeaderDatabase(database_directory, codec)
+            load_reports[database_directory] = header_database.load_from_directory(
+                os.path.join(path_to_database_directories, database_directory), specific_mrns, tqdm, load_mode,
+                use_cache, cache_directory, predicate)
             self.HeaderDatabases[database_directory] = header_database
+        return load_reports
 
-    def load_qcls(self, tqdm=None):
-        for db in self.HeaderDatabases.values():
-            db.load_qcls(tqdm)
+    def iter_headers(self, path_to_database_directories: Union[str, bytes, os.PathLike],
+                     specific_mrns: Optional[List[str]] = None, specific_folders: Optional[List[str]] = None,
+                     load_mode: str = 'thread', prefetch: Optional[int] = None, worker_count: Optional[int] = None,
+                     codec: Optional[Union[str, JsonCodec]] = None):
+        """
+        Stream every header of every database folder, nothing is added to HeaderDatabases
+        :return: a generator of (database name, PatientHeader)
+        """
+        for database_directory in return_database_directories(path_to_database_directories, specific_folders):
+            header_database = PatientHeaderDatabase(database_directory, codec)
+            for patient_header in header_database.iter_headers(
+                    os.path.join(path_to_database_directories, database_directory), specific_mrns, load_mode,
+                    prefetch, worker_count):
+                yield database_directory, patient_header
+
+    def iter_patients(self, specific_mrns: Optional[List[str]] = None, load_mode: str = 'thread',
+                      prefetch: Optional[int] = None, worker_count: Optional[int] = None):
+        """
+        Stream the full patient of every loaded header
+        :return: a generator of (database name, PatientClass)
+        """
+        for header_database in self.HeaderDatabases.values():
+            for patient in header_database.iter_patients(specific_mrns, load_mode, prefetch, worker_count):
+                yield header_database.DBName, patient
+
+    def load_qcls(self, tqdm=None, load_mode: str = 'thread') -> Dict[str, LoadReport]:
+        return {db.DBName: db.load_qcls(tqdm, load_mode) for db in self.HeaderDatabases.values()}
+
+
+def save_database(database: PatientDatabase, path: Union[str, bytes, os.PathLike], tqdm=None,
+                  save_mode: str = 'thread', worker_count: Optional[int] = None,
+                  skip_unchanged: bool = False, compression: Optional[str] = None,
+                  compression_level: Optional[int] = None) -> LoadReport:
+    return database.save_to_directory(path, tqdm, save_mode, worker_count, skip_unchanged, compression,
+                                      compression_level)
+
+
+def return_class_for_file(file_name: str):
+    """
+    Patient, header, and QCL files all live in the same folder, the suffix tells us which class wrote them
+    :param file_name:
+    :return: None for a name that is not '<RS_UID>_<date>' with one of their suffixes, a file none of them wrote
+    """
+    file_name = return_json_stem(file_name)
+    if '_' not in file_name or len(return_file_date_key(file_name)) != 5:
+        return None
+    if file_name.endswith('_Header.json'):
+        return PatientHeader
+    if file_name.endswith('QCLs.json'):
+        return QCLListClass
+    return PatientClass
+
+
+def upgrade_legacy_data(cls, data):
+    """
+    Decode any child objects that were stored as json strings, in place, following the class annotations
+    :param cls: the BaseMethod class that wrote data
+    :param data: a decoded dictionary
+    :return:
+    """
+    if isinstance(data, (str, bytes)):
+        data = json.loads(data)
+    for attribute, attribute_type in cls.__annotations__.items():
+        if attribute not in data or data[attribute] is None:
+            continue
+        if hasattr(attribute_type, "__origin__"):
+            if attribute_type.__origin__ == list or attribute_type.__origin__ is List:
+                sub_type = attribute_type.__args__[0]
+                if hasattr(sub_type, "from_json"):
+                    data[attribute] = [upgrade_legacy_data(sub_type, i) for i in data[attribute]]
+            elif attribute_type.__origin__ == dict or attribute_type.__origin__ is Dict:
+                value_type = attribute_type.__args__[1]
+                if hasattr(value_type, "from_json"):
+                    data[attribute] = {key: upgrade_legacy_data(value_type, value)
+                                       for key, value in data[attribute].items()}
+        elif hasattr(attribute_type, "from_json"):
+            data[attribute] = upgrade_legacy_data(attribute_type, data[attribute])
+    return data
+
+
+def migrate_legacy_file(json_file_path: Union[str, bytes, os.PathLike]) -> bool:
+    """
+    Rewrite a version 1 json file as a version 2 file, keeping every key it already had
+    :param json_file_path:
+    :return: True if the file was rewritten, False if it was already current
+    """
+    cls = return_class_for_file(os.path.basename(json_file_path))
+    if cls is None:
+        raise ValueError(f"{json_file_path} is not a patient, header, or QCL file")
+    codec = return_json_codec()
+    data = codec.read_file(json_file_path)
+    if data.get(FORMAT_VERSION_KEY, 1) >= JSON_FORMAT_VERSION:
+        return False
+    data = upgrade_legacy_data(cls, data)
+    data[FORMAT_VERSION_KEY] = JSON_FORMAT_VERSION
+    codec.write_file(json_file_path, data)
+    return True
 
 
-def save_database(database: PatientDatabase, path: Union[str, bytes, os.PathLike]):
-    for patient in database.Patients.values():
-        patient.save_to_directory(path)
+def migrate_legacy_directory(directory_path: Union[str, bytes, os.PathLike], tqdm=None) -> int:
+    """
+    Rewrite every patient, header, and QCL file in a database folder to the current json format, other json files
+    in the folder (the sync manifest, benchmark results) are left alone
+    :param directory_path:
+    :param tqdm:
+    :return: number of files rewritten
+    """
+    catalog = return_directory_catalog(directory_path, refresh=True)
+    json_files = [i for files_by_mrn in (catalog.PatientFiles, catalog.HeaderFiles)
+                  for file_names in files_by_mrn.values() for i in file_names] + sorted(catalog.QCLFiles)
+    pbar = None
+    if tqdm is not None:
+        pbar = tqdm(total=len(json_files), desc='Migrating ' + os.path.basename(directory_path))
+    migrated = 0
+    for json_file in json_files:
+        if migrate_legacy_file(os.path.join(directory_path, json_file)):
+            migrated += 1
+        if pbar is not None:
+            pbar.update()
+    return migrated
+
+
+def recompress_file(file_path: str, compression: Optional[str] = None,
+                    compression_level: Optional[int] = None) -> str:
+    """
+    Rewrite one json file with another compression, byte for byte the same document, and remove the old file
+    :return: the path of the file now holding it
+    """
+    out_file = return_compressed_file_name(file_path, compression)
+    if out_file == file_path:
+        return file_path
+    with open(file_path, 'rb') as json_file:
+        data = decompress_bytes(json_file.read(), return_compression(file_path))
+    write_file_atomic(out_file, compress_bytes(data, compression, compression_level))
+    os.remove(file_path)
+    return out_file
+
+
+def recompress_directory(directory_path: Union[str, bytes, os.PathLike], compression: Optional[str] = None,
+                         compression_level: Optional[int] = None, tqdm=None, load_mode: str = 'thread',
+                         worker_count: Optional[int] = None) -> LoadReport:
+    """
+    Rewrite every patient, header, and QCL file in a database folder with one compression, None to decompress
+    :param directory_path:
+    :param compression: None, 'gz', or 'xz'
+    :param compression_level: defaults to DEFAULT_COMPRESSION_LEVELS
+    :param tqdm:
+    :param load_mode: 'thread', 'process', or 'serial'
+    :param worker_count:
+    :return:
+    """
+    check_compression(compression)
+    catalog = return_directory_catalog(directory_path, refresh=True)
+    file_names = [i for files_by_mrn in (catalog.PatientFiles, catalog.HeaderFiles)
+                  for file_names in files_by_mrn.values() for i in file_names] + sorted(catalog.QCLFiles)
+    json_files = [os.path.join(directory_path, i) for i in file_names]
+    pbar = None
+    if tqdm is not None:
+        pbar = tqdm(total=len(json_files), desc='Compressing ' + os.path.basename(directory_path))
+    return run_pipeline(json_files, partial(recompress_file, compression=compression,
+                                            compression_level=compression_level),
+                        worker_count=worker_count, worker_kind=load_mode, pbar=pbar,
+                        description='Compressing ' + os.path.basename(directory_path))
+
+
+def recompress_database(path_to_database_directories: Union[str, bytes, os.PathLike],
+                        compression: Optional[str] = None, compression_level: Optional[int] = None, tqdm=None,
+                        specific_folders: Optional[List[str]] = None, load_mode: str = 'thread',
+                        worker_count: Optional[int] = None) -> Dict[str, LoadReport]:
+    recompressed = {}
+    for database_directory in return_database_directories(path_to_database_directories, specific_folders):
+        print(f"Compressing {database_directory}")
+        recompressed[database_directory] = recompress_directory(os.path.join(path_to_database_directories,
+                                                                              database_directory),
+                                                                compression, compression_level, tqdm, load_mode,
+                                                                worker_count)
+    return recompressed
+
+
+def migrate_legacy_database(path_to_database_directories: Union[str, bytes, os.PathLike], tqdm=None,
+                            specific_folders: Optional[List[str]] = None) -> Dict[str, int]:
+    migrated = {}
+    for database_directory in return_database_directories(path_to_database_directories, specific_folders):
+        print(f"Migrating {database_directory}")
+        migrated[database_directory] = migrate_legacy_directory(os.path.join(path_to_database_directories,
+                                                                             database_directory), tqdm)
+    return migrated
 
 
 if __name__ == '__main__':
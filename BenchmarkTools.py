@@ -0,0 +1,542 @@
+import random
+import platform
+import statistics
+import subprocess
+import tempfile
+import shutil
+import io
+from contextlib import redirect_stdout
+from .AbstractBase import *
+from .EvaluationTools import find_all_rois, identify_wanted_headers, update_local_database, RoiIndex
+from .PatientPack import pack_database, clear_patient_packs
+
+"""
+Timed load, save and query scenarios over a deterministic synthetic database, written as json so runs on different
+commits can be compared with compare_benchmark_results
+
+The same seed and sizes always give the same patients, so two results files are only comparable if their 'Config'
+matches, compare_benchmark_results refuses them otherwise
+"""
+BENCHMARK_VERSION = 1
+ROI_NAMES = ('External', 'SpinalCord', 'Brainstem', 'Parotid_L', 'Parotid_R', 'Mandible', 'Esophagus', 'Larynx',
+             'PTV_70', 'PTV_56', 'CTV_70', 'Opt_PTV', 'Ring_PTV', 'Couch', 'Lung_L', 'Lung_R', 'Heart', 'Bladder',
+             'Rectum', 'FemoralHead_L', 'FemoralHead_R', 'Bowel')
+ROI_TYPES = {'External': 'External', 'Couch': 'Support', 'PTV': 'Ptv', 'CTV': 'Ctv', 'Opt': 'Control',
+             'Ring': 'Control'}
+BODY_SITES = ('Head', 'Thorax', 'Pelvis')
+WANTED_ROIS = ['parotid_l', 'parotid_r', 'spinalcord']
+WANTED_TYPES = ['Organ']
+
+
+class SyntheticDatabaseConfig(object):
+    """
+    Sizes of the synthetic databases, every patient gets the same shape
+    :param database_count: database folders
+    :param patient_count: patients in each database
+    :param case_count: cases per patient
+    :param exam_count: examinations per case
+    :param roi_count: ROIs per case, names after the first len(ROI_NAMES) are ROI_1, ROI_2, ...
+    :param dvh_points: points in each DVH
+    :param beam_count: beams in each beam set, there are two plans of one beam set per case
+    :param qcl_count: QCLs per patient
+    :param dvh_dtype: None to keep DVHs as lists, or 'float32'/'float64' for array backed DVHs
+    :param seed:
+    """
+    def __init__(self, database_count: int = 2, patient_count: int = 50, case_count: int = 2, exam_count: int = 2,
+                 roi_count: int = 30, dvh_points: int = 101, beam_count: int = 4, qcl_count: int = 3,
+                 dvh_dtype: Optional[str] = None, seed: int = 0):
+        self.DatabaseCount = database_count
+        self.PatientCount = patient_count
+        self.CaseCount = case_count
+        self.ExamCount = exam_count
+        self.ROICount = roi_count
+        self.DVHPoints = dvh_points
+        self.BeamCount = beam_count
+        self.QCLCount = qcl_count
+        self.DVHDtype = dvh_dtype
+        self.Seed = seed
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+def return_roi_type(roi_name: str) -> str:
+    for prefix, roi_type in ROI_TYPES.items():
+        if roi_name.startswith(prefix):
+            return roi_type
+    return 'Organ'
+
+
+def return_date_time(date_string: str) -> DateTimeClass:
+    date_time = DateTimeClass()
+    date_time.from_string(date_string)
+    return date_time
+
+
+def make_synthetic_patient(patient_number: int, config: SyntheticDatabaseConfig) -> PatientClass:
+    """
+    A complete PatientClass tree, the same for the same patient_number and config
+    :param patient_number: gives the MRN (zero padded to 8 digits) and seeds the values
+    :param config:
+    :return:
+    """
+    generator = random.Random(config.Seed * 1000003 + patient_number)
+    roi_names = list(ROI_NAMES[:config.ROICount]) + [f"ROI_{i}" for i in range(1, config.ROICount - len(ROI_NAMES) + 1)]
+    patient = PatientClass()
+    patient.MRN = str(patient_number).zfill(8)
+    patient.define_rs_uid()
+    patient.Name_First = f"First{patient_number}"
+    patient.Name_Last = f"Last{patient_number}"
+    patient.Gender = patient_number % 2
+    patient.DateLastModified = return_date_time(f"2023.{1 + patient_number % 12}.{1 + patient_number % 28}."
+                                                f"{patient_number % 24}.{patient_number % 60}")
+    patient.DateOfBirth = return_date_time(f"{1940 + patient_number % 50}.{1 + patient_number % 12}.1.0.0")
+    for case_index in range(config.CaseCount):
+        case = CaseClass()
+        case.CaseName = f"Case {case_index + 1}"
+        case.BodySite = generator.choice(BODY_SITES)
+        for roi_number, roi_name in enumerate(roi_names):
+            base_roi = RegionOfInterestBase()
+            base_roi.Name = roi_name
+            base_roi.RS_Number = roi_number
+            base_roi.Type = return_roi_type(roi_name)
+            base_roi.ROI_Material = None
+            base_roi.OrganData = None
+            base_roi.StructureCode = None
+            case.Base_ROIs.append(base_roi)
+        base_poi = PointOfInterestBase()
+        base_poi.Name = 'Iso'
+        base_poi.RS_Number = 0
+        base_poi.Type = 'Isocenter'
+        base_poi.OrganType = None
+        base_poi.ROI_Material = None
+        base_poi.OrganData = None
+        case.Base_POIs.append(base_poi)
+        for exam_index in range(config.ExamCount):
+            exam = ExaminationClass()
+            exam.ExamName = f"CT {exam_index + 1}"
+            exam.SeriesDescription = 'Synthetic'
+            exam.SeriesInstanceUID = f"1.2.{patient_number}.{case_index}.{exam_index}"
+            exam.StudyInstanceUID = f"1.3.{patient_number}"
+            exam.StudyDescription = 'Synthetic'
+            equipment = EquipmentInfoClass()
+            equipment.FrameOfReference = f"1.4.{patient_number}.{case_index}"
+            equipment.Modality = 'CT'
+            exam.EquipmentInfo = equipment
+            exam.Exam_DateTime = return_date_time(f"2022.{1 + exam_index % 12}.1.8.0")
+            for roi_number, roi_name in enumerate(roi_names):
+                roi = RegionOfInterest()
+                roi.Name = roi_name
+                roi.RS_Number = roi_number
+                roi.Volume = generator.uniform(1.0, 1000.0)
+                roi.HU_Min = generator.uniform(-1000.0, 0.0)
+                roi.HU_Max = generator.uniform(0.0, 2000.0)
+                roi.HU_Average = generator.uniform(-100.0, 100.0)
+                roi.Defined = True
+                exam.ROIs.append(roi)
+            case.Examinations.append(exam)
+        for plan_index in range(2):
+            plan = TreatmentPlanClass()
+            plan.PlanName = f"Plan {plan_index + 1}"
+            plan.PlannedBy = generator.choice(('Dr A', 'Dr B', 'Dr C'))
+            plan.FractionNumber = 0
+            plan.Optimizations = []
+            plan.Referenced_Exam_Name = 'CT 1'
+            plan.BeamSets = []
+            plan.Review = None
+            if plan_index == 0 or patient_number % 3:
+                plan.Review = ReviewClass()
+                plan.Review.ApprovalStatus = 'Approved' if plan_index == 0 else 'UnApproved'
+                plan.Review.ReviewerName = 'Dr D'
+                plan.Review.ReviewTime = return_date_time(f"2023.{1 + patient_number % 12}.2.12.0")
+            beam_set = BeamSetClass()
+            beam_set.DicomPlanLabel = f"BS {plan_index + 1}"
+            beam_set.RS_BeamNumber = 1
+            beam_set.NumberOfFractions = 35
+            beam_set.PlanIntent = 'Curative'
+            beam_set.PlanGenerationTechnique = 'Imrt'
+            beam_set.Modality = 'Photons'
+            prescription = PrescriptionClass()
+            prescription.DoseValue_cGy = 7000.0
+            prescription.DoseVolume_percent = 95.0
+            prescription.PrescriptionType = 'DoseAtVolume'
+            prescription.NumberOfFractions = 35
+            prescription.Dose_per_Fraction = 200.0
+            prescription.Referenced_ROI_Structure = None
+            prescription.Referenced_POI_Structure = None
+            prescription.DoseSpecificationPoint = None
+            beam_set.Prescriptions.append(prescription)
+            beam_set.Primary_Prescription = prescription
+            beam_set.Primary_Prescription_UID = 0
+            machine = MachineReferenceClass()
+            machine.MachineName = 'TrueBeam'
+            machine.CommissioningTime = None
+            beam_set.MachineReference = machine
+            for beam_number in range(config.BeamCount):
+                beam = BeamClass()
+                beam.ArcRotationDirection = 'Clockwise'
+                beam.ArcStopGantryAngle = 179.0
+                beam.CollimatorAngle = generator.choice((5.0, 30.0, 355.0))
+                beam.BeamMU = generator.uniform(100.0, 400.0)
+                beam.BeamQualityId = '6'
+                beam.CouchRotationAngle = 0.0
+                beam.DeliveryTechnique = 'DynamicArc'
+                beam.Description = f"Arc {beam_number + 1}"
+                beam.GantryAngle = 181.0
+                beam.PlanGenerationTechnique = 'Imrt'
+                beam.BeamName = f"{beam_number + 1}"
+                beam.RS_BeamNumber = beam_number + 1
+                beam_set.Beams.append(beam)
+            fraction_dose = FractionDoseClass()
+            fraction_dose.Name = beam_set.DicomPlanLabel
+            for roi_number, roi_name in enumerate(roi_names):
+                roi_dose = RegionOfInterestDose()
+                roi_dose.Name = roi_name
+                roi_dose.RS_Number = roi_number
+                maximum_dose = generator.uniform(500.0, 7500.0)
+                roi_dose.AbsoluteDose = [maximum_dose * (1 - i / config.DVHPoints) for i in range(config.DVHPoints)]
+                roi_dose.RelativeVolumes = [i / (config.DVHPoints - 1) for i in range(config.DVHPoints)]
+                roi_dose.Dose_Min_cGy = roi_dose.AbsoluteDose[-1]
+                roi_dose.Dose_Max_cGy = maximum_dose
+                roi_dose.Dose_Average_cGy = maximum_dose / 2
+                roi_dose.Defined = True
+                if config.DVHDtype is not None:
+                    roi_dose.to_arrays(config.DVHDtype)
+                fraction_dose.DoseROIs.append(roi_dose)
+            poi_dose = PointOfInterestDose()
+            poi_dose.Name = 'Iso'
+            poi_dose.RS_Number = 0
+            poi_dose.Dose_cGy = 200.0
+            fraction_dose.DosePOIs.append(poi_dose)
+            beam_set.FractionDose = fraction_dose
+            plan.BeamSets.append(beam_set)
+            case.TreatmentPlans.append(plan)
+        patient.Cases.append(case)
+    note = TreatmentNoteClass()
+    note.Note = f"Synthetic note for {patient.MRN}"
+    note.StaffFirstName = 'Staff'
+    note.StaffLastName = 'Member'
+    note.DateLastEdited = ReducedDateTimeClass()
+    patient.TreatmentNotes.append(note)
+    for qcl_index in range(config.QCLCount):
+        qcl = QCLClass()
+        qcl.Description = f"QCL {qcl_index + 1}"
+        qcl.CreatedTime = ReducedDateTimeClass()
+        qcl.CompletedTime = None
+        qcl.ResponsibleStaff = 'Physics'
+        qcl.CompletedStaff = 'Physics'
+        patient.QCL_List.QCLs.append(qcl)
+    return patient
+
+
+def return_synthetic_databases(config: SyntheticDatabaseConfig) -> PatientDatabases:
+    databases = PatientDatabases()
+    for database_index in range(config.DatabaseCount):
+        database = PatientDatabase(f"Synthetic{database_index + 1}")
+        for patient_index in range(config.PatientCount):
+            patient = make_synthetic_patient(database_index * 100000 + patient_index, config)
+            database.Patients[patient.RS_UID] = patient
+        databases.add_database(database)
+    return databases
+
+
+def write_synthetic_databases(path_to_database_directories: Union[str, bytes, os.PathLike],
+                              config: SyntheticDatabaseConfig, save_mode: str = 'thread') -> Dict[str, LoadReport]:
+    """
+    Write the synthetic databases in the usual layout, one folder per database of patient, header, and QCL files
+    """
+    with redirect_stdout(io.StringIO()):
+        return return_synthetic_databases(config).save(path_to_database_directories, save_mode=save_mode)
+
+
+def time_scenario(function, repeats: int = 3, setup=None) -> dict:
+    """
+    :param function: called with no arguments, what it returns last is kept as 'Result'
+    :param repeats:
+    :param setup: called before each repeat, not timed
+    :return: {'Seconds': [...], 'Min', 'Median', 'Result'}
+    """
+    seconds = []
+    result = None
+    for _ in range(repeats):
+        with redirect_stdout(io.StringIO()):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            result = function()
+            seconds.append(time.perf_counter() - start)
+    return {'Seconds': seconds, 'Min': min(seconds), 'Median': statistics.median(seconds), 'Result': result}
+
+
+def return_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def return_patient_count(databases) -> int:
+    if isinstance(databases, PatientDatabases):
+        return sum(len(i.Patients) for i in databases.Databases.values())
+    return sum(len(i.PatientHeaders) for i in databases.HeaderDatabases.values())
+
+
+def return_codec_benchmark_files(path_to_database_directories: Union[str, bytes, os.PathLike],
+                                 max_files: Optional[int] = None) -> List[str]:
+    """
+    The patient files of every database folder, the first max_files of them if given
+    """
+    patient_files = []
+    for database_directory in return_database_directories(path_to_database_directories):
+        patient_files += PatientDatabase(database_directory).return_patient_files(
+            os.path.join(path_to_database_directories, database_directory))
+    return patient_files[:max_files] if max_files is not None else patient_files
+
+
+def run_codec_benchmarks(path_to_database_directories: Union[str, bytes, os.PathLike], repeats: int = 3,
+                         max_files: Optional[int] = None) -> Dict[str, dict]:
+    """
+    Parse and write throughput of each installed json codec over the patient files of a database path
+    ParseMBps decodes bytes already in memory, ReadMBps goes through read_file (memory mapped for large files) and
+    WriteMBps encodes the decoded documents, each from the fastest of the repeats
+    :param path_to_database_directories: a folder of database folders, synthetic or real
+    :param repeats:
+    :param max_files: limit the number of patient files read into memory
+    :return: {codec name: {'Files', 'MB', 'ParseMBps', 'ReadMBps', 'WriteMBps'}}
+    """
+    patient_files = return_codec_benchmark_files(path_to_database_directories, max_files)
+    contents = []
+    for file in patient_files:
+        with open(file, 'rb') as json_file:
+            contents.append(json_file.read())
+    megabytes = sum(len(i) for i in contents) / (1024 * 1024)
+    results = {}
+    if not contents:
+        return results
+    for name, codec in JSON_CODECS.items():
+        if name == 'auto':
+            continue
+        timing = time_scenario(lambda: [codec.loads(i) for i in contents], repeats)
+        documents = timing['Result']
+        read_timing = time_scenario(lambda: [codec.read_file(i) for i in patient_files], repeats)
+        write_timing = time_scenario(lambda: [codec.dumps(i) for i in documents], repeats)
+        results[name] = {'Files': len(contents), 'MB': megabytes, 'ParseMBps': megabytes / timing['Min'],
+                         'ReadMBps': megabytes / read_timing['Min'], 'WriteMBps': megabytes / write_timing['Min']}
+        print(f"{name}: parse {results[name]['ParseMBps']:.1f} MB/s, read {results[name]['ReadMBps']:.1f} MB/s, "
+              f"write {results[name]['WriteMBps']:.1f} MB/s over {megabytes:.1f} MB")
+    return results
+
+
+def run_benchmarks(work_directory: Optional[Union[str, bytes, os.PathLike]] = None,
+                   config: Optional[SyntheticDatabaseConfig] = None, repeats: int = 3, load_mode: str = 'thread',
+                   results_path: Optional[Union[str, bytes, os.PathLike]] = None,
+                   keep_files: bool = False) -> dict:
+    """
+    Write the synthetic databases and time each scenario on them
+    :param work_directory: where the databases and copies are written, a temporary folder if None
+    :param config:
+    :param repeats: timings per scenario, Min is the one to compare
+    :param load_mode: 'thread', 'process', or 'serial', used by every load and save
+    :param results_path: also write the results here as json
+    :param keep_files: leave the written databases in work_directory
+    :return: the results, {'Config', 'Environment', 'Scenarios': {name: {'Seconds', 'Min', 'Median', 'Count'}},
+    'Codecs': see run_codec_benchmarks}
+    """
+    if config is None:
+        config = SyntheticDatabaseConfig()
+    created_directory = work_directory is None
+    if created_directory:
+        work_directory = tempfile.mkdtemp(prefix='benchmark_')
+    database_path = os.path.join(work_directory, 'Network')
+    save_path = os.path.join(work_directory, 'Saved')
+    compressed_path = os.path.join(work_directory, 'Compressed')
+    packed_path = os.path.join(work_directory, 'Packed')
+    local_path = os.path.join(work_directory, 'Local')
+    cache_path = os.path.join(work_directory, 'Cache')
+    for path in (database_path, save_path, compressed_path, packed_path, local_path, cache_path):
+        shutil.rmtree(path, ignore_errors=True)
+    scenarios = {}
+
+    def record(name: str, timing: dict, count: int):
+        timing.pop('Result')
+        timing['Count'] = count
+        scenarios[name] = timing
+        print(f"{name}: {timing['Min']:.3f}s min, {timing['Median']:.3f}s median over {count}")
+
+    def return_headers() -> PatientHeaderDatabases:
+        header_databases = PatientHeaderDatabases()
+        header_databases.build_from_folder(database_path, load_mode=load_mode)
+        return header_databases
+
+    def return_patients() -> PatientDatabases:
+        patient_databases = PatientDatabases()
+        patient_databases.build_from_folder(database_path, load_mode=load_mode)
+        return patient_databases
+
+    try:
+        timing = time_scenario(lambda: write_synthetic_databases(database_path, config, load_mode), 1)
+        record('write_synthetic_databases', timing, config.DatabaseCount * config.PatientCount)
+        patient_count = config.DatabaseCount * config.PatientCount
+
+        timing = time_scenario(return_headers, repeats, clear_directory_catalogs)
+        header_databases = timing['Result']
+        record('headers_build_from_folder', timing, patient_count)
+        record('headers_build_from_folder_warm', time_scenario(return_headers, repeats), patient_count)
+
+        def return_cached_headers():
+            cached_databases = PatientHeaderDatabases()
+            cached_databases.build_from_folder(database_path, load_mode=load_mode, use_cache=True,
+                                               cache_directory=cache_path)
+            return cached_databases
+        with redirect_stdout(io.StringIO()):
+            return_cached_headers()
+        record('headers_build_from_cache', time_scenario(return_cached_headers, repeats), patient_count)
+
+        record('patients_build_from_folder', time_scenario(return_patients, repeats, clear_directory_catalogs),
+               patient_count)
+        timing = time_scenario(lambda: header_databases.return_patient_databases(load_mode=load_mode), repeats)
+        patient_databases = timing['Result']
+        record('return_patient_database', timing, return_patient_count(patient_databases))
+        record('return_patient_database_lazy',
+               time_scenario(lambda: header_databases.return_patient_databases(load_mode=load_mode, lazy=True),
+                             repeats), patient_count)
+        record('load_qcls', time_scenario(lambda: patient_databases.load_qcls(load_mode=load_mode), repeats),
+               patient_count)
+
+        def save_patients():
+            shutil.rmtree(save_path, ignore_errors=True)
+            return patient_databases.save(save_path, save_mode=load_mode)
+        record('save', time_scenario(save_patients, repeats), patient_count)
+        record('save_skip_unchanged',
+               time_scenario(lambda: patient_databases.save(save_path, save_mode=load_mode, skip_unchanged=True),
+                             repeats), patient_count)
+
+        def save_compressed():
+            shutil.rmtree(compressed_path, ignore_errors=True)
+            return patient_databases.save(compressed_path, save_mode=load_mode, compression='gz')
+
+        def return_compressed_patients() -> PatientDatabases:
+            compressed_databases = PatientDatabases()
+            compressed_databases.build_from_folder(compressed_path, load_mode=load_mode)
+            return compressed_databases
+        record('save_gz', time_scenario(save_compressed, repeats), patient_count)
+        record('patients_build_from_folder_gz', time_scenario(return_compressed_patients, repeats,
+                                                              clear_directory_catalogs), patient_count)
+
+        def return_unpacked_copy():
+            clear_patient_packs()
+            shutil.rmtree(packed_path, ignore_errors=True)
+            shutil.copytree(save_path, packed_path)
+
+        def return_packed_patients() -> PatientDatabases:
+            packed_databases = PatientDatabases()
+            packed_databases.build_from_folder(packed_path, load_mode=load_mode)
+            return packed_databases
+
+        def clear_packed_state():
+            clear_directory_catalogs()
+            clear_patient_packs()
+        record('pack_database', time_scenario(lambda: pack_database(packed_path), repeats, return_unpacked_copy),
+               patient_count)
+        record('patients_build_from_folder_packed', time_scenario(return_packed_patients, repeats,
+                                                                  clear_packed_state), patient_count)
+
+        record('roi_index_build', time_scenario(lambda: RoiIndex().build(header_databases), repeats), patient_count)
+        roi_index = RoiIndex()
+        roi_index.build(header_databases)
+        timing = time_scenario(lambda: find_all_rois(header_databases, roi_index), repeats)
+        record('find_all_rois', timing, len(timing['Result']))
+        timing = time_scenario(lambda: identify_wanted_headers(header_databases, WANTED_ROIS, WANTED_TYPES,
+                                                               roi_index), repeats)
+        record('identify_wanted_headers', timing, return_patient_count(timing['Result']))
+
+        def return_empty_local():
+            shutil.rmtree(local_path, ignore_errors=True)
+            os.makedirs(local_path)
+        record('update_local_database_full',
+               time_scenario(lambda: update_local_database(local_path, database_path), repeats,
+                             return_empty_local), patient_count)
+        record('update_local_database_unchanged',
+               time_scenario(lambda: update_local_database(local_path, database_path), repeats), patient_count)
+        codecs = run_codec_benchmarks(database_path, repeats)
+    finally:
+        if created_directory and not keep_files:
+            shutil.rmtree(work_directory, ignore_errors=True)
+        clear_directory_catalogs()
+        clear_patient_packs()
+    results = {'version': BENCHMARK_VERSION, 'Config': config.to_dict(),
+               'Environment': {'Commit': return_git_commit(), 'Python': platform.python_version(),
+                               'Platform': platform.platform(), 'CPUCount': os.cpu_count(), 'LoadMode': load_mode,
+                               'Repeats': repeats, 'Time': datetime.now().isoformat(timespec='seconds')},
+               'Scenarios': scenarios, 'Codecs': codecs}
+    if results_path is not None:
+        write_file_atomic(results_path, json.dumps(results, indent=1))
+    return results
+
+
+def load_benchmark_results(results_path: Union[str, bytes, os.PathLike]) -> dict:
+    with open(results_path, 'r') as json_file:
+        results = json.load(json_file)
+    if results.get('version') != BENCHMARK_VERSION:
+        raise ValueError(f"{results_path} was written by a different benchmark version")
+    return results
+
+
+def compare_benchmark_results(baseline: dict or str, current: dict or str) -> Dict[str, float]:
+    """
+    :param baseline: results (or a results file) of the reference commit
+    :param current: results (or a results file) to compare with it
+    :return: scenario name to current Min over baseline Min, below 1 is faster
+    """
+    if not isinstance(baseline, dict):
+        baseline = load_benchmark_results(baseline)
+    if not isinstance(current, dict):
+        current = load_benchmark_results(current)
+    if baseline['Config'] != current['Config']:
+        raise ValueError("Benchmark results were run on different synthetic databases")
+    ratios = {}
+    for name, timing in current['Scenarios'].items():
+        baseline_timing = baseline['Scenarios'].get(name)
+        if baseline_timing is None or baseline_timing['Min'] == 0:
+            continue
+        ratios[name] = timing['Min'] / baseline_timing['Min']
+    return ratios
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Time load, save and query paths on synthetic databases')
+    parser.add_argument('--work-directory', default=None)
+    parser.add_argument('--results', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None, help='a results file to compare this run with')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--load-mode', default='thread', choices=['thread', 'process', 'serial'])
+    parser.add_argument('--databases', type=int, default=2)
+    parser.add_argument('--patients', type=int, default=50)
+    parser.add_argument('--cases', type=int, default=2)
+    parser.add_argument('--exams', type=int, default=2)
+    parser.add_argument('--rois', type=int, default=30)
+    parser.add_argument('--dvh-points', type=int, default=101)
+    parser.add_argument('--beams', type=int, default=4)
+    parser.add_argument('--qcls', type=int, default=3)
+    parser.add_argument('--dvh-dtype', default=None, choices=['float32', 'float64'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--codecs', default=None,
+                        help='only time the json codecs, on the patient files of the database folders in this path')
+    arguments = parser.parse_args()
+    if arguments.codecs is not None:
+        run_codec_benchmarks(arguments.codecs, arguments.repeats)
+        return None
+    config = SyntheticDatabaseConfig(arguments.databases, arguments.patients, arguments.cases, arguments.exams,
+                                     arguments.rois, arguments.dvh_points, arguments.beams, arguments.qcls,
+                                     arguments.dvh_dtype, arguments.seed)
+    results = run_benchmarks(arguments.work_directory, config, arguments.repeats, arguments.load_mode,
+                             arguments.results)
+    if arguments.compare is not None:
+        for name, ratio in compare_benchmark_results(arguments.compare, results).items():
+            print(f"{name}: {ratio:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+import re
+from .AbstractBase import *
+try:
+    import numpy as np
+except ImportError:
+    print("Unable to import numpy, DVH stacks are not available")
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    print("Unable to compute DVH metrics in parallel")
+
+
+def iterate_dose_rois(databases: PatientDatabases or PatientDatabase):
+    """
+    Walk every RegionOfInterestDose held in the fraction doses of the beam sets
+    :param databases:
+    :return: a generator of (database name, patient, case, treatment plan, beam set, region of interest dose)
+    """
+    if isinstance(databases, PatientDatabases):
+        database_list = list(databases.Databases.values())
+    else:
+        database_list = [databases]
+    for database in database_list:
+        for patient in database.Patients.values():
+            for case in patient.Cases:
+                for treatment_plan in case.TreatmentPlans:
+                    for beam_set in treatment_plan.BeamSets:
+                        fraction_dose = getattr(beam_set, 'FractionDose', None)
+                        if fraction_dose is None:
+                            continue
+                        for dose_roi in fraction_dose.DoseROIs:
+                            yield database.DBName, patient, case, treatment_plan, beam_set, dose_roi
+
+
+def convert_dvhs_to_arrays(databases: PatientDatabases or PatientDatabase, dtype: str = 'float32'):
+    """
+    Switch every DVH to the array backed representation, see RegionOfInterestDose.to_arrays
+    """
+    for _, _, _, _, _, dose_roi in iterate_dose_rois(databases):
+        dose_roi.to_arrays(dtype)
+
+
+def _interpolate_rows(x_rows, y_rows, x_value: float, left, right):
+    """
+    np.interp applied to every row at once, x_rows must be ascending with any NaN padding at the end of the row
+    :param left: value for rows where x_value is below the first x, None to use the first y
+    :param right: value for rows where x_value is above the last x, None to use the last y
+    """
+    if x_rows.shape[1] == 0:
+        return np.full(x_rows.shape[0], np.nan)
+    counts = (~np.isnan(x_rows)).sum(axis=1)
+    above = x_rows >= x_value
+    index = np.where(above.any(axis=1), above.argmax(axis=1), counts)
+    rows = np.arange(x_rows.shape[0])
+    last = np.maximum(counts - 1, 0)
+    high = np.minimum(index, last)
+    low = np.clip(index - 1, 0, last)
+    x_low, x_high = x_rows[rows, low], x_rows[rows, high]
+    y_low, y_high = y_rows[rows, low], y_rows[rows, high]
+    span = x_high - x_low
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = np.where(span > 0, (x_value - x_low) / span, 0.0)
+    out = y_low + fraction * (y_high - y_low)
+    out = np.where(index == 0, y_rows[rows, 0] if left is None else left, out)
+    out = np.where(index >= counts, y_rows[rows, last] if right is None else right, out)
+    out[counts == 0] = np.nan
+    return out
+
+
+VOLUME_UNITS = ('fraction', 'percent')
+
+
+class DVHStack(object):
+    """
+    A group of DVHs as 2-D arrays, one row per RegionOfInterestDose, padded with NaN to the longest DVH
+    AbsoluteDose is the total dose in cGy (fraction dose times ScalingFactor)
+    RelativeVolumes are fractions of the ROI volume
+    :param dose_rois:
+    :param keys:
+    :param volume_unit: 'fraction' (0-1, as dvh_step counts) or 'percent' (0-100) for the stored RelativeVolumes, the
+    unit is never guessed from the values as a small ROI can hold percentages that all look like fractions
+    """
+    Keys: List[tuple]  # (DBName, RS_UID, CaseName, PlanName, DicomPlanLabel, ROI Name)
+
+    def __init__(self, dose_rois: List[RegionOfInterestDose], keys: List[tuple], volume_unit: str = 'fraction'):
+        if volume_unit not in VOLUME_UNITS:
+            raise ValueError(f"volume_unit must be one of {VOLUME_UNITS}, not {volume_unit}")
+        self.Keys = keys
+        rows = len(dose_rois)
+        length = max([len(getattr(i, 'AbsoluteDose', [])) for i in dose_rois] + [0])
+        self.AbsoluteDose = np.full((rows, length), np.nan)
+        self.RelativeVolumes = np.full((rows, length), np.nan)
+        self.ScalingFactor = np.ones(rows)
+        self.DoseMax = np.full(rows, np.nan)
+        self.DoseMin = np.full(rows, np.nan)
+        self.DoseMean = np.full(rows, np.nan)
+        for row, dose_roi in enumerate(dose_rois):
+            absolute_dose = getattr(dose_roi, 'AbsoluteDose', [])
+            count = len(absolute_dose)
+            self.AbsoluteDose[row, :count] = absolute_dose
+            relative_volumes = getattr(dose_roi, 'RelativeVolumes', None)
+            if relative_volumes is not None and len(relative_volumes) == count:
+                self.RelativeVolumes[row, :count] = relative_volumes
+                if volume_unit == 'percent':
+                    self.RelativeVolumes[row, :count] /= 100
+            else:
+                self.RelativeVolumes[row, :count] = np.arange(1, count + 1) * dose_roi.dvh_step
+            self.ScalingFactor[row] = dose_roi.ScalingFactor
+            self.DoseMax[row] = dose_roi.Dose_Max_cGy
+            self.DoseMin[row] = dose_roi.Dose_Min_cGy
+            self.DoseMean[row] = dose_roi.Dose_Average_cGy
+        scaling = self.ScalingFactor[:, None]
+        self.AbsoluteDose *= scaling
+        self.DoseMax *= self.ScalingFactor
+        self.DoseMin *= self.ScalingFactor
+        self.DoseMean *= self.ScalingFactor
+        order = np.argsort(self.RelativeVolumes, axis=1)
+        self.RelativeVolumes = np.take_along_axis(self.RelativeVolumes, order, axis=1)
+        self.AbsoluteDose = np.take_along_axis(self.AbsoluteDose, order, axis=1)
+
+    def __len__(self):
+        return len(self.Keys)
+
+    def dose_at_volume(self, relative_volume: float):
+        """
+        D_x, the dose in cGy received by at least relative_volume (0-1) of each ROI
+        """
+        return _interpolate_rows(self.RelativeVolumes, self.AbsoluteDose, relative_volume, None, None)
+
+    def volume_at_dose(self, dose_cGy: float):
+        """
+        V_x, the relative volume (0-1) of each ROI receiving at least dose_cGy
+        """
+        order = np.argsort(self.AbsoluteDose, axis=1)
+        doses = np.take_along_axis(self.AbsoluteDose, order, axis=1)
+        volumes = np.take_along_axis(self.RelativeVolumes, order, axis=1)
+        return _interpolate_rows(doses, volumes, dose_cGy, None, 0.0)
+
+    def mean_dose(self):
+        return self.DoseMean
+
+    def max_dose(self):
+        return self.DoseMax
+
+    def __repr__(self):
+        return f"DVHStack of {len(self.Keys)} DVHs"
+
+
+def return_roi_matcher(roi_matcher):
+    """
+    :param roi_matcher: an ROI name (case insensitive), a list of names, a compiled regular expression (matched from
+    the start of the name), or a function taking the name and returning a bool
+    :return: a function taking the name and returning a bool
+    """
+    if isinstance(roi_matcher, str):
+        roi_matcher = [roi_matcher]
+    if isinstance(roi_matcher, (list, tuple, set)):
+        wanted_names = {i.lower() for i in roi_matcher}
+        return lambda name: name.lower() in wanted_names
+    if hasattr(roi_matcher, 'match'):
+        return lambda name: roi_matcher.match(name) is not None
+    return roi_matcher
+
+
+def return_dose_rois(databases: PatientDatabases or PatientDatabase, roi_matcher):
+    matches = return_roi_matcher(roi_matcher)
+    dose_rois = []
+    keys = []
+    for db_name, patient, case, treatment_plan, beam_set, dose_roi in iterate_dose_rois(databases):
+        if not matches(dose_roi.Name):
+            continue
+        dose_rois.append(dose_roi)
+        keys.append((db_name, patient.RS_UID, case.CaseName, treatment_plan.PlanName, beam_set.DicomPlanLabel,
+                     dose_roi.Name))
+    return dose_rois, keys
+
+
+def stack_dvhs(databases: PatientDatabases or PatientDatabase, roi_name, volume_unit: str = 'fraction') -> DVHStack:
+    """
+    Gather every DVH of an ROI across the databases into one DVHStack
+    :param databases:
+    :param roi_name: an ROI name (case insensitive), or anything return_roi_matcher accepts
+    :param volume_unit: 'fraction' or 'percent', the unit of the stored RelativeVolumes
+    :return:
+    """
+    dose_rois, keys = return_dose_rois(databases, roi_name)
+    return DVHStack(dose_rois, keys, volume_unit)
+
+
+class DVHMetric(object):
+    """
+    One metric expression
+    D95 or D95% is the dose (cGy) to 95% of the volume, V20Gy or V2000cGy is the percent volume receiving 20 Gy,
+    Dmean, Dmax, and Dmin are the dose statistics stored with the DVH (cGy)
+    """
+    Expression: str
+
+    def __init__(self, expression: str):
+        self.Expression = expression
+        dose_match = re.fullmatch(r'D(\d+(?:\.\d+)?)%?', expression)
+        volume_match = re.fullmatch(r'V(\d+(?:\.\d+)?)(cGy|Gy)', expression)
+        if expression in ('Dmean', 'Dmax', 'Dmin'):
+            self.Kind = expression
+            self.Value = None
+        elif dose_match:
+            self.Kind = 'D'
+            self.Value = float(dose_match.group(1)) / 100
+        elif volume_match:
+            self.Kind = 'V'
+            self.Value = float(volume_match.group(1)) * (100 if volume_match.group(2) == 'Gy' else 1)
+        else:
+            raise ValueError(f"Unable to interpret DVH metric {expression}")
+
+    def evaluate(self, dvh_stack: DVHStack):
+        if self.Kind == 'D':
+            return dvh_stack.dose_at_volume(self.Value)
+        if self.Kind == 'V':
+            return dvh_stack.volume_at_dose(self.Value) * 100
+        if self.Kind == 'Dmean':
+            return dvh_stack.mean_dose()
+        if self.Kind == 'Dmax':
+            return dvh_stack.max_dose()
+        return dvh_stack.DoseMin
+
+    def __repr__(self):
+        return self.Expression
+
+
+class DVHMetricTable(object):
+    """
+    One row per DVH, the key columns followed by a column per metric
+    """
+    KeyColumns = ['DBName', 'RS_UID', 'CaseName', 'PlanName', 'DicomPlanLabel', 'ROIName']
+    Columns: List[str]
+    Rows: List[list]
+
+    def __init__(self, metric_names: List[str]):
+        self.Columns = self.KeyColumns + metric_names
+        self.Rows = []
+
+    def add_rows(self, keys: List[tuple], values):
+        """
+        :param keys: key tuples
+        :param values: a (len(keys), metrics) array
+        """
+        for key, row in zip(keys, values.tolist()):
+            self.Rows.append(list(key) + row)
+
+    def return_column(self, name: str):
+        index = self.Columns.index(name)
+        return [row[index] for row in self.Rows]
+
+    def to_csv(self, csv_file_path: Union[str, bytes, os.PathLike]):
+        import csv
+        with open(csv_file_path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(self.Columns)
+            writer.writerows(self.Rows)
+
+    def to_dataframe(self):
+        import pandas
+        return pandas.DataFrame(self.Rows, columns=self.Columns)
+
+    def __len__(self):
+        return len(self.Rows)
+
+    def __repr__(self):
+        return f"DVHMetricTable with {len(self.Rows)} rows"
+
+
+def _compute_database_metrics(database: PatientDatabase, metrics: List[DVHMetric], roi_matcher,
+                              volume_unit: str = 'fraction'):
+    dose_rois, keys = return_dose_rois(database, roi_matcher)
+    dvh_stack = DVHStack(dose_rois, keys, volume_unit)
+    values = np.empty((len(dvh_stack), len(metrics)))
+    for column, metric in enumerate(metrics):
+        values[:, column] = metric.evaluate(dvh_stack)
+    return keys, values
+
+
+def compute_dvh_metrics(databases: PatientDatabases or PatientDatabase, metrics: List[str], roi_matcher,
+                        thread_count: int = 1, volume_unit: str = 'fraction') -> DVHMetricTable:
+    """
+    Compute DVH metrics for every matching ROI dose across a cohort, each metric is evaluated for all DVHs of a
+    database at once
+    :param databases:
+    :param metrics: expressions such as ['D95', 'V20Gy', 'Dmean', 'Dmax'], see DVHMetric
+    :param roi_matcher: see return_roi_matcher
+    :param thread_count: number of databases evaluated at the same time
+    :param volume_unit: 'fraction' or 'percent', the unit of the stored RelativeVolumes
+    :return:
+    """
+    metrics = [DVHMetric(i) for i in metrics]
+    if isinstance(databases, PatientDatabases):
+        database_list = list(databases.Databases.values())
+    else:
+        database_list = [databases]
+    table = DVHMetricTable([i.Expression for i in metrics])
+    if thread_count > 1:
+        with ThreadPoolExecutor(max_workers=thread_count) as executor:
+            results = list(executor.map(lambda db: _compute_database_metrics(db, metrics, roi_matcher,
+                                                                             volume_unit), database_list))
+    else:
+        results = [_compute_database_metrics(db, metrics, roi_matcher, volume_unit) for db in database_list]
+    for keys, values in results:
+        table.add_rows(keys, values)
+    return table
+
+
+if __name__ == '__main__':
+    pass
@@ -3,31 +3,159 @@ try:
     from tqdm import tqdm
 except:
     tqdm = None
-try:
-    from threading import Thread
-    from queue import *
-    from multiprocessing import cpu_count
-except ImportError:
-    print("Unable to potentially load data in parallel")
-    load_parallel = False
 try:
     import shutil
 except ImportError:
     print("Unable to import shuttle, cannot update local database")
+try:
+    import hashlib
+except ImportError:
+    print("Unable to import hashlib, cannot hash files when updating the local database")
+SYNC_MANIFEST_NAME = 'SyncManifest.json'
+
+
+class RoiIndex(object):
+    """
+    An inverted index over the headers of PatientHeaderDatabases
+    ROINames maps a lower case ROI name to [database name, RS_UID, case index, lower case ROI type] postings
+    ROITypes, BodySites, and POINames map their lower case value to [database name, RS_UID, case index] postings
+    Sources records which header file each patient was indexed from and a digest of the cases indexed, so update only
+    re-indexes what changed, on disk or in memory (delete_unapproved_cases, predicates)
+    """
+    ROINames: Dict[str, List[list]]
+    ROITypes: Dict[str, List[list]]
+    BodySites: Dict[str, List[list]]
+    POINames: Dict[str, List[list]]
+    Sources: Dict[str, Dict[str, str]]
+
+    def __init__(self):
+        self.ROINames = {}
+        self.ROITypes = {}
+        self.BodySites = {}
+        self.POINames = {}
+        self.Sources = {}
+
+    @staticmethod
+    def return_source(patient_header: PatientHeader) -> str:
+        """
+        '<header file name>:<digest of the indexed body sites, ROIs, and POIs of each case>'
+        """
+        cases = [[case.BodySite, [[roi.Name, roi.Type] for roi in case.ROIS], list(case.POIS)]
+                 for case in patient_header.Cases]
+        return os.path.basename(getattr(patient_header, 'FilePath', '')) + ':' + return_content_hash(cases)
+
+    def add_patient_header(self, db_name: str, patient_header: PatientHeader):
+        rs_uid = patient_header.RS_UID
+        self.Sources.setdefault(db_name, {})[rs_uid] = self.return_source(patient_header)
+        for case_index, case in enumerate(patient_header.Cases):
+            self.BodySites.setdefault(str(case.BodySite).lower(), []).append([db_name, rs_uid, case_index])
+            for roi in case.ROIS:
+                roi_type = roi.Type.lower()
+                self.ROINames.setdefault(roi.Name.lower(), []).append([db_name, rs_uid, case_index, roi_type])
+                self.ROITypes.setdefault(roi_type, []).append([db_name, rs_uid, case_index])
+            for poi_name in case.POIS:
+                self.POINames.setdefault(poi_name.lower(), []).append([db_name, rs_uid, case_index])
+
+    def _remove_patients(self, stale: set):
+        for postings_dict in (self.ROINames, self.ROITypes, self.BodySites, self.POINames):
+            for key in list(postings_dict.keys()):
+                postings = [i for i in postings_dict[key] if (i[0], i[1]) not in stale]
+                if postings:
+                    postings_dict[key] = postings
+                else:
+                    postings_dict.pop(key)
+        for db_name, rs_uid in stale:
+            self.Sources[db_name].pop(rs_uid, None)
+
+    def update(self, header_databases: PatientHeaderDatabases):
+        """
+        Index any patient that is new, or whose header file or cases changed, and drop patients no longer present
+        :param header_databases:
+        :return: number of patients (re)indexed
+        """
+        stale = set()
+        changed = []
+        for db_name, header_database in header_databases.HeaderDatabases.items():
+            sources = self.Sources.get(db_name, {})
+            for rs_uid in sources:
+                if rs_uid not in header_database.PatientHeaders:
+                    stale.add((db_name, rs_uid))
+            for rs_uid, pat in header_database.PatientHeaders.items():
+                if sources.get(rs_uid) != self.return_source(pat):
+                    if rs_uid in sources:
+                        stale.add((db_name, rs_uid))
+                    changed.append((db_name, pat))
+        if stale:
+            self._remove_patients(stale)
+        for db_name, pat in changed:
+            self.add_patient_header(db_name, pat)
+        return len(changed)
+
+    def build(self, header_databases: PatientHeaderDatabases):
+        self.__init__()
+        self.update(header_databases)
+
+    def return_patients(self, roi_names: Optional[List[str]] = None, roi_types: Optional[List[str]] = None,
+                        body_sites: Optional[List[str]] = None) -> set:
+        """
+        All (database name, RS_UID) with a case holding one of roi_names of one of roi_types, in one of body_sites
+        Names are matched as given against the lower case index, types and body sites are lower cased first
+        """
+        cases = None
+        if roi_names is not None:
+            roi_types_lower = None if roi_types is None else {i.lower() for i in roi_types}
+            cases = {(i[0], i[1], i[2]) for name in roi_names for i in self.ROINames.get(name, [])
+                     if roi_types_lower is None or i[3] in roi_types_lower}
+        elif roi_types is not None:
+            cases = {tuple(i) for roi_type in roi_types for i in self.ROITypes.get(roi_type.lower(), [])}
+        if body_sites is not None:
+            site_cases = {tuple(i) for body_site in body_sites for i in self.BodySites.get(body_site.lower(), [])}
+            cases = site_cases if cases is None else cases & site_cases
+        if cases is None:
+            return {(db_name, rs_uid) for db_name, sources in self.Sources.items() for rs_uid in sources}
+        return {(i[0], i[1]) for i in cases}
 
+    def save(self, index_file_path: Union[str, bytes, os.PathLike]):
+        write_file_atomic(index_file_path, json.dumps(self.__dict__))
 
-def find_all_rois(header_databases: PatientHeaderDatabases):
+    @classmethod
+    def load(cls, index_file_path: Union[str, bytes, os.PathLike]):
+        roi_index = cls()
+        with open(index_file_path, 'r') as json_file:
+            roi_index.__dict__.update(json.load(json_file))
+        return roi_index
+
+
+def return_roi_index(header_databases: PatientHeaderDatabases,
+                     index_file_path: Optional[Union[str, bytes, os.PathLike]] = None) -> RoiIndex:
+    """
+    Load the index saved at index_file_path (if any), bring it up to date with header_databases, and save it back
+    """
+    if index_file_path is not None and os.path.exists(index_file_path):
+        roi_index = RoiIndex.load(index_file_path)
+        changed = roi_index.update(header_databases)
+    else:
+        roi_index = RoiIndex()
+        changed = roi_index.update(header_databases)
+    if index_file_path is not None and changed:
+        roi_index.save(index_file_path)
+    return roi_index
+
+
+def find_all_rois(header_databases: PatientHeaderDatabases, roi_index: Optional[RoiIndex] = None):
     """
     :param header_databases:
+    :param roi_index: an index built from header_databases, one is built if not provided. Only the postings of patients
+    in header_databases are used, the index may cover more
     :return:
     """
-    all_rois = []
-    for header_database in header_databases.HeaderDatabases.values():
-        for pat in header_database.PatientHeaders.values():
-            for case in pat.Cases:
-                for roi in case.ROIS:
-                    if roi.Name.lower() not in all_rois:
-                        all_rois.append(roi.Name.lower())
+    if roi_index is None:
+        roi_index = RoiIndex()
+        roi_index.build(header_databases)
+    patients = {(db_name, rs_uid) for db_name, header_database in header_databases.HeaderDatabases.items()
+                for rs_uid in header_database.PatientHeaders}
+    all_rois = [name for name, postings in roi_index.ROINames.items()
+                if any((i[0], i[1]) in patients for i in postings)]
     """
     Remove PTV contours, opts, tuning structures, and DNU
     """
@@ -61,39 +189,45 @@ def update_database(network_path, local_path):
 
 
 def identify_wanted_headers(patient_header_dbs: PatientHeaderDatabases,
-                            wanted_roi_list: List[str], wanted_type: List[str]):
+                            wanted_roi_list: List[str], wanted_type: List[str], roi_index: Optional[RoiIndex] = None):
+    """
+    :param patient_header_dbs:
+    :param wanted_roi_list: lower case ROI names
+    :param wanted_type: ROI types, any case
+    :param roi_index: an index built from patient_header_dbs, one is built if not provided
+    :return:
+    """
+    if roi_index is None:
+        roi_index = RoiIndex()
+        roi_index.build(patient_header_dbs)
+    wanted_patients = roi_index.return_patients(roi_names=wanted_roi_list, roi_types=wanted_type)
     out_header_dbs = PatientHeaderDatabases()
-    wanted_type = [i.lower() for i in wanted_type]
     for pat_header_db in patient_header_dbs.HeaderDatabases.values():
         out_header_db = PatientHeaderDatabase(pat_header_db.DBName)
         for pat in pat_header_db.PatientHeaders.values():
-            has_roi = False
-            for case in pat.Cases:
-                wanted_rois = [r for r in case.ROIS if r.Name.lower() in wanted_roi_list and
-                               r.Type.lower() in wanted_type]
-                if wanted_rois:
-                    has_roi = True
-            if has_roi:
+            if (pat_header_db.DBName, pat.RS_UID) in wanted_patients:
                 out_header_db.PatientHeaders[pat.RS_UID] = pat
         out_header_dbs.HeaderDatabases[out_header_db.DBName] = out_header_db
     return out_header_dbs
 
 
-def copy_file(a):
-    q: Queue
-    q, pbar = a
-    update = False
-    if pbar is not None:
-        update = True
-    while True:
-        files_tuple = q.get()
-        if files_tuple is None:
-            break
-        db_file_path, local_file_path = files_tuple
-        if update:
-            pbar.update()
-        shutil.copy(db_file_path, local_file_path)
-        q.task_done()
+def copy_file_atomic(db_file_path: Union[str, bytes, os.PathLike], local_file_path: Union[str, bytes, os.PathLike]):
+    """
+    Copy to a temporary name next to the destination, then rename into place, so readers never see half a file
+    """
+    temp_file_path = os.fspath(local_file_path) + '.part'
+    try:
+        shutil.copyfile(db_file_path, temp_file_path)
+        os.replace(temp_file_path, local_file_path)
+    except BaseException:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        raise
+
+
+def copy_file_item(file_copy: tuple):
+    db_file_path, local_file_path = file_copy[:2]
+    copy_file_atomic(db_file_path, local_file_path)
 
 
 def check_case_has_approved(case: CaseClass or StrippedDownCase):
@@ -134,8 +268,110 @@ def return_plan_names_by_contains(patients: List[PatientHeader] or List[PatientC
     return plan_names
 
 
+def return_file_hash(file_path: Union[str, bytes, os.PathLike]) -> str:
+    file_hash = hashlib.sha1()
+    with open(file_path, 'rb') as hash_file:
+        for block in iter(lambda: hash_file.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+class SyncManifest(object):
+    """
+    What the local copy of one database holds: file name to [size, network modification time in ns, sha1 or None]
+    The size and time are those of the network file when it was copied, so an unchanged share needs no local listing
+    """
+    Files: Dict[str, list]
+
+    def __init__(self, local_db_path: Union[str, bytes, os.PathLike]):
+        self.ManifestPath = os.path.join(local_db_path, SYNC_MANIFEST_NAME)
+        self.Files = {}
+
+    def load(self) -> bool:
+        if not os.path.exists(self.ManifestPath):
+            return False
+        try:
+            with open(self.ManifestPath, 'r') as json_file:
+                self.Files = json.load(json_file)
+        except ValueError:
+            return False
+        return True
+
+    def save(self):
+        write_file_atomic(self.ManifestPath, json.dumps(self.Files))
+
+
+class DatabaseSyncPlan(object):
+    """
+    CopyFiles holds (network path, local path, size, modification time) with the size and time of the planning scan,
+    DeleteFiles the local file names to remove
+    """
+    def __init__(self, db_path, local_db_path, manifest: SyncManifest):
+        self.DBPath = db_path
+        self.LocalDBPath = local_db_path
+        self.Manifest = manifest
+        self.CopyFiles = []
+        self.DeleteFiles = []
+
+
+def plan_database_sync(db_path: Union[str, bytes, os.PathLike], local_db_path: Union[str, bytes, os.PathLike],
+                       use_hash: bool = False) -> DatabaseSyncPlan:
+    """
+    Decide which files of one database need to be copied or deleted
+    :param db_path: the network database folder
+    :param local_db_path: the local database folder
+    :param use_hash: if a file changed time but not size, compare its sha1 with the manifest before copying
+    :return:
+    """
+    if not os.path.exists(local_db_path):
+        os.makedirs(local_db_path)
+    db_catalog = return_directory_catalog(db_path, refresh=True)
+    """
+    A pack is copied or deleted whole, like any other file
+    """
+    db_files = dict(db_catalog.Files, **db_catalog.PackFiles)
+    manifest = SyncManifest(local_db_path)
+    if not manifest.load():
+        """
+        No manifest yet, trust any local file of the same name and size, as the previous name only check did
+        """
+        local_catalog = return_directory_catalog(local_db_path, refresh=True)
+        local_files = dict(local_catalog.Files, **local_catalog.PackFiles)
+        for file_name, (size, mtime) in local_files.items():
+            if file_name in db_files and db_files[file_name][0] == size:
+                manifest.Files[file_name] = [size, db_files[file_name][1], None]
+            elif file_name not in db_files:
+                manifest.Files[file_name] = [size, mtime, None]
+    sync_plan = DatabaseSyncPlan(db_path, local_db_path, manifest)
+    for file_name, (size, mtime) in db_files.items():
+        entry = manifest.Files.get(file_name)
+        if entry is not None and entry[0] == size and entry[1] == mtime:
+            continue
+        db_file_path = os.path.join(db_path, file_name)
+        if use_hash and entry is not None and entry[0] == size and entry[2] is not None:
+            if return_file_hash(db_file_path) == entry[2]:
+                entry[1] = mtime
+                continue
+        sync_plan.CopyFiles.append((db_file_path, os.path.join(local_db_path, file_name), size, mtime))
+    sync_plan.DeleteFiles = [i for i in manifest.Files if i not in db_files]
+    return sync_plan
+
+
 def update_local_database(local_database_path: Union[str, bytes, os.PathLike],
-                          network_database_path: Union[str, bytes, os.PathLike], tqdm=None):
+                          network_database_path: Union[str, bytes, os.PathLike], tqdm=None, use_hash: bool = False,
+                          worker_count: Optional[int] = None):
+    """
+    Bring the local copy up to date, copying only new or changed files and deleting files gone from the network
+    Compressed files are copied as they are, a file recompressed on the network arrives under its new name and its old
+    local copy is deleted. Pack files are copied whole, a folder packed on the network swaps its loose local files for
+    the packs
+    :param local_database_path:
+    :param network_database_path:
+    :param tqdm:
+    :param use_hash: record the sha1 of copied files, and use it to skip files whose time changed but content did not
+    :param worker_count: copies running at once, defaults to 80% of the cpu count
+    :return:
+    """
     try:
         import shutil
     except:
@@ -145,54 +381,47 @@ def update_local_database(local_database_path: Union[str, bytes, os.PathLike],
     for root, databases, files in os.walk(network_database_path):
         break
 
+    sync_plans = []
     copy_files = []
     for database in databases:
         print(f"Updating {database}")
-        db_path = os.path.join(network_database_path, database)
-        local_db_path = os.path.join(local_database_path, database)
-        if not os.path.exists(local_db_path):
-            os.makedirs(local_db_path)
-        db_files = os.listdir(db_path)
-        db_json_files = [i for i in db_files if i.endswith('.json')]
-        local_files = os.listdir(local_db_path)
-        local_json_files = [i for i in local_files if i.endswith('.json')]
-        for db_json_file in db_json_files:
-            """
-            If we do not have an instance of this file locally, copy it over
-            """
-            if db_json_file not in local_json_files:
-                db_file_path = os.path.join(db_path, db_json_file)
-                local_file_path = os.path.join(local_db_path, db_json_file)
-                copy_files.append((db_file_path, local_file_path))
-        for local_json_file in local_json_files:
+        sync_plan = plan_database_sync(os.path.join(network_database_path, database),
+                                       os.path.join(local_database_path, database), use_hash)
+        sync_plans.append(sync_plan)
+        copy_files += sync_plan.CopyFiles
+    copied = []
+    """
+    Open packs are closed first, on Windows a file that is mapped cannot be replaced or deleted
+    """
+    from .PatientPack import clear_patient_packs
+    clear_patient_packs()
+    pbar = None
+    if tqdm is not None:
+        pbar = tqdm(total=len(copy_files), desc='Adding patients from network databases')
+    run_pipeline(copy_files, copy_file_item, lambda file_copy, _: copied.append(file_copy), worker_count=worker_count,
+                 pbar=pbar, description='Copying from network databases')
+    copied = set(copied)
+    for sync_plan in sync_plans:
+        manifest = sync_plan.Manifest
+        for file_copy in sync_plan.CopyFiles:
+            if file_copy not in copied:
+                continue
             """
-            If this file does no exist in the database, delete it
+            The size and time seen when planning, a file changed on the network since is then copied next time
             """
-            if local_json_file not in db_json_files:
-                os.remove(os.path.join(local_db_path, local_json_file))
-    if load_parallel:
-        pbar = None
-        if tqdm is not None:
-            pbar = tqdm(total=len(copy_files), desc='Adding patients from network databases')
-        if load_parallel:
-            thread_count = int(cpu_count() * 0.8 - 1)
-            q = Queue(maxsize=thread_count)
-            threads = []
-            a = (q, pbar)
-            for worker in range(thread_count):
-                t = Thread(target=copy_file, args=(a,))
-                t.start()
-                threads.append(t)
-            for file_copy in copy_files:
-                q.put(file_copy)
-            for _ in range(thread_count):
-                q.put(None)
-            for t in threads:
-                t.join()
-    else:
-        for file_copy in copy_files:
-            db_file_path, local_file_path = file_copy
-            shutil.copy(db_file_path, local_file_path)
+            db_file_path, local_file_path, size, mtime = file_copy
+            file_hash = return_file_hash(local_file_path) if use_hash else None
+            manifest.Files[os.path.basename(local_file_path)] = [size, mtime, file_hash]
+        """
+        Deletions go after the copies, so a patient's new file is in place before its old one goes
+        """
+        for file_name in sync_plan.DeleteFiles:
+            try:
+                os.remove(os.path.join(sync_plan.LocalDBPath, file_name))
+            except FileNotFoundError:
+                pass
+            manifest.Files.pop(file_name, None)
+        manifest.save()
     today = DateTimeClass()
     today.from_python_datetime(datetime.today())
     last_update_date = os.path.join(local_database_path, "Last_Updated.txt")
@@ -0,0 +1,493 @@
+import mmap
+import sys
+from array import array
+from .AbstractBase import *
+
+"""
+A columnar binary copy of the flattened _Header.json files of one database folder
+
+Layout: MAGIC, a uint64 giving the length of a small json table of contents, the table of contents, then every column
+aligned to 8 bytes. Integer columns are int64 arrays, string columns are an int64 offsets array (rows + 1), a utf-8
+blob, and a uint8 null mask. The categorical string columns (DICTIONARY_COLUMNS) are dictionary encoded instead: an
+int64 code per row (-1 for None) and a string column holding each distinct value once. Nested data (cases in a
+patient, rois/pois/plans in a case) is stored as an offsets column in the parent, the same way the string columns are.
+The treatment notes of a patient are kept as one json string. A header the columns cannot give back exactly (an
+attribute they do not hold, a value of another type) is flagged in the Exact column, and read from its json file instead
+"""
+MAGIC = b'AISHCACH'
+CACHE_VERSION = 4
+CACHE_FILE_NAME = 'HeaderCache.bin'
+
+PATIENT_STRING_COLUMNS = ('FileName', 'MRN', 'RS_UID', 'Name_First', 'Name_Last', 'ContentHash', 'TreatmentNotes')
+CASE_STRING_COLUMNS = ('CaseName', 'BodySite')
+ROI_STRING_COLUMNS = ('ROIName', 'ROIType')
+POI_STRING_COLUMNS = ('POIName',)
+PLAN_STRING_COLUMNS = ('PlanName', 'PlannedBy', 'ApprovalStatus', 'ReviewerName')
+DATE_FIELDS = ('year', 'month', 'day', 'hour', 'minute', 'second')
+DICTIONARY_COLUMNS = ('CaseName', 'BodySite', 'ROIName', 'ROIType', 'POIName', 'PlannedBy', 'ApprovalStatus',
+                      'ReviewerName')
+"""
+ReviewFields bits of a plan: it has a Review, and which of the Review attributes are set
+"""
+HAS_REVIEW = 1
+HAS_APPROVAL_STATUS = 2
+HAS_REVIEWER_NAME = 4
+HAS_REVIEW_TIME = 8
+PATIENT_ATTRIBUTES = ('MRN', 'RS_UID', 'Name_First', 'Name_Last', 'ContentHash', 'Gender', 'DateLastModified',
+                      'DateOfBirth', 'Cases', 'TreatmentNotes', 'FilePath', 'QCL_List')
+CASE_ATTRIBUTES = ('CaseName', 'BodySite', 'ROIS', 'POIS', 'TreatmentPlans')
+PLAN_ATTRIBUTES = ('PlanName', 'PlannedBy', 'Review')
+REVIEW_ATTRIBUTES = ('ApprovalStatus', 'ReviewerName', 'ReviewTime')
+
+
+def _pad(length: int):
+    return (8 - length % 8) % 8
+
+
+def _return_date_values(date_time):
+    if date_time is None:
+        return [0, 1, 1, 0, 0, 0]
+    return [getattr(date_time, i, 0) for i in DATE_FIELDS]
+
+
+def _check_strings(value, attributes) -> bool:
+    return all(isinstance(getattr(value, i, None), (str, type(None))) for i in attributes)
+
+
+def check_header_is_cacheable(header: PatientHeader) -> bool:
+    """
+    True if PatientHeaderCache.return_header gives back a header equal to this one: no attributes beyond the ones the
+    columns hold, the ones the reader always sets are set, strings are strings and dates are DateTimeClass
+    """
+    attributes = header.__dict__
+    if not set(attributes).issubset(PATIENT_ATTRIBUTES):
+        return False
+    if any(i in attributes and not isinstance(attributes[i], str)
+           for i in ('MRN', 'RS_UID', 'Name_First', 'Name_Last', 'ContentHash')):
+        return False
+    if type(attributes.get('Gender')) is not int or type(attributes.get('DateLastModified')) is not DateTimeClass \
+            or type(attributes.get('DateOfBirth')) is not DateTimeClass:
+        return False
+    if not all(type(i) is TreatmentNoteClass for i in header.TreatmentNotes):
+        return False
+    for case in header.Cases:
+        if type(case) is not StrippedDownCase or set(case.__dict__) != set(CASE_ATTRIBUTES) \
+                or not _check_strings(case, ('CaseName', 'BodySite')):
+            return False
+        if not all(type(roi) is StrippedDownRegionOfInterest and hasattr(roi, 'Name') and hasattr(roi, 'Type')
+                   and _check_strings(roi, ('Name', 'Type')) for roi in case.ROIS):
+            return False
+        if not all(isinstance(i, (str, type(None))) for i in case.POIS):
+            return False
+        for plan in case.TreatmentPlans:
+            if type(plan) is not StrippedDownPlan or set(plan.__dict__) != set(PLAN_ATTRIBUTES) \
+                    or not _check_strings(plan, ('PlanName', 'PlannedBy')):
+                return False
+            review = plan.Review
+            if review is None:
+                continue
+            if type(review) is not ReviewClass or not set(review.__dict__).issubset(REVIEW_ATTRIBUTES) \
+                    or not _check_strings(review, ('ApprovalStatus', 'ReviewerName')):
+                return False
+            if 'ReviewTime' in review.__dict__ and type(review.ReviewTime) is not DateTimeClass:
+                return False
+    return True
+
+
+class PatientHeaderCacheWriter(object):
+    def __init__(self):
+        self.Strings = {}
+        self.Integers = {}
+        for name in PATIENT_STRING_COLUMNS + CASE_STRING_COLUMNS + ROI_STRING_COLUMNS + POI_STRING_COLUMNS + \
+                PLAN_STRING_COLUMNS:
+            self.Strings[name] = []
+        for name in ('FileMTime', 'Exact', 'Gender', 'DateLastModified', 'DateOfBirth', 'ReviewFields', 'ReviewTime'):
+            self.Integers[name] = array('q')
+        for name in ('CaseOffsets', 'ROIOffsets', 'POIOffsets', 'PlanOffsets'):
+            self.Integers[name] = array('q', [0])
+
+    def add_header(self, file_name: str, file_mtime: int, header: PatientHeader, exact: Optional[bool] = None):
+        """
+        :param exact: whether the cache holds all of header, checked with check_header_is_cacheable if None
+        """
+        if exact is None:
+            exact = check_header_is_cacheable(header)
+        strings = self.Strings
+        integers = self.Integers
+        strings['FileName'].append(file_name)
+        strings['MRN'].append(getattr(header, 'MRN', None))
+        strings['RS_UID'].append(getattr(header, 'RS_UID', None))
+        strings['Name_First'].append(getattr(header, 'Name_First', None))
+        strings['Name_Last'].append(getattr(header, 'Name_Last', None))
+        strings['ContentHash'].append(getattr(header, 'ContentHash', None))
+        treatment_notes = getattr(header, 'TreatmentNotes', None)
+        strings['TreatmentNotes'].append(json.dumps([i.to_dict() for i in treatment_notes]) if exact and treatment_notes
+                                         else None)
+        integers['FileMTime'].append(file_mtime)
+        integers['Exact'].append(int(exact))
+        integers['Gender'].append(getattr(header, 'Gender', -1))
+        integers['DateLastModified'].extend(_return_date_values(getattr(header, 'DateLastModified', None)))
+        integers['DateOfBirth'].extend(_return_date_values(getattr(header, 'DateOfBirth', None)))
+        for case in header.Cases:
+            strings['CaseName'].append(getattr(case, 'CaseName', None))
+            strings['BodySite'].append(getattr(case, 'BodySite', None))
+            for roi in case.ROIS:
+                strings['ROIName'].append(getattr(roi, 'Name', None))
+                strings['ROIType'].append(getattr(roi, 'Type', None))
+            strings['POIName'].extend(case.POIS)
+            for plan in case.TreatmentPlans:
+                strings['PlanName'].append(getattr(plan, 'PlanName', None))
+                strings['PlannedBy'].append(getattr(plan, 'PlannedBy', None))
+                review = getattr(plan, 'Review', None)
+                review_fields = 0
+                if review is not None:
+                    review_fields = HAS_REVIEW
+                    review_attributes = getattr(review, '__dict__', {})
+                    for attribute, bit in (('ApprovalStatus', HAS_APPROVAL_STATUS),
+                                           ('ReviewerName', HAS_REVIEWER_NAME), ('ReviewTime', HAS_REVIEW_TIME)):
+                        if attribute in review_attributes:
+                            review_fields |= bit
+                strings['ApprovalStatus'].append(getattr(review, 'ApprovalStatus', None))
+                strings['ReviewerName'].append(getattr(review, 'ReviewerName', None))
+                integers['ReviewFields'].append(review_fields)
+                integers['ReviewTime'].extend(_return_date_values(getattr(review, 'ReviewTime', None)))
+            integers['ROIOffsets'].append(len(strings['ROIName']))
+            integers['POIOffsets'].append(len(strings['POIName']))
+            integers['PlanOffsets'].append(len(strings['PlanName']))
+        integers['CaseOffsets'].append(len(strings['CaseName']))
+
+    def write(self, cache_file_path: Union[str, bytes, os.PathLike]):
+        blocks = []
+        contents = {'version': CACHE_VERSION, 'byteorder': sys.byteorder,
+                    'rows': len(self.Strings['FileName']), 'columns': {}}
+        position = 0
+
+        def add_block(block: bytes):
+            nonlocal position
+            start = position
+            blocks.append(block)
+            blocks.append(b'\0' * _pad(len(block)))
+            position += len(block) + _pad(len(block))
+            return start
+
+        for name, values in self.Integers.items():
+            contents['columns'][name] = {'kind': 'q', 'offset': add_block(values.tobytes()), 'count': len(values)}
+
+        def add_string_column(values: list) -> dict:
+            offsets = array('q', [0])
+            nulls = bytearray(len(values))
+            encoded = []
+            length = 0
+            for index, value in enumerate(values):
+                if value is None:
+                    nulls[index] = 1
+                else:
+                    value = str(value).encode('utf-8')
+                    encoded.append(value)
+                    length += len(value)
+                offsets.append(length)
+            return {'kind': 'S', 'count': len(values), 'offset': add_block(offsets.tobytes()),
+                    'data': add_block(b''.join(encoded)), 'data_length': length, 'nulls': add_block(bytes(nulls))}
+
+        for name, values in self.Strings.items():
+            if name in DICTIONARY_COLUMNS:
+                symbol_table = SymbolTable()
+                codes = array('q', [symbol_table.return_code(None if i is None else str(i)) for i in values])
+                contents['columns'][name] = {'kind': 'D', 'count': len(values),
+                                             'offset': add_block(codes.tobytes()),
+                                             'values': add_string_column(symbol_table.Values)}
+            else:
+                contents['columns'][name] = add_string_column(values)
+        table_of_contents = json.dumps(contents).encode('utf-8')
+        table_of_contents += b' ' * _pad(len(MAGIC) + 8 + len(table_of_contents))
+        prefix = MAGIC + array('Q', [len(table_of_contents)]).tobytes() + table_of_contents
+        temp_file_path = cache_file_path + '.tmp'
+        with open(temp_file_path, 'wb') as cache_file:
+            cache_file.write(prefix)
+            for block in blocks:
+                cache_file.write(block)
+        os.replace(temp_file_path, cache_file_path)
+
+
+class PatientHeaderCache(object):
+    """
+    Read only, memory mapped view of a header cache file. Columns are memoryviews straight onto the map
+    The values of the dictionary encoded columns are decoded once, into symbol_table if one is given, so every header
+    built from the cache shares them
+    """
+    def __init__(self, cache_file_path: Union[str, bytes, os.PathLike], symbol_table: Optional[SymbolTable] = None):
+        self.CacheFilePath = cache_file_path
+        self.SymbolTable = symbol_table
+        self._dictionaries = {}
+        self._file = open(cache_file_path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._columns = {}
+        try:
+            if bytes(self._view[:len(MAGIC)]) != MAGIC:
+                raise ValueError(f"{cache_file_path} is not a header cache")
+            toc_length = self._view[len(MAGIC):len(MAGIC) + 8].cast('Q')[0]
+            data_start = len(MAGIC) + 8 + toc_length
+            contents = json.loads(bytes(self._view[len(MAGIC) + 8:data_start]))
+            if contents['version'] != CACHE_VERSION or contents['byteorder'] != sys.byteorder:
+                raise ValueError(f"{cache_file_path} was written by a different version")
+        except Exception:
+            self.close()
+            raise
+        self.Rows = contents['rows']
+
+        def return_string_column(column: dict):
+            offsets_start = data_start + column['offset']
+            offsets = self._view[offsets_start:offsets_start + 8 * (column['count'] + 1)].cast('q')
+            data_start_string = data_start + column['data']
+            data = self._view[data_start_string:data_start_string + column['data_length']]
+            nulls_start = data_start + column['nulls']
+            nulls = self._view[nulls_start:nulls_start + column['count']]
+            return offsets, data, nulls
+
+        for name, column in contents['columns'].items():
+            start = data_start + column['offset']
+            if column['kind'] == 'q':
+                self._columns[name] = self._view[start:start + 8 * column['count']].cast('q')
+            elif column['kind'] == 'D':
+                self._columns[name] = self._view[start:start + 8 * column['count']].cast('q')
+                offsets, data, nulls = return_string_column(column['values'])
+                values = [str(data[offsets[i]:offsets[i + 1]], 'utf-8') for i in range(column['values']['count'])]
+                if symbol_table is not None:
+                    values = [symbol_table.intern(i) for i in values]
+                self._dictionaries[name] = values
+                for view in (offsets, data, nulls):
+                    view.release()
+            else:
+                self._columns[name] = return_string_column(column)
+
+    def __len__(self):
+        return self.Rows
+
+    def return_string(self, name: str, index: int) -> Optional[str]:
+        if name in self._dictionaries:
+            code = self._columns[name][index]
+            return None if code < 0 else self._dictionaries[name][code]
+        offsets, data, nulls = self._columns[name]
+        if nulls[index]:
+            return None
+        return str(data[offsets[index]:offsets[index + 1]], 'utf-8')
+
+    def return_integers(self, name: str):
+        return self._columns[name]
+
+    def return_codes(self, name: str):
+        """
+        The int64 codes of a dictionary encoded column and the value of each code, for filtering by integer compare
+        """
+        return self._columns[name], self._dictionaries[name]
+
+    def check_exact(self, row: int) -> bool:
+        """
+        False if the header of row has more than the cache holds, and has to be read from its json file
+        """
+        return bool(self._columns['Exact'][row])
+
+    def return_file_mtimes(self) -> Dict[str, int]:
+        file_mtimes = self._columns['FileMTime']
+        return {self.return_string('FileName', row): file_mtimes[row] for row in range(self.Rows)}
+
+    def _return_date(self, name: str, row: int) -> DateTimeClass:
+        values = self._columns[name][6 * row:6 * row + 6]
+        date_time = DateTimeClass()
+        for attribute, value in zip(DATE_FIELDS, values):
+            setattr(date_time, attribute, value)
+        return date_time
+
+    def return_header(self, row: int) -> PatientHeader:
+        header = PatientHeader()
+        for attribute in ('MRN', 'RS_UID', 'Name_First', 'Name_Last', 'ContentHash'):
+            value = self.return_string(attribute, row)
+            if value is not None:
+                setattr(header, attribute, value)
+        header.Gender = self._columns['Gender'][row]
+        header.DateLastModified = self._return_date('DateLastModified', row)
+        header.DateOfBirth = self._return_date('DateOfBirth', row)
+        treatment_notes = self.return_string('TreatmentNotes', row)
+        if treatment_notes is not None:
+            header.TreatmentNotes = [TreatmentNoteClass.from_json(i) for i in json.loads(treatment_notes)]
+            if self.SymbolTable is not None:
+                self.SymbolTable.intern_object(header.TreatmentNotes)
+        review_fields = self._columns['ReviewFields']
+        case_offsets = self._columns['CaseOffsets']
+        roi_offsets = self._columns['ROIOffsets']
+        poi_offsets = self._columns['POIOffsets']
+        plan_offsets = self._columns['PlanOffsets']
+        for case_index in range(case_offsets[row], case_offsets[row + 1]):
+            case = StrippedDownCase()
+            case.CaseName = self.return_string('CaseName', case_index)
+            case.BodySite = self.return_string('BodySite', case_index)
+            for roi_index in range(roi_offsets[case_index], roi_offsets[case_index + 1]):
+                roi = StrippedDownRegionOfInterest()
+                roi.Name = self.return_string('ROIName', roi_index)
+                roi.Type = self.return_string('ROIType', roi_index)
+                case.ROIS.append(roi)
+            case.POIS = [self.return_string('POIName', i) for i in range(poi_offsets[case_index],
+                                                                          poi_offsets[case_index + 1])]
+            for plan_index in range(plan_offsets[case_index], plan_offsets[case_index + 1]):
+                plan = StrippedDownPlan()
+                plan.PlanName = self.return_string('PlanName', plan_index)
+                plan.PlannedBy = self.return_string('PlannedBy', plan_index)
+                plan.Review = None
+                plan_review_fields = review_fields[plan_index]
+                if plan_review_fields & HAS_REVIEW:
+                    plan.Review = ReviewClass()
+                    if plan_review_fields & HAS_APPROVAL_STATUS:
+                        plan.Review.ApprovalStatus = self.return_string('ApprovalStatus', plan_index)
+                    if plan_review_fields & HAS_REVIEWER_NAME:
+                        plan.Review.ReviewerName = self.return_string('ReviewerName', plan_index)
+                    if plan_review_fields & HAS_REVIEW_TIME:
+                        plan.Review.ReviewTime = self._return_date('ReviewTime', plan_index)
+                case.TreatmentPlans.append(plan)
+            header.Cases.append(case)
+        return header
+
+    def close(self):
+        for column in self._columns.values():
+            if isinstance(column, tuple):
+                for view in column:
+                    view.release()
+            else:
+                column.release()
+        self._columns = {}
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+
+def return_cache_file_path(directory_path: Union[str, bytes, os.PathLike],
+                           cache_directory: Optional[Union[str, bytes, os.PathLike]] = None):
+    """
+    The cache sits in the database folder, unless a separate (local, writable) cache_directory is given
+    """
+    if cache_directory is None:
+        return os.path.join(directory_path, CACHE_FILE_NAME)
+    if not os.path.exists(cache_directory):
+        os.makedirs(cache_directory)
+    db_name = os.path.basename(os.path.normpath(directory_path))
+    return os.path.join(cache_directory, f"{db_name}_{CACHE_FILE_NAME}")
+
+
+def update_header_cache(directory_path: Union[str, bytes, os.PathLike],
+                        cache_directory: Optional[Union[str, bytes, os.PathLike]] = None,
+                        tqdm=None, symbol_table: Optional[SymbolTable] = None,
+                        codec: Optional[Union[str, JsonCodec]] = None,
+                        report: Optional[LoadReport] = None) -> PatientHeaderCache:
+    """
+    Open the header cache for a database folder, only re-parsing the _Header.json files that are new or whose
+    modification time changed since the cache was written
+    :param directory_path:
+    :param cache_directory:
+    :param tqdm:
+    :param symbol_table: where the values of the dictionary encoded columns are interned
+    :param codec: the JsonCodec (or its name) that parses the changed headers
+    :param report: a LoadReport the headers that could not be read are added to as failures, they stay out of the cache
+    and are tried again next time
+    :return:
+    """
+    cache_file_path = return_cache_file_path(directory_path, cache_directory)
+    catalog = return_directory_catalog(directory_path, refresh=True)
+    header_files = {file_name: catalog.return_mtime(file_name) for file_names in catalog.HeaderFiles.values()
+                    for file_name in file_names}
+    cache = None
+    cached_files = {}
+    if os.path.exists(cache_file_path):
+        try:
+            cache = PatientHeaderCache(cache_file_path, symbol_table)
+            cached_files = cache.return_file_mtimes()
+        except (ValueError, KeyError, IndexError, TypeError):
+            cache = None
+    if cache is not None and cached_files == header_files:
+        return cache
+    changed_files = [i for i in header_files if cached_files.get(i) != header_files[i]]
+    print(f"Updating header cache with {len(changed_files)} files")
+    pbar = None
+    if tqdm is not None:
+        pbar = tqdm(total=len(changed_files), desc='Caching headers from ' + os.path.basename(directory_path))
+    writer = PatientHeaderCacheWriter()
+    if cache is not None:
+        for row in range(len(cache)):
+            file_name = cache.return_string('FileName', row)
+            if header_files.get(file_name) == cached_files[file_name]:
+                writer.add_header(file_name, cached_files[file_name], cache.return_header(row), cache.check_exact(row))
+        cache.close()
+    for file_name in changed_files:
+        try:
+            header = PatientHeader.from_json_file(os.path.join(directory_path, file_name), codec=codec)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as error:
+            header = None
+            if report is not None:
+                report.add_failure(os.path.join(directory_path, file_name), error)
+        if header is not None:
+            writer.add_header(file_name, header_files[file_name], header)
+        if pbar is not None:
+            pbar.update()
+    writer.write(cache_file_path)
+    return PatientHeaderCache(cache_file_path, symbol_table)
+
+
+def load_header_database_from_cache(header_database: PatientHeaderDatabase,
+                                    directory_path: Union[str, bytes, os.PathLike],
+                                    wanted_files: Optional[List[str]] = None,
+                                    cache_directory: Optional[Union[str, bytes, os.PathLike]] = None,
+                                    tqdm=None, predicate: Optional[LoadPredicate] = None) -> LoadReport:
+    """
+    Fill a PatientHeaderDatabase from the header cache instead of the json files, headers the cache does not hold
+    exactly are read from their json files
+    :param header_database:
+    :param directory_path:
+    :param wanted_files: _Header.json file names to load, None for all
+    :param cache_directory:
+    :param tqdm:
+    :param predicate: the date range is checked on the cache columns, before the header is built
+    :return: a LoadReport, with the headers that could not be read as failures
+    """
+    report = LoadReport('Adding patient headers from the cache of ' + header_database.DBName)
+    start_time = time.time()
+    cache = update_header_cache(directory_path, cache_directory, tqdm, header_database.SymbolTable,
+                                header_database.Codec, report)
+    report.Total = len(report.Failures)
+    if wanted_files is not None:
+        wanted_files = set(wanted_files)
+    try:
+        dates = cache.return_integers('DateLastModified')
+        for row in range(len(cache)):
+            file_name = cache.return_string('FileName', row)
+            if wanted_files is not None and file_name not in wanted_files:
+                continue
+            report.Total += 1
+            file_path = os.path.join(directory_path, file_name)
+            if not cache.check_exact(row):
+                try:
+                    patient_header = load_patient_header_file(file_path, header_database.SymbolTable, predicate,
+                                                              header_database.Codec)
+                except (OSError, ValueError, KeyError, TypeError, AttributeError) as error:
+                    report.add_failure(file_path, error)
+                    continue
+            elif predicate is not None and not predicate.accepts_date(tuple(dates[row * 6:row * 6 + 6])):
+                patient_header = None
+            else:
+                patient_header = cache.return_header(row)
+                if predicate is not None and not predicate.filter_object(patient_header):
+                    patient_header = None
+            report.Succeeded += 1
+            if patient_header is None:
+                report.Rejected += 1
+                continue
+            patient_header.FilePath = file_path
+            header_database.PatientHeaders[patient_header.RS_UID] = patient_header
+    finally:
+        cache.close()
+    report.Seconds = time.time() - start_time
+    if report.Failures:
+        print(report)
+    return report
+
+
+if __name__ == '__main__':
+    pass
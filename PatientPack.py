@@ -0,0 +1,315 @@
+import mmap
+import struct
+from .AbstractBase import *
+
+"""
+Pack files bundle the patient, header, and QCL json files of many patients of one database folder, so a folder of 40k
+patients is a few dozen files to open over a share instead of 120k
+
+Layout: PACK_MAGIC, the records back to back, a json index, then a trailer of the index offset and length (two
+little endian uint64) and PACK_MAGIC again. Each record is one json file exactly as its loose file held it, compressed
+on its own with the pack's Compression so any one file can be read without the rest. The index maps each file name
+(without compression suffix) to [offset, length] of its record
+A pack sits in the database folder next to the loose files, and the files in it are addressed as
+<database folder>/Pack_000001.pack/<file name>, so the loaders, the DirectoryCatalog pairing and the QCL lookups treat
+them like any other file. Packs are never modified, pack_directory writes new ones
+"""
+PACK_MAGIC = b'AISPACK1'
+PACK_VERSION = 1
+PACK_PREFIX = 'Pack_'
+PACK_TRAILER = struct.Struct('<QQ8s')
+DEFAULT_MAX_PACK_BYTES = 1024 * 1024 * 1024
+
+
+def return_pack_name(pack_number: int) -> str:
+    return f"{PACK_PREFIX}{pack_number:06d}{PACK_SUFFIX}"
+
+
+def return_pack_number(pack_name: str) -> int:
+    try:
+        return int(pack_name[len(PACK_PREFIX):-len(PACK_SUFFIX)])
+    except ValueError:
+        return 0
+
+
+class PatientPackWriter(object):
+    """
+    Written next to pack_path and renamed into place by close, a pack is either complete or absent
+    :param pack_path:
+    :param compression: None, 'gz', or 'xz', applied to each record
+    :param compression_level: defaults to DEFAULT_COMPRESSION_LEVELS
+    """
+    def __init__(self, pack_path: Union[str, os.PathLike], compression: Optional[str] = None,
+                 compression_level: Optional[int] = None):
+        check_compression(compression)
+        self.PackPath = os.fspath(pack_path)
+        self.Compression = compression
+        self.CompressionLevel = compression_level
+        self.Files = {}
+        self.Bytes = len(PACK_MAGIC)
+        self._file = open(self.PackPath + '.tmp', 'wb')
+        self._file.write(PACK_MAGIC)
+
+    def add_file(self, file_name: str, data: bytes):
+        """
+        :param file_name: the name of the loose file, its compression suffix is dropped
+        :param data: the uncompressed json
+        """
+        record = compress_bytes(data, self.Compression, self.CompressionLevel)
+        self.Files[return_json_stem(file_name)] = [self.Bytes, len(record)]
+        self._file.write(record)
+        self.Bytes += len(record)
+
+    def close(self):
+        index = json.dumps({'version': PACK_VERSION, 'Compression': self.Compression,
+                            'Files': self.Files}).encode('utf-8')
+        self._file.write(index)
+        self._file.write(PACK_TRAILER.pack(self.Bytes, len(index), PACK_MAGIC))
+        self._file.close()
+        os.replace(self.PackPath + '.tmp', self.PackPath)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self.PackPath + '.tmp')
+
+
+class PatientPack(object):
+    """
+    Read only, memory mapped view of a pack file, safe to share between threads
+    Records are copied out of the map under a lock, so close never pulls the map from under a reader
+    """
+    def __init__(self, pack_path: Union[str, os.PathLike]):
+        self.PackPath = os.fspath(pack_path)
+        self._lock = Lock()
+        self._map = None
+        self._file = open(self.PackPath, 'rb')
+        try:
+            stat = os.fstat(self._file.fileno())
+            self.FileStat = (stat.st_size, stat.st_mtime_ns)
+            if stat.st_size < len(PACK_MAGIC) + PACK_TRAILER.size:
+                raise ValueError(f"{self.PackPath} is not a pack file")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self._file.close()
+            raise
+        try:
+            index_offset, index_length, magic = PACK_TRAILER.unpack(self._map[-PACK_TRAILER.size:])
+            if self._map[:len(PACK_MAGIC)] != PACK_MAGIC or magic != PACK_MAGIC:
+                raise ValueError(f"{self.PackPath} is not a pack file")
+            index = json.loads(self._map[index_offset:index_offset + index_length])
+            if index.get('version') != PACK_VERSION:
+                raise ValueError(f"{self.PackPath} was written by a different version")
+        except BaseException:
+            self.close()
+            raise
+        self.Compression = index['Compression']
+        self.Files = index['Files']
+
+    def __contains__(self, file_name: str) -> bool:
+        return file_name in self.Files
+
+    def __len__(self):
+        return len(self.Files)
+
+    def return_record(self, file_name: str) -> Optional[bytes]:
+        """
+        A copy of the stored (compressed) record of one file, None if the pack was closed
+        """
+        if file_name not in self.Files:
+            raise FileNotFoundError(os.path.join(self.PackPath, file_name))
+        offset, length = self.Files[file_name]
+        with self._lock:
+            if self._map is None:
+                return None
+            return self._map[offset:offset + length]
+
+    def return_bytes(self, file_name: str) -> bytes:
+        """
+        The uncompressed json of one file
+        """
+        record = self.return_record(file_name)
+        if record is None:
+            raise ValueError(f"{self.PackPath} is closed")
+        return decompress_bytes(record, self.Compression)
+
+    def return_catalog_files(self) -> Dict[str, tuple]:
+        """
+        Name to (stored size, pack modification time), what a DirectoryCatalog lists for a folder
+        """
+        return {file_name: (length, self.FileStat[1]) for file_name, (offset, length) in self.Files.items()}
+
+    def return_patient_file_names(self, rs_uid: str) -> Dict[str, Optional[str]]:
+        """
+        Random access by RS_UID: the 'Patient', 'Header' and 'QCLs' file names of its newest version in this pack, by
+        the date in the names
+        """
+        catalog = return_directory_catalog(self.PackPath)
+        header_files = catalog.return_header_files([rs_uid])
+        if not header_files:
+            raise KeyError(rs_uid)
+        header_file = max(header_files, key=return_file_date_key)
+        patient_file = catalog.return_file_name(header_file.replace('_Header.json', '.json'))
+        qcl_file = catalog.return_file_name(header_file.replace('_Header.json', 'QCLs.json'))
+        return {'Patient': patient_file, 'Header': header_file, 'QCLs': qcl_file}
+
+    def load_patient(self, rs_uid: str, symbol_table: Optional[SymbolTable] = None,
+                     codec: Optional[Union[str, JsonCodec]] = None) -> PatientClass:
+        file_name = self.return_patient_file_names(rs_uid)['Patient']
+        if file_name is None:
+            raise KeyError(rs_uid)
+        return load_patient_file(os.path.join(self.PackPath, file_name), symbol_table, codec=codec)
+
+    def load_patient_header(self, rs_uid: str, symbol_table: Optional[SymbolTable] = None,
+                            codec: Optional[Union[str, JsonCodec]] = None) -> PatientHeader:
+        file_name = self.return_patient_file_names(rs_uid)['Header']
+        return load_patient_header_file(os.path.join(self.PackPath, file_name), symbol_table, codec=codec)
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+
+
+_patient_packs: Dict[str, PatientPack] = {}
+_patient_pack_lock = Lock()
+
+
+def return_patient_pack(pack_path: Union[str, os.PathLike]) -> PatientPack:
+    """
+    The open PatientPack of a path, reopened if the file was replaced since
+    """
+    key = os.path.abspath(os.fspath(pack_path))
+    stat = os.stat(key)
+    with _patient_pack_lock:
+        patient_pack = _patient_packs.get(key)
+        if patient_pack is not None and patient_pack.FileStat == (stat.st_size, stat.st_mtime_ns):
+            return patient_pack
+        if patient_pack is not None:
+            # Readers on other threads may still hold the old pack, it is not closed here but with its last reference
+            _patient_packs.pop(key)
+        patient_pack = PatientPack(key)
+        _patient_packs[key] = patient_pack
+    return patient_pack
+
+
+def clear_patient_packs():
+    """
+    Close every open pack, on Windows a pack cannot be replaced or removed while it is open
+    A reader still holding a closed pack gets None from return_record, read_packed_file then opens the pack again
+    """
+    with _patient_pack_lock:
+        for patient_pack in _patient_packs.values():
+            patient_pack.close()
+        _patient_packs.clear()
+
+
+def read_packed_file(pack_path: Union[str, os.PathLike], file_name: str) -> bytes:
+    file_name = return_json_stem(file_name)
+    record = None
+    while record is None:
+        patient_pack = return_patient_pack(pack_path)
+        record = patient_pack.return_record(file_name)
+    return decompress_bytes(record, patient_pack.Compression)
+
+
+def return_pack_files(pack_path: Union[str, os.PathLike]) -> Dict[str, tuple]:
+    return return_patient_pack(pack_path).return_catalog_files()
+
+
+def return_loose_file_bytes(file_path: str) -> bytes:
+    """
+    The uncompressed json of a loose or packed file, byte for byte
+    """
+    pack_path, file_name = os.path.split(file_path)
+    if pack_path.endswith(PACK_SUFFIX):
+        return read_packed_file(pack_path, file_name)
+    with open(file_path, 'rb') as json_file:
+        return decompress_bytes(json_file.read(), return_compression(file_path))
+
+
+def pack_directory(directory_path: Union[str, bytes, os.PathLike], compression: Optional[str] = None,
+                   compression_level: Optional[int] = None, max_pack_bytes: int = DEFAULT_MAX_PACK_BYTES,
+                   remove_files: bool = True, repack: bool = False, tqdm=None) -> List[str]:
+    """
+    Move the loose patient, header, and QCL files of a database folder into new packs
+    :param directory_path:
+    :param compression: None, 'gz', or 'xz' for each record
+    :param compression_level: defaults to DEFAULT_COMPRESSION_LEVELS
+    :param max_pack_bytes: start a new pack once the current one is this large, a patient's files share one pack
+    :param remove_files: delete the loose files (and with repack the old packs) once the new packs are in place
+    :param repack: also move what the current packs hold into the new ones, dropping versions that are not read
+    :param tqdm:
+    :return: the names of the packs written
+    """
+    directory_path = os.fspath(directory_path)
+    check_compression(compression)
+    catalog = return_directory_catalog(directory_path, refresh=True)
+    """
+    The header files are the ones a load would read, each one's patient and QCL file is packed with it
+    """
+    header_files = catalog.return_header_files()
+    if not repack:
+        header_files = [i for i in header_files if not os.path.dirname(i)]
+    old_packs = sorted(catalog.PackFiles) if repack else []
+    pack_number = max([return_pack_number(i) for i in catalog.PackFiles] + [0])
+    pbar = None
+    if tqdm is not None:
+        pbar = tqdm(total=len(header_files), desc='Packing ' + os.path.basename(directory_path))
+    written_packs = []
+    packed_files = []
+    writer = None
+    try:
+        for header_file in header_files:
+            pack_name, header_name = os.path.split(header_file)
+            source_catalog = catalog if not pack_name else return_directory_catalog(
+                os.path.join(directory_path, pack_name))
+            file_names = [header_name]
+            for file_name in (header_name.replace('_Header.json', '.json'),
+                              header_name.replace('_Header.json', 'QCLs.json')):
+                file_name = source_catalog.return_file_name(file_name)
+                if file_name is not None:
+                    file_names.append(file_name)
+            if writer is None or writer.Bytes >= max_pack_bytes:
+                if writer is not None:
+                    writer.close()
+                pack_number += 1
+                written_packs.append(return_pack_name(pack_number))
+                writer = PatientPackWriter(os.path.join(directory_path, written_packs[-1]), compression,
+                                           compression_level)
+            for file_name in file_names:
+                file_path = os.path.join(directory_path, pack_name, file_name)
+                writer.add_file(file_name, return_loose_file_bytes(file_path))
+                if not pack_name:
+                    packed_files.append(file_path)
+            if pbar is not None:
+                pbar.update()
+        if writer is not None:
+            writer.close()
+            writer = None
+    finally:
+        if writer is not None:
+            writer.abort()
+    if remove_files:
+        clear_patient_packs()
+        for file_path in packed_files + [os.path.join(directory_path, i) for i in old_packs]:
+            os.remove(file_path)
+    return written_packs
+
+
+def pack_database(path_to_database_directories: Union[str, bytes, os.PathLike], compression: Optional[str] = None,
+                  compression_level: Optional[int] = None, max_pack_bytes: int = DEFAULT_MAX_PACK_BYTES,
+                  remove_files: bool = True, repack: bool = False, tqdm=None,
+                  specific_folders: Optional[List[str]] = None) -> Dict[str, List[str]]:
+    packed = {}
+    for database_directory in return_database_directories(path_to_database_directories, specific_folders):
+        print(f"Packing {database_directory}")
+        packed[database_directory] = pack_directory(os.path.join(path_to_database_directories, database_directory),
+                                                    compression, compression_level, max_pack_bytes, remove_files,
+                                                    repack, tqdm)
+    return packed
+
+
+if __name__ == '__main__':
+    pass
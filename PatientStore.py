@@ -0,0 +1,335 @@
+from .AbstractBase import *
+
+"""
+An append-only, versioned store for the patients of one database, an alternative to one json file per save
+
+Layout of a store folder: Segment_000001.seg, Segment_000002.seg, ... and StoreIndex.json
+Every record in a segment is a one line json record header {"RS_UID", "DateLastModified", "Length", "ContentHash"},
+then Length bytes of the patient json document (the same text as a patient file, QCLs included), then a newline.
+The index maps each RS_UID to its versions [segment, offset, length, DateLastModified, ContentHash], offset pointing at
+the patient json, so reading one patient is a single seek and read. It also remembers how far into each segment it reaches,
+anything written past that (a crash before the index was saved) is recovered by reading the record headers.
+"""
+SEGMENT_PREFIX = 'Segment_'
+SEGMENT_SUFFIX = '.seg'
+STORE_INDEX_NAME = 'StoreIndex.json'
+STORE_VERSION = 1
+DATE_FIELDS = ('year', 'month', 'day', 'hour', 'minute', 'second')
+
+
+def return_date_values(date_time) -> List[int]:
+    if date_time is None:
+        return [0, 1, 1, 0, 0, 0]
+    return [getattr(date_time, i, 0) for i in DATE_FIELDS]
+
+
+def return_segment_name(segment: int) -> str:
+    return f"{SEGMENT_PREFIX}{segment:06d}{SEGMENT_SUFFIX}"
+
+
+def return_store_dict(patient: PatientClass) -> dict:
+    patient_dict = patient.to_dict(exclude=["QCLs", "FilePath"])
+    patient_dict[FORMAT_VERSION_KEY] = JSON_FORMAT_VERSION
+    return patient_dict
+
+
+def return_record_line(rs_uid: str, date_values: List[int], length: int, content_hash: Optional[str]) -> bytes:
+    """
+    The json record header line written before a patient json document
+    """
+    return json.dumps({'RS_UID': rs_uid, 'DateLastModified': date_values, 'Length': length,
+                       'ContentHash': content_hash}).encode('utf-8') + b'\n'
+
+
+class PatientStore(object):
+    """
+    :param store_path: folder holding the segments and index, created if needed
+    :param max_segment_bytes: start a new segment once the current one is this large
+    """
+    StorePath: str
+    Versions: Dict[str, List[list]]
+    Segments: Dict[int, int]
+
+    def __init__(self, store_path: Union[str, bytes, os.PathLike], max_segment_bytes: int = 256 * 1024 * 1024):
+        self.StorePath = os.fspath(store_path)
+        self.MaxSegmentBytes = max_segment_bytes
+        self.Versions = {}
+        self.Segments = {}
+        self._lock = Lock()
+        if not os.path.exists(self.StorePath):
+            os.makedirs(self.StorePath)
+        self.load_index()
+        self.recover()
+
+    def return_segment_path(self, segment: int) -> str:
+        return os.path.join(self.StorePath, return_segment_name(segment))
+
+    def return_segments_on_disk(self) -> List[int]:
+        segments = []
+        for file_name in os.listdir(self.StorePath):
+            if file_name.startswith(SEGMENT_PREFIX) and file_name.endswith(SEGMENT_SUFFIX):
+                segments.append(int(file_name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+        return sorted(segments)
+
+    def load_index(self):
+        index_path = os.path.join(self.StorePath, STORE_INDEX_NAME)
+        if not os.path.exists(index_path):
+            return None
+        with open(index_path, 'r') as index_file:
+            index = json.load(index_file)
+        if index.get('version') != STORE_VERSION:
+            raise ValueError(f"{index_path} was written by a different version")
+        self.Versions = index['Versions']
+        self.Segments = {int(key): value for key, value in index['Segments'].items()}
+
+    def _write_index(self):
+        index = {'version': STORE_VERSION, 'Versions': self.Versions, 'Segments': self.Segments}
+        write_file_atomic(os.path.join(self.StorePath, STORE_INDEX_NAME), json.dumps(index))
+
+    def save_index(self):
+        with self._lock:
+            self._write_index()
+
+    def _add_version(self, rs_uid: str, entry: list):
+        self.Versions.setdefault(rs_uid, []).append(entry)
+
+    def recover(self) -> int:
+        """
+        Index any records past the indexed end of each segment, and cut off a record left half written
+        :return: the number of records recovered
+        """
+        recovered = 0
+        for segment in self.return_segments_on_disk():
+            indexed_length = self.Segments.get(segment, 0)
+            segment_path = self.return_segment_path(segment)
+            if os.path.getsize(segment_path) == indexed_length:
+                continue
+            with open(segment_path, 'rb+') as segment_file:
+                segment_file.seek(indexed_length)
+                position = indexed_length
+                while True:
+                    record_line = segment_file.readline()
+                    if not record_line:
+                        break
+                    try:
+                        record = json.loads(record_line)
+                        offset = position + len(record_line)
+                        segment_file.seek(offset + record['Length'])
+                        if segment_file.read(1) != b'\n':
+                            raise ValueError
+                    except (ValueError, KeyError):
+                        break
+                    self._add_version(record['RS_UID'], [segment, offset, record['Length'],
+                                                         record['DateLastModified'], record.get('ContentHash')])
+                    position = offset + record['Length'] + 1
+                    recovered += 1
+                segment_file.truncate(position)
+            self.Segments[segment] = position
+        if recovered:
+            self.save_index()
+        return recovered
+
+    def return_latest_entry(self, rs_uid: str) -> Optional[list]:
+        """
+        The newest DateLastModified wins, a later append wins a tie
+        """
+        versions = self.Versions.get(rs_uid)
+        if not versions:
+            return None
+        return max(enumerate(versions), key=lambda i: (i[1][3], i[0]))[1]
+
+    def append(self, patient: PatientClass, patient_dict: Optional[dict] = None) -> list:
+        """
+        Add a version of a patient, the index on disk is only brought up to date by save_index (or recover)
+        :param patient:
+        :param patient_dict: the return_store_dict of the patient, if already made
+        :return: the index entry [segment, offset, length, DateLastModified, ContentHash]
+        """
+        if patient.__dict__.get('_projection') is not None:
+            raise ValueError(f"{patient.RS_UID} was loaded with only some fields, storing it would lose the rest")
+        if patient_dict is None:
+            patient_dict = return_store_dict(patient)
+        body = return_json_codec().dumps(patient_dict)
+        date_values = return_date_values(getattr(patient, 'DateLastModified', None))
+        content_hash = return_content_hash(patient_dict)
+        record_line = return_record_line(patient.RS_UID, date_values, len(body), content_hash)
+        with self._lock:
+            segment = max(self.Segments) if self.Segments else 1
+            if self.Segments.get(segment, 0) >= self.MaxSegmentBytes:
+                segment += 1
+            position = self.Segments.get(segment, 0)
+            with open(self.return_segment_path(segment), 'ab') as segment_file:
+                segment_file.write(record_line + body + b'\n')
+            entry = [segment, position + len(record_line), len(body), date_values, content_hash]
+            self.Segments[segment] = position + len(record_line) + len(body) + 1
+            self._add_version(patient.RS_UID, entry)
+        return entry
+
+    def read_entry(self, entry: list) -> PatientClass:
+        segment, offset, length = entry[:3]
+        with open(self.return_segment_path(segment), 'rb') as segment_file:
+            segment_file.seek(offset)
+            patient = PatientClass().from_json(segment_file.read(length))
+        if patient is None:
+            raise ValueError(f"{return_segment_name(segment)} at {offset} is not a patient record")
+        return patient
+
+    def get(self, rs_uid: str) -> Optional[PatientClass]:
+        """
+        The latest version of one patient, or None if the store does not hold it
+        """
+        entry = self.return_latest_entry(rs_uid)
+        if entry is None:
+            return None
+        return self.read_entry(entry)
+
+    def iter_latest(self, specific_rs_uids: Optional[List[str]] = None):
+        """
+        Yield the latest version of every patient (or of specific_rs_uids), in segment order so reads are sequential
+        """
+        rs_uids = self.Versions.keys() if specific_rs_uids is None else specific_rs_uids
+        entries = [i for i in (self.return_latest_entry(rs_uid) for rs_uid in rs_uids) if i is not None]
+        entries.sort(key=lambda i: (i[0], i[1]))
+        segment_file = None
+        current_segment = None
+        try:
+            for entry in entries:
+                if entry[0] != current_segment:
+                    if segment_file is not None:
+                        segment_file.close()
+                    current_segment = entry[0]
+                    segment_file = open(self.return_segment_path(current_segment), 'rb')
+                segment_file.seek(entry[1])
+                patient = PatientClass().from_json(segment_file.read(entry[2]))
+                if patient is not None:
+                    yield patient
+        finally:
+            if segment_file is not None:
+                segment_file.close()
+
+    def return_live_record_bytes(self, rs_uid: str) -> int:
+        """
+        Size of the latest record of a patient as compact writes it: record header line, json document, newline
+        """
+        entry = self.return_latest_entry(rs_uid)
+        content_hash = entry[4] if len(entry) > 4 else None
+        return len(return_record_line(rs_uid, entry[3], entry[2], content_hash)) + entry[2] + 1
+
+    def return_dead_bytes(self) -> int:
+        """
+        Bytes held by versions that are no longer the latest, what compact would free
+        """
+        live_bytes = sum(self.return_live_record_bytes(i) for i in self.Versions if self.Versions[i])
+        return sum(self.Segments.values()) - live_bytes
+
+    def compact(self) -> int:
+        """
+        Rewrite the latest version of every patient into new segments and drop the old segments, appends wait
+        :return: bytes freed
+        """
+        with self._lock:
+            old_segments = dict(self.Segments)
+            latest = [(rs_uid, self.return_latest_entry(rs_uid)) for rs_uid in self.Versions if self.Versions[rs_uid]]
+            latest.sort(key=lambda i: (i[1][0], i[1][1]))
+            segment = (max(old_segments) if old_segments else 0) + 1
+            new_segments = {segment: 0}
+            new_versions = {}
+            segment_file = open(self.return_segment_path(segment), 'wb')
+            try:
+                for rs_uid, entry in latest:
+                    with open(self.return_segment_path(entry[0]), 'rb') as old_file:
+                        old_file.seek(entry[1])
+                        body = old_file.read(entry[2])
+                    if new_segments[segment] >= self.MaxSegmentBytes:
+                        segment_file.close()
+                        segment += 1
+                        segment_file = open(self.return_segment_path(segment), 'wb')
+                        new_segments[segment] = 0
+                    content_hash = entry[4] if len(entry) > 4 else None
+                    record_line = return_record_line(rs_uid, entry[3], len(body), content_hash)
+                    segment_file.write(record_line + body + b'\n')
+                    new_versions[rs_uid] = [[segment, new_segments[segment] + len(record_line), len(body), entry[3],
+                                             content_hash]]
+                    new_segments[segment] += len(record_line) + len(body) + 1
+            finally:
+                segment_file.close()
+            self.Versions = new_versions
+            self.Segments = new_segments
+            self._write_index()
+            for old_segment in old_segments:
+                os.remove(self.return_segment_path(old_segment))
+        return sum(old_segments.values()) - sum(new_segments.values())
+
+    def __len__(self):
+        return len(self.Versions)
+
+    def __contains__(self, rs_uid: str):
+        return rs_uid in self.Versions
+
+
+def save_database_to_store(database: PatientDatabase, store_path: Union[str, bytes, os.PathLike],
+                           tqdm=None) -> LoadReport:
+    """
+    Append every patient of a database as a new version, patients whose DateLastModified is older than the stored
+    one, or whose content hash matches it, are not written (versions stored without a hash need a newer date)
+    """
+    store = PatientStore(store_path)
+    pbar = None
+    if tqdm is not None:
+        pbar = tqdm(total=len(database.Patients), desc='Storing ' + database.DBName)
+
+    def append_patient(patient: PatientClass):
+        entry = store.return_latest_entry(patient.RS_UID)
+        date_values = return_date_values(getattr(patient, 'DateLastModified', None))
+        patient_dict = None
+        if entry is not None:
+            stored_hash = entry[4] if len(entry) > 4 else None
+            if entry[3] > date_values or (stored_hash is None and entry[3] == date_values):
+                return None
+            patient_dict = return_store_dict(patient)
+            if stored_hash == return_content_hash(patient_dict):
+                return None
+        store.append(patient, patient_dict)
+
+    report = run_pipeline(list(database.Patients.values()), append_patient, worker_kind='serial', pbar=pbar,
+                          description='Storing ' + database.DBName)
+    store.save_index()
+    return report
+
+
+def load_database_from_store(store_path: Union[str, bytes, os.PathLike], db_name: Optional[str] = None,
+                             specific_rs_uids: Optional[List[str]] = None) -> PatientDatabase:
+    """
+    A PatientDatabase of the latest version of each patient in a store
+    """
+    if db_name is None:
+        db_name = os.path.basename(os.path.normpath(store_path))
+    patient_database = PatientDatabase(db_name)
+    for patient in PatientStore(store_path).iter_latest(specific_rs_uids):
+        patient_database.Patients[patient.RS_UID] = patient
+    return patient_database
+
+
+def import_directory_to_store(directory_path: Union[str, bytes, os.PathLike],
+                              store_path: Union[str, bytes, os.PathLike], tqdm=None) -> LoadReport:
+    """
+    Append every patient file of a database folder to a store, QCL files are folded into their patient
+    """
+    patient_files = PatientDatabase('').return_patient_files(directory_path)
+    store = PatientStore(store_path)
+    pbar = None
+    if tqdm is not None:
+        pbar = tqdm(total=len(patient_files), desc='Importing ' + os.path.basename(directory_path))
+
+    def append_patient(file, patient: PatientClass):
+        patient.load_qcls()  # whatever the compression of the QCL file
+        store.append(patient)
+
+    report = run_pipeline(patient_files, load_patient_file, append_patient, pbar=pbar,
+                          description='Importing ' + os.path.basename(directory_path))
+    store.save_index()
+    return report
+
+
+if __name__ == '__main__':
+    pass
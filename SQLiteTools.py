@@ -0,0 +1,413 @@
+from .AbstractBase import *
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+    print("Unable to import sqlite3, cannot export databases to SQLite")
+
+"""
+A local SQLite copy of the header (and optionally plan and beam set) metadata of PatientHeaderDatabases, so relational
+questions (approved plans by planner in a date range, cases per body site, patients per ROI type) are SQL queries
+instead of loops over the object graph. Each patient row keeps its header json, PatientHeader objects are rebuilt
+from it on demand, and PatientClass objects are read from the patient file the row points at.
+Dates are stored as 'YYYY-MM-DD HH:MM:SS' text so they compare and range filter in SQL.
+"""
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS databases (
+    DatabaseId INTEGER PRIMARY KEY,
+    DBName TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS patients (
+    PatientId INTEGER PRIMARY KEY,
+    DatabaseId INTEGER NOT NULL REFERENCES databases(DatabaseId),
+    RS_UID TEXT NOT NULL,
+    MRN TEXT,
+    Name_First TEXT,
+    Name_Last TEXT,
+    Gender INTEGER,
+    DateLastModified TEXT,
+    DateOfBirth TEXT,
+    FilePath TEXT,
+    HeaderJson TEXT,
+    IsFull INTEGER NOT NULL DEFAULT 0,
+    ContentHash TEXT,
+    UNIQUE (DatabaseId, RS_UID)
+);
+CREATE TABLE IF NOT EXISTS cases (
+    CaseId INTEGER PRIMARY KEY,
+    PatientId INTEGER NOT NULL REFERENCES patients(PatientId) ON DELETE CASCADE,
+    CaseIndex INTEGER,
+    CaseName TEXT,
+    BodySite TEXT
+);
+CREATE TABLE IF NOT EXISTS rois (
+    CaseId INTEGER NOT NULL REFERENCES cases(CaseId) ON DELETE CASCADE,
+    Name TEXT,
+    Type TEXT
+);
+CREATE TABLE IF NOT EXISTS pois (
+    CaseId INTEGER NOT NULL REFERENCES cases(CaseId) ON DELETE CASCADE,
+    Name TEXT
+);
+CREATE TABLE IF NOT EXISTS plans (
+    PlanId INTEGER PRIMARY KEY,
+    CaseId INTEGER NOT NULL REFERENCES cases(CaseId) ON DELETE CASCADE,
+    PlanName TEXT,
+    PlannedBy TEXT,
+    ApprovalStatus TEXT,
+    ReviewerName TEXT,
+    ReviewTime TEXT,
+    FractionNumber INTEGER,
+    Referenced_Exam_Name TEXT
+);
+CREATE TABLE IF NOT EXISTS beam_sets (
+    BeamSetId INTEGER PRIMARY KEY,
+    PlanId INTEGER NOT NULL REFERENCES plans(PlanId) ON DELETE CASCADE,
+    DicomPlanLabel TEXT,
+    NumberOfFractions INTEGER,
+    PlanIntent TEXT,
+    PlanGenerationTechnique TEXT,
+    Modality TEXT,
+    MachineName TEXT,
+    PrescriptionDose_cGy REAL,
+    BeamCount INTEGER
+);
+CREATE INDEX IF NOT EXISTS patients_mrn ON patients (MRN);
+CREATE INDEX IF NOT EXISTS patients_date ON patients (DateLastModified);
+CREATE INDEX IF NOT EXISTS cases_patient ON cases (PatientId);
+CREATE INDEX IF NOT EXISTS cases_body_site ON cases (BodySite);
+CREATE INDEX IF NOT EXISTS rois_case ON rois (CaseId);
+CREATE INDEX IF NOT EXISTS rois_type_nocase ON rois (Type COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS rois_name ON rois (Name);
+CREATE INDEX IF NOT EXISTS pois_case ON pois (CaseId);
+CREATE INDEX IF NOT EXISTS plans_case ON plans (CaseId);
+CREATE INDEX IF NOT EXISTS plans_approval ON plans (ApprovalStatus, PlannedBy, ReviewTime);
+CREATE INDEX IF NOT EXISTS beam_sets_plan ON beam_sets (PlanId);
+"""
+
+
+def return_date_string(date_time) -> Optional[str]:
+    """
+    :param date_time: a DateTimeClass, datetime, or an already formatted string
+    :return: 'YYYY-MM-DD HH:MM:SS', or None
+    """
+    if date_time is None or isinstance(date_time, str):
+        return date_time
+    return (f"{getattr(date_time, 'year', 0):04d}-{getattr(date_time, 'month', 1):02d}-"
+            f"{getattr(date_time, 'day', 1):02d} {getattr(date_time, 'hour', 0):02d}:"
+            f"{getattr(date_time, 'minute', 0):02d}:{getattr(date_time, 'second', 0):02d}")
+
+
+class PatientSQLiteDatabase(object):
+    """
+    :param sqlite_path: the SQLite file, created with its tables and indexes if needed
+    """
+    def __init__(self, sqlite_path: Union[str, bytes, os.PathLike]):
+        self.SQLitePath = sqlite_path
+        self.Connection = sqlite3.connect(sqlite_path)
+        self.Connection.execute("PRAGMA foreign_keys = ON")
+        self.Connection.executescript(SCHEMA)
+        try:
+            self.Connection.execute("ALTER TABLE patients ADD COLUMN ContentHash TEXT")  # Files made before it
+        except sqlite3.OperationalError:
+            pass
+        self.Connection.execute("DROP INDEX IF EXISTS rois_type")  # Replaced by rois_type_nocase
+        self.Connection.commit()
+
+    def close(self):
+        self.Connection.close()
+
+    def query(self, sql: str, parameters=()) -> list:
+        return self.Connection.execute(sql, parameters).fetchall()
+
+    def return_database_id(self, db_name: str) -> int:
+        self.Connection.execute("INSERT OR IGNORE INTO databases (DBName) VALUES (?)", (db_name,))
+        return self.Connection.execute("SELECT DatabaseId FROM databases WHERE DBName = ?", (db_name,)).fetchone()[0]
+
+    def _is_current(self, database_id: int, rs_uid: str, date_last_modified: Optional[str], file_path, is_full: bool,
+                    content_hash: Optional[str] = None):
+        """
+        The file has to match, and then the ContentHash when there is one, otherwise the date
+        """
+        row = self.Connection.execute("SELECT DateLastModified, FilePath, IsFull, ContentHash FROM patients "
+                                      "WHERE DatabaseId = ? AND RS_UID = ?", (database_id, rs_uid)).fetchone()
+        if row is None or row[2] < is_full or row[1] != file_path:
+            return False
+        if content_hash:
+            return row[3] == content_hash  # Rows exported before hashes were kept are rewritten once
+        return row[0] == date_last_modified
+
+    def _remove_missing_patients(self, database_id: int, rs_uids) -> int:
+        """
+        Delete the rows (and with them their cases, rois, pois, plans and beam sets) of patients not in rs_uids
+        :return: number of patients removed
+        """
+        rs_uids = set(rs_uids)
+        missing = [(database_id, i[0]) for i in self.Connection.execute("SELECT RS_UID FROM patients "
+                                                                        "WHERE DatabaseId = ?", (database_id,))
+                   if i[0] not in rs_uids]
+        self.Connection.executemany("DELETE FROM patients WHERE DatabaseId = ? AND RS_UID = ?", missing)
+        return len(missing)
+
+    def _insert_patient(self, database_id: int, patient: PatientClass or PatientHeader, header_json: str,
+                        is_full: bool, content_hash: Optional[str] = None):
+        cursor = self.Connection.cursor()
+        file_path = getattr(patient, 'FilePath', None)
+        cursor.execute("DELETE FROM patients WHERE DatabaseId = ? AND RS_UID = ?", (database_id, patient.RS_UID))
+        cursor.execute("INSERT INTO patients (DatabaseId, RS_UID, MRN, Name_First, Name_Last, Gender, "
+                       "DateLastModified, DateOfBirth, FilePath, HeaderJson, IsFull, ContentHash) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       (database_id, patient.RS_UID, getattr(patient, 'MRN', None),
+                        getattr(patient, 'Name_First', None), getattr(patient, 'Name_Last', None),
+                        getattr(patient, 'Gender', None),
+                        return_date_string(getattr(patient, 'DateLastModified', None)),
+                        return_date_string(getattr(patient, 'DateOfBirth', None)),
+                        None if file_path is None else os.fspath(file_path), header_json, int(is_full),
+                        content_hash))
+        patient_id = cursor.lastrowid
+        for case_index, case in enumerate(patient.Cases):
+            cursor.execute("INSERT INTO cases (PatientId, CaseIndex, CaseName, BodySite) VALUES (?, ?, ?, ?)",
+                           (patient_id, case_index, getattr(case, 'CaseName', None), getattr(case, 'BodySite', None)))
+            case_id = cursor.lastrowid
+            rois = case.Base_ROIs if is_full else case.ROIS
+            cursor.executemany("INSERT INTO rois (CaseId, Name, Type) VALUES (?, ?, ?)",
+                               [(case_id, getattr(roi, 'Name', None), getattr(roi, 'Type', None)) for roi in rois])
+            pois = [i.Name for i in case.Base_POIs] if is_full else case.POIS
+            cursor.executemany("INSERT INTO pois (CaseId, Name) VALUES (?, ?)", [(case_id, i) for i in pois])
+            for plan in case.TreatmentPlans:
+                review = getattr(plan, 'Review', None)
+                cursor.execute("INSERT INTO plans (CaseId, PlanName, PlannedBy, ApprovalStatus, ReviewerName, "
+                               "ReviewTime, FractionNumber, Referenced_Exam_Name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (case_id, getattr(plan, 'PlanName', None), getattr(plan, 'PlannedBy', None),
+                                getattr(review, 'ApprovalStatus', None), getattr(review, 'ReviewerName', None),
+                                return_date_string(getattr(review, 'ReviewTime', None)),
+                                getattr(plan, 'FractionNumber', None), getattr(plan, 'Referenced_Exam_Name', None)))
+                if not is_full:
+                    continue
+                plan_id = cursor.lastrowid
+                for beam_set in getattr(plan, 'BeamSets', []):
+                    prescription = getattr(beam_set, 'Primary_Prescription', None)
+                    machine = getattr(beam_set, 'MachineReference', None)
+                    cursor.execute("INSERT INTO beam_sets (PlanId, DicomPlanLabel, NumberOfFractions, PlanIntent, "
+                                   "PlanGenerationTechnique, Modality, MachineName, PrescriptionDose_cGy, BeamCount) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   (plan_id, getattr(beam_set, 'DicomPlanLabel', None),
+                                    getattr(beam_set, 'NumberOfFractions', None),
+                                    getattr(beam_set, 'PlanIntent', None),
+                                    getattr(beam_set, 'PlanGenerationTechnique', None),
+                                    getattr(beam_set, 'Modality', None), getattr(machine, 'MachineName', None),
+                                    getattr(prescription, 'DoseValue_cGy', None),
+                                    len(getattr(beam_set, 'Beams', []))))
+
+    def export_header_database(self, header_database: PatientHeaderDatabase, tqdm=None,
+                               remove_missing: bool = True) -> int:
+        """
+        Add or replace the headers of one database, headers whose content hash (or date and file) did not change are
+        skipped
+        :param remove_missing: delete the rows of patients no longer in header_database
+        :return: number of patients written
+        """
+        database_id = self.return_database_id(header_database.DBName)
+        pbar = None
+        if tqdm is not None:
+            pbar = tqdm(total=len(header_database.PatientHeaders), desc='Exporting ' + header_database.DBName)
+        written = 0
+        with self.Connection:
+            for patient_header in header_database.PatientHeaders.values():
+                if pbar is not None:
+                    pbar.update()
+                content_hash = getattr(patient_header, 'ContentHash', None)
+                if self._is_current(database_id, patient_header.RS_UID,
+                                    return_date_string(getattr(patient_header, 'DateLastModified', None)),
+                                    getattr(patient_header, 'FilePath', None), False, content_hash):
+                    continue
+                self._insert_patient(database_id, patient_header,
+                                     patient_header.to_json(exclude=["QCLs", "QCL_List"]), False, content_hash)
+                written += 1
+            if remove_missing:
+                self._remove_missing_patients(database_id, header_database.PatientHeaders)
+        return written
+
+    def export_patient_database(self, patient_database: PatientDatabase, tqdm=None,
+                                remove_missing: bool = True) -> int:
+        """
+        Add or replace full patients, which also fills the plan details and beam_sets
+        :param remove_missing: delete the rows of patients no longer in patient_database, leave False when the headers
+        exported alongside hold more patients than the full ones
+        :return: number of patients written
+        """
+        database_id = self.return_database_id(patient_database.DBName)
+        pbar = None
+        if tqdm is not None:
+            pbar = tqdm(total=len(patient_database.Patients), desc='Exporting ' + patient_database.DBName)
+        written = 0
+        with self.Connection:
+            for patient in patient_database.Patients.values():
+                if pbar is not None:
+                    pbar.update()
+                file_path = getattr(patient, 'FilePath', None)
+                header_path = None if file_path is None else file_path.replace('.json', '_Header.json')
+                content_hash = patient.content_hash()
+                if self._is_current(database_id, patient.RS_UID,
+                                    return_date_string(getattr(patient, 'DateLastModified', None)), header_path,
+                                    True, content_hash):
+                    continue
+                header_dict = return_header_dict(patient.to_dict(exclude=["QCLs", "QCL_List"]))
+                header_dict['ContentHash'] = content_hash
+                self._insert_patient(database_id, patient, json.dumps(header_dict), True, content_hash)
+                if header_path is not None:
+                    self.Connection.execute("UPDATE patients SET FilePath = ? WHERE DatabaseId = ? AND RS_UID = ?",
+                                            (header_path, database_id, patient.RS_UID))
+                written += 1
+            if remove_missing:
+                self._remove_missing_patients(database_id, patient_database.Patients)
+        return written
+
+    def export_header_databases(self, header_databases: PatientHeaderDatabases, tqdm=None,
+                                remove_missing: bool = True) -> Dict[str, int]:
+        return {db_name: self.export_header_database(header_database, tqdm, remove_missing)
+                for db_name, header_database in header_databases.HeaderDatabases.items()}
+
+    def export_patient_databases(self, patient_databases: PatientDatabases, tqdm=None,
+                                 remove_missing: bool = True) -> Dict[str, int]:
+        return {db_name: self.export_patient_database(patient_database, tqdm, remove_missing)
+                for db_name, patient_database in patient_databases.Databases.items()}
+
+    def return_patient_header(self, db_name: str, rs_uid: str) -> Optional[PatientHeader]:
+        row = self.Connection.execute("SELECT p.HeaderJson, p.FilePath FROM patients p "
+                                      "JOIN databases d ON d.DatabaseId = p.DatabaseId "
+                                      "WHERE d.DBName = ? AND p.RS_UID = ?", (db_name, rs_uid)).fetchone()
+        if row is None:
+            return None
+        patient_header = PatientHeader().from_json(row[0])
+        if row[1] is not None:
+            patient_header.FilePath = row[1]
+        return patient_header
+
+    def return_patient(self, db_name: str, rs_uid: str) -> Optional[PatientClass]:
+        """
+        Read the full patient from the patient file next to the exported header
+        """
+        row = self.Connection.execute("SELECT p.FilePath FROM patients p "
+                                      "JOIN databases d ON d.DatabaseId = p.DatabaseId "
+                                      "WHERE d.DBName = ? AND p.RS_UID = ?", (db_name, rs_uid)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return load_patient_file(row[0].replace('_Header.json', '.json'))
+
+    def return_header_database(self, db_name: str, rs_uids: Optional[List[str]] = None) -> PatientHeaderDatabase:
+        header_database = PatientHeaderDatabase(db_name)
+        if rs_uids is None:
+            rs_uids = [i[0] for i in self.query("SELECT p.RS_UID FROM patients p JOIN databases d "
+                                                "ON d.DatabaseId = p.DatabaseId WHERE d.DBName = ?", (db_name,))]
+        for rs_uid in rs_uids:
+            patient_header = self.return_patient_header(db_name, rs_uid)
+            if patient_header is not None:
+                header_database.PatientHeaders[rs_uid] = patient_header
+        return header_database
+
+    def return_approved_rs_uids(self, db_name: str) -> List[str]:
+        """
+        Patients with at least one approved plan, see EvaluationTools.check_patient_has_approved
+        """
+        return [i[0] for i in self.query("SELECT DISTINCT p.RS_UID FROM patients p "
+                                         "JOIN databases d ON d.DatabaseId = p.DatabaseId "
+                                         "JOIN cases c ON c.PatientId = p.PatientId "
+                                         "JOIN plans t ON t.CaseId = c.CaseId "
+                                         "WHERE d.DBName = ? AND t.ApprovalStatus = 'Approved' "
+                                         "ORDER BY p.PatientId", (db_name,))]
+
+    def check_patient_has_approved(self, db_name: str, rs_uid: str) -> bool:
+        return self.Connection.execute("SELECT 1 FROM patients p "
+                                       "JOIN databases d ON d.DatabaseId = p.DatabaseId "
+                                       "JOIN cases c ON c.PatientId = p.PatientId "
+                                       "JOIN plans t ON t.CaseId = c.CaseId "
+                                       "WHERE d.DBName = ? AND p.RS_UID = ? AND t.ApprovalStatus = 'Approved' "
+                                       "LIMIT 1", (db_name, rs_uid)).fetchone() is not None
+
+    def return_approved_db(self, db_name: str) -> PatientHeaderDatabase:
+        """
+        The SQL version of EvaluationTools.return_approved_db for a header database
+        """
+        return self.return_header_database(db_name, self.return_approved_rs_uids(db_name))
+
+    def return_plan_names_by_contains(self, find_str: str, db_name: Optional[str] = None) -> List[str]:
+        """
+        Names of unapproved plans whose lower case name contains find_str, in first seen order, the SQL version of
+        EvaluationTools.return_plan_names_by_contains
+        """
+        sql = ("SELECT t.PlanName FROM plans t JOIN cases c ON c.CaseId = t.CaseId "
+               "JOIN patients p ON p.PatientId = c.PatientId JOIN databases d ON d.DatabaseId = p.DatabaseId "
+               "WHERE (t.ApprovalStatus IS NULL OR t.ApprovalStatus != 'Approved') "
+               "AND instr(lower(t.PlanName), ?) > 0")
+        parameters = [find_str]
+        if db_name is not None:
+            sql += " AND d.DBName = ?"
+            parameters.append(db_name)
+        sql += " GROUP BY t.PlanName ORDER BY MIN(t.PlanId)"
+        return [i[0] for i in self.query(sql, parameters)]
+
+    def return_approved_plans(self, planned_by: Optional[str] = None, start_date=None, end_date=None,
+                              db_name: Optional[str] = None) -> List[tuple]:
+        """
+        Approved plans, optionally by planner and with a review time between start_date and end_date (inclusive)
+        :return: (DBName, RS_UID, CaseName, PlanName, PlannedBy, ReviewTime) rows
+        """
+        sql = ("SELECT d.DBName, p.RS_UID, c.CaseName, t.PlanName, t.PlannedBy, t.ReviewTime FROM plans t "
+               "JOIN cases c ON c.CaseId = t.CaseId JOIN patients p ON p.PatientId = c.PatientId "
+               "JOIN databases d ON d.DatabaseId = p.DatabaseId WHERE t.ApprovalStatus = 'Approved'")
+        parameters = []
+        if planned_by is not None:
+            sql += " AND t.PlannedBy = ?"
+            parameters.append(planned_by)
+        if start_date is not None:
+            sql += " AND t.ReviewTime >= ?"
+            parameters.append(return_date_string(start_date))
+        if end_date is not None:
+            sql += " AND t.ReviewTime <= ?"
+            parameters.append(return_date_string(end_date))
+        if db_name is not None:
+            sql += " AND d.DBName = ?"
+            parameters.append(db_name)
+        return self.query(sql + " ORDER BY t.ReviewTime", parameters)
+
+    def return_case_counts_by_body_site(self, db_name: Optional[str] = None) -> Dict[str, int]:
+        sql = ("SELECT c.BodySite, COUNT(*) FROM cases c JOIN patients p ON p.PatientId = c.PatientId "
+               "JOIN databases d ON d.DatabaseId = p.DatabaseId")
+        parameters = []
+        if db_name is not None:
+            sql += " WHERE d.DBName = ?"
+            parameters.append(db_name)
+        return dict(self.query(sql + " GROUP BY c.BodySite ORDER BY c.BodySite", parameters))
+
+    def return_patients_by_roi_type(self, roi_type: str) -> List[tuple]:
+        """
+        :return: (DBName, RS_UID) of every patient with a ROI of roi_type, case insensitive (ASCII, as lower() was) through
+        the rois_type_nocase index
+        """
+        return self.query("SELECT DISTINCT d.DBName, p.RS_UID FROM rois r JOIN cases c ON c.CaseId = r.CaseId "
+                          "JOIN patients p ON p.PatientId = c.PatientId "
+                          "JOIN databases d ON d.DatabaseId = p.DatabaseId "
+                          "WHERE r.Type = ? COLLATE NOCASE ORDER BY d.DBName, p.PatientId", (roi_type,))
+
+
+def export_to_sqlite(header_databases: PatientHeaderDatabases, sqlite_path: Union[str, bytes, os.PathLike],
+                     patient_databases: Optional[PatientDatabases] = None, tqdm=None) -> PatientSQLiteDatabase:
+    """
+    Export headers, and the plans and beam sets of full patients if patient_databases is given. Patients no longer in
+    header_databases are removed from the file
+    :param header_databases:
+    :param sqlite_path:
+    :param patient_databases:
+    :param tqdm:
+    :return: the open PatientSQLiteDatabase, ready to query
+    """
+    sqlite_database = PatientSQLiteDatabase(sqlite_path)
+    sqlite_database.export_header_databases(header_databases, tqdm)
+    if patient_databases is not None:
+        sqlite_database.export_patient_databases(patient_databases, tqdm, remove_missing=False)
+    return sqlite_database
+
+
+if __name__ == '__main__':
+    pass
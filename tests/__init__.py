@@ -0,0 +1 @@
+# RaystationInfoStructure tests
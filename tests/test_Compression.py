@@ -0,0 +1,100 @@
+import gzip
+import json
+import lzma
+import os
+import tempfile
+import unittest
+from ..AbstractBase import PatientDatabases, PatientHeaderDatabases, compress_bytes, decompress_bytes, \
+    recompress_database, return_compressed_file_name, return_compression, return_json_stem
+from ..BenchmarkTools import SyntheticDatabaseConfig, return_synthetic_databases
+
+CONFIG = SyntheticDatabaseConfig(database_count=2, patient_count=3, roi_count=4, dvh_points=5, beam_count=1,
+                                 qcl_count=1)
+
+
+def return_databases_json(databases: PatientDatabases) -> dict:
+    return {db_name: {key: json.loads(patient.to_json(exclude=['FilePath']))
+                      for key, patient in database.Patients.items()}
+            for db_name, database in databases.Databases.items()}
+
+
+def return_documents(path: str) -> dict:
+    """
+    The decompressed contents of every json file under path, by uncompressed name
+    """
+    documents = {}
+    for root, _, file_names in os.walk(path):
+        for file_name in file_names:
+            with open(os.path.join(root, file_name), 'rb') as in_file:
+                documents[os.path.join(os.path.relpath(root, path), return_json_stem(file_name))] = \
+                    decompress_bytes(in_file.read(), return_compression(file_name))
+    return documents
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.path = self.temp_directory.name
+        self.databases = return_synthetic_databases(CONFIG)
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def return_loaded(self, lazy: bool = False) -> PatientDatabases:
+        if lazy:
+            header_databases = PatientHeaderDatabases()
+            header_databases.build_from_folder(self.path, load_mode='serial')
+            databases = header_databases.return_patient_databases(load_mode='serial', lazy=True)
+        else:
+            databases = PatientDatabases()
+            databases.build_from_folder(self.path, load_mode='thread')
+        databases.load_qcls(load_mode='serial')
+        return databases
+
+    def return_suffixes(self) -> set:
+        return {return_compression(file_name) for _, _, file_names in os.walk(self.path) for file_name in file_names}
+
+    def test_file_names(self):
+        self.assertEqual(return_compression('A_2023.1.1.0.0_Header.json.gz'), 'gz')
+        self.assertIsNone(return_compression('A_2023.1.1.0.0.json'))
+        self.assertIsNone(return_compression('A.xz'))
+        self.assertEqual(return_json_stem('A_2023.1.1.0.0QCLs.json.xz'), 'A_2023.1.1.0.0QCLs.json')
+        self.assertEqual(return_compressed_file_name('A.json.gz', 'xz'), 'A.json.xz')
+        self.assertEqual(return_compressed_file_name('A.json.gz'), 'A.json')
+        with self.assertRaises(ValueError):
+            return_compressed_file_name('A.json', 'bz2')
+
+    def test_bytes(self):
+        data = json.dumps({'a': list(range(100))}).encode('utf-8')
+        self.assertEqual(gzip.decompress(compress_bytes(data, 'gz')), data)
+        self.assertEqual(lzma.decompress(compress_bytes(data, 'xz', 1)), data)
+        self.assertEqual(compress_bytes(data, 'gz'), compress_bytes(data, 'gz'))
+        self.assertIs(compress_bytes(data, None), data)
+
+    def test_save_and_load(self):
+        expected = return_databases_json(self.databases)
+        documents = None
+        for compression in ('gz', 'xz', None, 'gz'):
+            self.databases.save(self.path, save_mode='thread', compression=compression)
+            self.assertEqual(self.return_suffixes(), {compression})
+            self.assertEqual(return_databases_json(self.return_loaded()), expected, compression)
+            self.assertEqual(return_databases_json(self.return_loaded(lazy=True)), expected, compression)
+            if documents is not None:
+                self.assertEqual(return_documents(self.path), documents)
+            documents = return_documents(self.path)
+
+    def test_recompress(self):
+        self.databases.save(self.path, save_mode='serial')
+        documents = return_documents(self.path)
+        expected = return_databases_json(self.databases)
+        for compression in ('xz', 'gz', None):
+            reports = recompress_database(self.path, compression, load_mode='thread')
+            self.assertEqual({key: (i.Succeeded, len(i.Failures)) for key, i in reports.items()},
+                             {key: (3 * CONFIG.PatientCount, 0) for key in self.databases.Databases})
+            self.assertEqual(self.return_suffixes(), {compression})
+            self.assertEqual(return_documents(self.path), documents)
+            self.assertEqual(return_databases_json(self.return_loaded()), expected, compression)
+
+
+if __name__ == '__main__':
+    unittest.main()
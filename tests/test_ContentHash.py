@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+import unittest
+from ..AbstractBase import PatientClass, PatientDatabase, PatientHeaderDatabase, return_content_diff, \
+    return_content_hash
+from ..BenchmarkTools import SyntheticDatabaseConfig, make_synthetic_patient
+
+CONFIG = SyntheticDatabaseConfig(patient_count=2, roi_count=3, dvh_points=5, beam_count=1, qcl_count=1)
+
+
+class TestContentHash(unittest.TestCase):
+    def setUp(self):
+        self.patient = make_synthetic_patient(1, CONFIG)
+        self.other = make_synthetic_patient(1, CONFIG)
+
+    def test_equal_patients(self):
+        self.assertEqual(self.patient.content_hash(), self.other.content_hash())
+        self.other.FilePath = os.path.join('elsewhere', 'patient.json')
+        self.other.QCL_List.QCLs = []
+        self.assertEqual(self.patient.content_hash(), self.other.content_hash())
+        self.assertEqual(PatientClass.from_json(self.patient.to_json()).content_hash(), self.patient.content_hash())
+
+    def test_edits_in_place(self):
+        content_hash = self.patient.content_hash()
+        self.patient.Cases[0].TreatmentPlans[0].PlannedBy = 'Dr Z'
+        self.assertNotEqual(self.patient.content_hash(), content_hash)
+        self.patient.Cases[0].TreatmentPlans[0].PlannedBy = self.other.Cases[0].TreatmentPlans[0].PlannedBy
+        self.assertEqual(self.patient.content_hash(), content_hash)
+
+    def test_array_dvhs(self):
+        dose_roi = self.other.Cases[0].TreatmentPlans[0].BeamSets[0].FractionDose.DoseROIs[0]
+        dose_roi.to_arrays('float64')
+        self.assertEqual(self.patient.content_hash(), self.other.content_hash())
+        self.assertEqual(self.patient.content_diff(self.other), [])
+
+    def test_scalars(self):
+        self.assertEqual(return_content_hash({'a': 1, 'b': [1.0, 2]}), return_content_hash({'b': [1, 2.0], 'a': 1.0}))
+        self.assertEqual(return_content_hash([float('nan'), 'a']), return_content_hash([float('nan'), 'a']))
+        self.assertNotEqual(return_content_hash({'a': True}), return_content_hash({'a': 1}))
+        self.assertNotEqual(return_content_hash([True]), return_content_hash([1.0]))
+        self.assertNotEqual(return_content_hash(['1']), return_content_hash([1]))
+        self.assertNotEqual(return_content_hash([None]), return_content_hash([]))
+        self.assertNotEqual(return_content_hash([2 ** 53 + 1]), return_content_hash([2 ** 53]))
+        self.assertNotEqual(return_content_hash([2 ** 53 + 1]), return_content_hash([float(2 ** 53)]))
+        self.assertNotEqual(return_content_hash([10 ** 400]), return_content_hash([10 ** 400 + 1]))
+        self.assertNotEqual(return_content_hash({'a': 'b'}), return_content_hash({'ab': ''}))
+        self.assertNotEqual(return_content_hash([[1, 2]]), return_content_hash([1, 2]))
+
+    def test_content_diff(self):
+        self.other.Cases[0].TreatmentPlans[1].Review.ApprovalStatus = 'Approved'
+        self.other.Cases[1].Base_ROIs.pop()
+        self.other.FilePath = 'moved.json'
+        self.assertEqual(self.patient.content_diff(self.other),
+                         ['Cases[0].TreatmentPlans[1].Review.ApprovalStatus', 'Cases[1].Base_ROIs'])
+        self.assertEqual(return_content_diff({'a': 1, 'b': {'c': [1, 2]}}, {'a': 1.0, 'b': {'c': [1, 3]}, 'd': 0}),
+                         ['b.c', 'd'])
+
+    def test_saved_header_hash(self):
+        database = PatientDatabase('Synthetic')
+        database.Patients[self.patient.RS_UID] = self.patient
+        with tempfile.TemporaryDirectory() as temp_directory:
+            database.save_to_directory(temp_directory, save_mode='serial')
+            header_database = PatientHeaderDatabase('Synthetic')
+            header_database.load_from_directory(temp_directory, load_mode='serial')
+            patient_header = header_database.PatientHeaders[self.patient.RS_UID]
+            self.assertEqual(patient_header.ContentHash, self.patient.content_hash())
+            lazy = header_database.return_patient_database(lazy=True)
+            proxy = lazy.Patients[self.patient.RS_UID]
+            self.assertEqual(proxy.content_hash(), self.patient.content_hash())
+            self.assertFalse(proxy.is_loaded())
+            file_name = [i for i in os.listdir(temp_directory) if i.endswith('.json') and '_Header' not in i
+                         and 'QCLs' not in i][0]
+            with open(os.path.join(temp_directory, file_name)) as json_file:
+                self.assertEqual(return_content_hash(json.load(json_file)), self.patient.content_hash())
+
+
+if __name__ == '__main__':
+    unittest.main()
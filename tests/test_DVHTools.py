@@ -0,0 +1,146 @@
+import json
+import os
+import re
+import tempfile
+import unittest
+import numpy as np
+from ..AbstractBase import ARRAY_KEY, PatientDatabases, RegionOfInterestDose, compare_values
+from ..BenchmarkTools import SyntheticDatabaseConfig, return_synthetic_databases
+from ..DVHTools import DVHMetric, DVHStack, compute_dvh_metrics, convert_dvhs_to_arrays, iterate_dose_rois, \
+    return_roi_matcher, stack_dvhs
+
+
+def return_dose_roi(doses, volumes, scaling_factor=1, name='Parotid_L') -> RegionOfInterestDose:
+    dose_roi = RegionOfInterestDose()
+    dose_roi.Name = name
+    dose_roi.AbsoluteDose = list(doses)
+    dose_roi.RelativeVolumes = list(volumes)
+    dose_roi.ScalingFactor = scaling_factor
+    dose_roi.Dose_Max_cGy = max(doses)
+    dose_roi.Dose_Min_cGy = min(doses)
+    dose_roi.Dose_Average_cGy = sum(doses) / len(doses)
+    return dose_roi
+
+
+class TestDVHStack(unittest.TestCase):
+    def setUp(self):
+        self.dose_rois = [return_dose_roi([4000, 3000, 2000, 1000, 0], [0, 0.25, 0.5, 0.75, 1.0]),
+                          return_dose_roi([200, 100, 0], [0, 0.5, 1.0], scaling_factor=30)]
+        self.keys = [('DB', str(i), 'Case 1', 'Plan', 'Label', 'Parotid_L') for i in range(len(self.dose_rois))]
+
+    def test_metrics(self):
+        dvh_stack = DVHStack(self.dose_rois, self.keys)
+        self.assertEqual(len(dvh_stack), 2)
+        np.testing.assert_allclose(DVHMetric('D50').evaluate(dvh_stack), [2000, 3000])
+        np.testing.assert_allclose(DVHMetric('D75%').evaluate(dvh_stack), [1000, 1500])
+        np.testing.assert_allclose(DVHMetric('V30Gy').evaluate(dvh_stack), [25, 50])
+        np.testing.assert_allclose(DVHMetric('V3000cGy').evaluate(dvh_stack), [25, 50])
+        np.testing.assert_allclose(DVHMetric('Dmax').evaluate(dvh_stack), [4000, 6000])
+        np.testing.assert_allclose(DVHMetric('Dmean').evaluate(dvh_stack), [2000, 3000])
+        with self.assertRaises(ValueError):
+            DVHMetric('D')
+
+    def test_percent_volumes(self):
+        """
+        The unit is given, not guessed: a percent DVH whose volumes all sit below 1.5% is still divided by 100
+        """
+        percent_rois = [return_dose_roi(i.AbsoluteDose, [v * 100 for v in i.RelativeVolumes], i.ScalingFactor)
+                        for i in self.dose_rois]
+        fraction_stack = DVHStack(self.dose_rois, self.keys)
+        percent_stack = DVHStack(percent_rois, self.keys, 'percent')
+        np.testing.assert_allclose(percent_stack.RelativeVolumes, fraction_stack.RelativeVolumes)
+        small_roi = return_dose_roi([400, 300, 200, 100], [0, 0.5, 1.0, 1.5])
+        np.testing.assert_allclose(DVHStack([small_roi], self.keys[:1], 'percent').dose_at_volume(0.01), [200])
+        np.testing.assert_allclose(DVHStack([small_roi], self.keys[:1]).dose_at_volume(0.5), [300])
+        with self.assertRaises(ValueError):
+            DVHStack(self.dose_rois, self.keys, 'percentage')
+
+    def test_uneven_lengths(self):
+        dvh_stack = DVHStack(self.dose_rois, self.keys)
+        self.assertEqual(dvh_stack.AbsoluteDose.shape, (2, 5))
+        self.assertTrue(np.isnan(dvh_stack.AbsoluteDose[1, 3:]).all())
+        self.assertEqual(len(DVHStack([], [])), 0)
+
+
+class TestArrayDVHs(unittest.TestCase):
+    def setUp(self):
+        self.dose_roi = return_dose_roi([4000.5, 3000.25, 2000.1, 1000, 0], [0, 0.25, 0.5, 0.75, 1.0])
+
+    def test_round_trip(self):
+        for dtype in ('float64', 'float32'):
+            dose_roi = RegionOfInterestDose.from_json(self.dose_roi.to_json())
+            dose_roi.to_arrays(dtype)
+            self.assertIsInstance(dose_roi.AbsoluteDose, np.ndarray)
+            self.assertEqual(dose_roi.AbsoluteDose.dtype, np.dtype(dtype))
+            data = json.loads(dose_roi.to_json())
+            self.assertEqual(data['AbsoluteDose']['dtype'], dtype)
+            self.assertIn(ARRAY_KEY, data['RelativeVolumes'])
+            loaded = RegionOfInterestDose.from_json(dose_roi.to_json())
+            self.assertEqual(loaded.AbsoluteDose.dtype, np.dtype(dtype))
+            np.testing.assert_array_equal(loaded.AbsoluteDose, dose_roi.AbsoluteDose)
+            np.testing.assert_array_equal(loaded.RelativeVolumes, dose_roi.RelativeVolumes)
+            np.testing.assert_allclose(loaded.AbsoluteDose, self.dose_roi.AbsoluteDose, rtol=1e-6)
+        dose_roi = RegionOfInterestDose.from_json(self.dose_roi.to_json())
+        dose_roi.to_arrays('float64')
+        self.assertTrue(compare_values(dose_roi.AbsoluteDose, self.dose_roi.AbsoluteDose))
+
+    def test_converted_databases(self):
+        config = SyntheticDatabaseConfig(database_count=1, patient_count=3, roi_count=4, dvh_points=11, beam_count=1,
+                                         qcl_count=0)
+        databases = return_synthetic_databases(config)
+        expected = stack_dvhs(databases, 'brainstem')
+        convert_dvhs_to_arrays(databases, 'float64')
+        self.assertTrue(all(isinstance(i[-1].AbsoluteDose, np.ndarray) for i in iterate_dose_rois(databases)))
+        with tempfile.TemporaryDirectory() as temp_directory:
+            databases.save(temp_directory, save_mode='serial')
+            loaded = PatientDatabases()
+            loaded.build_from_folder(temp_directory, load_mode='serial')
+        dvh_stack = stack_dvhs(loaded, 'brainstem')
+        self.assertEqual(dvh_stack.Keys, expected.Keys)
+        np.testing.assert_array_equal(dvh_stack.AbsoluteDose, expected.AbsoluteDose)
+        np.testing.assert_array_equal(dvh_stack.volume_at_dose(1000), expected.volume_at_dose(1000))
+
+    def test_roi_matcher(self):
+        self.assertTrue(return_roi_matcher('Parotid_L')('parotid_l'))
+        self.assertFalse(return_roi_matcher(['brainstem'])('parotid_l'))
+        self.assertTrue(return_roi_matcher(re.compile('parotid', re.IGNORECASE))('Parotid_R'))
+        self.assertFalse(return_roi_matcher(re.compile('otid'))('Parotid_R'))
+        self.assertTrue(return_roi_matcher(lambda name: name.endswith('_L'))('Parotid_L'))
+
+
+class TestDVHMetrics(unittest.TestCase):
+    def setUp(self):
+        config = SyntheticDatabaseConfig(database_count=2, patient_count=3, roi_count=4, dvh_points=11, beam_count=1,
+                                         qcl_count=0)
+        self.databases = return_synthetic_databases(config)
+
+    def return_expected(self, roi_name: str, volume: float) -> list:
+        expected = []
+        for _, _, _, _, _, dose_roi in iterate_dose_rois(self.databases):
+            if dose_roi.Name.lower() == roi_name.lower():
+                expected.append(np.interp(volume, dose_roi.RelativeVolumes[::-1] if dose_roi.RelativeVolumes[0] >
+                                          dose_roi.RelativeVolumes[-1] else dose_roi.RelativeVolumes,
+                                          dose_roi.AbsoluteDose[::-1] if dose_roi.RelativeVolumes[0] >
+                                          dose_roi.RelativeVolumes[-1] else dose_roi.AbsoluteDose)
+                                * dose_roi.ScalingFactor)
+        return expected
+
+    def test_compute_dvh_metrics(self):
+        roi_name = 'parotid_l'
+        dvh_stack = stack_dvhs(self.databases, roi_name)
+        self.assertGreater(len(dvh_stack), 0)
+        for thread_count in (1, 2):
+            table = compute_dvh_metrics(self.databases, ['D95', 'Dmax'], roi_name, thread_count=thread_count)
+            self.assertEqual(len(table), len(dvh_stack))
+            self.assertEqual(table.Columns[-2:], ['D95', 'Dmax'])
+            np.testing.assert_allclose(table.return_column('D95'), dvh_stack.dose_at_volume(0.95))
+            np.testing.assert_allclose(table.return_column('D95'), self.return_expected(roi_name, 0.95))
+        with tempfile.TemporaryDirectory() as temp_directory:
+            csv_path = os.path.join(temp_directory, 'metrics.csv')
+            table.to_csv(csv_path)
+            with open(csv_path) as csv_file:
+                self.assertEqual(len(csv_file.readlines()), len(table) + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import tempfile
+import unittest
+from ..AbstractBase import DirectoryCatalog, PatientDatabase, PatientHeaderDatabase, return_canonical_mrn, \
+    return_directory_catalog, return_existing_files
+from ..BenchmarkTools import SyntheticDatabaseConfig, write_synthetic_databases
+
+
+def return_files(mrns: list, date: str = '2023.1.1.0.0') -> dict:
+    """
+    (size, modification time) of the patient, header, and QCL file of each MRN, for a catalog built without a folder
+    """
+    files = {}
+    for mrn in mrns:
+        for suffix in ('.json', '_Header.json', 'QCLs.json'):
+            files[f"{mrn}_{date}{suffix}"] = (10, 1)
+    return files
+
+
+class TestMRNSelection(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def test_canonical_mrn(self):
+        self.assertEqual({return_canonical_mrn(i) for i in ('00012345', '012345', '12345', ' 12345 ', 12345)},
+                         {'12345'})
+        self.assertEqual(return_canonical_mrn('000'), '0')
+        self.assertEqual(return_canonical_mrn('1230'), '1230')
+
+    def test_select(self):
+        catalog = DirectoryCatalog(self.temp_directory.name, return_files(['0000123', '123', '00001230', 'A12']))
+        self.assertEqual(sorted(catalog.return_header_files(['00123'])),
+                         ['0000123_2023.1.1.0.0_Header.json', '123_2023.1.1.0.0_Header.json'])
+        self.assertEqual(catalog.return_patient_files(['1230']), ['00001230_2023.1.1.0.0.json'])
+        self.assertEqual(catalog.return_patient_files(['a12']), [])
+        self.assertEqual(catalog.return_patient_files(['A12']), ['A12_2023.1.1.0.0.json'])
+        self.assertEqual(len(catalog.return_patient_files()), 4)
+        self.assertEqual(len(catalog.return_patient_files([])), 4)
+
+    def test_load_specific_mrns(self):
+        config = SyntheticDatabaseConfig(database_count=1, patient_count=4, roi_count=2, dvh_points=5, beam_count=1,
+                                         qcl_count=0)
+        write_synthetic_databases(self.temp_directory.name, config, save_mode='serial')
+        database_path = os.path.join(self.temp_directory.name, os.listdir(self.temp_directory.name)[0])
+        database = PatientDatabase('Synthetic')
+        database.load_from_directory(database_path, specific_mrns=['1', '0003', '30'], load_mode='serial')
+        self.assertEqual(sorted(i.MRN for i in database.Patients.values()), ['00000001', '00000003'])
+        header_database = PatientHeaderDatabase('Synthetic')
+        header_database.load_from_directory(database_path, specific_mrns=['000000002'], load_mode='serial')
+        self.assertEqual([i.MRN for i in header_database.PatientHeaders.values()], ['00000002'])
+
+
+class TestDirectoryCatalog(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.path = self.temp_directory.name
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def write_files(self, file_names: list):
+        for file_name in file_names:
+            with open(os.path.join(self.path, file_name), 'w') as out_file:
+                out_file.write('{}')
+
+    def test_pairing(self):
+        files = return_files(['1', '2'])
+        files.pop('2_2023.1.1.0.0.json')
+        files['3_2023.1.1.0.0.json'] = (10, 1)
+        catalog = DirectoryCatalog(self.path, files)
+        self.assertEqual(catalog.return_header_files(), ['1_2023.1.1.0.0_Header.json', '2_2023.1.1.0.0_Header.json'])
+        self.assertEqual(catalog.return_patient_files(), ['1_2023.1.1.0.0.json'])
+        self.assertEqual(catalog.QCLFiles, {'1_2023.1.1.0.0QCLs.json', '2_2023.1.1.0.0QCLs.json'})
+
+    def test_versions_by_date(self):
+        files = return_files(['1'], '2023.10.1.0.0')
+        files.update(return_files(['1'], '2023.9.30.0.0'))
+        catalog = DirectoryCatalog(self.path, files)
+        self.assertEqual(catalog.return_patient_files(), ['1_2023.9.30.0.0.json', '1_2023.10.1.0.0.json'])
+
+    def test_compressions(self):
+        files = {'1_2023.1.1.0.0_Header.json.gz': (10, 1), '1_2023.1.1.0.0.json.xz': (10, 1),
+                 '2_2023.1.1.0.0_Header.json': (10, 1), '2_2023.1.1.0.0.json': (10, 1),
+                 '2_2023.1.1.0.0.json.gz': (10, 2)}
+        catalog = DirectoryCatalog(self.path, files)
+        self.assertEqual(catalog.return_patient_files(), ['1_2023.1.1.0.0.json.xz', '2_2023.1.1.0.0.json.gz'])
+        self.assertEqual(catalog.return_file_name('1_2023.1.1.0.0.json'), '1_2023.1.1.0.0.json.xz')
+        self.assertIsNone(catalog.return_file_name('3_2023.1.1.0.0.json'))
+
+    def test_scan_and_reuse(self):
+        self.write_files(['1_2023.1.1.0.0.json', '1_2023.1.1.0.0_Header.json', 'notes.txt'])
+        os.mkdir(os.path.join(self.path, 'folder.json'))
+        catalog = return_directory_catalog(self.path)
+        self.assertEqual(set(catalog.Files), {'1_2023.1.1.0.0.json', '1_2023.1.1.0.0_Header.json'})
+        self.assertEqual(catalog.return_size('1_2023.1.1.0.0.json'), 2)
+        self.assertIsNone(catalog.return_mtime('notes.txt'))
+        self.assertIs(return_directory_catalog(self.path), catalog)
+        self.assertIsNot(return_directory_catalog(self.path, refresh=True), catalog)
+        catalog = return_directory_catalog(self.path)
+        self.write_files(['2_2023.1.1.0.0.json.gz', '2_2023.1.1.0.0_Header.json'])
+        self.assertFalse(catalog.is_current())
+        catalog = return_directory_catalog(self.path)
+        self.assertTrue(catalog.is_current())
+        self.assertEqual(len(catalog.return_patient_files()), 2)
+        file_paths = [os.path.join(self.path, i) for i in ('1_2023.1.1.0.0.json', '2_2023.1.1.0.0.json',
+                                                            '3_2023.1.1.0.0.json')]
+        self.assertEqual(return_existing_files(file_paths), file_paths[:1])
+        self.assertEqual(return_existing_files(file_paths, any_compression=True),
+                         [file_paths[0], file_paths[1] + '.gz'])
+        self.assertEqual(return_existing_files([os.path.join(self.path, 'missing', 'a.json')]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from ..AbstractBase import PatientDatabases, PatientHeaderDatabases, StrippedDownRegionOfInterest
+from ..BenchmarkTools import SyntheticDatabaseConfig, write_synthetic_databases
+from ..EvaluationTools import SYNC_MANIFEST_NAME, RoiIndex, SyncManifest, copy_file_atomic, find_all_rois, \
+    identify_wanted_headers, plan_database_sync, return_roi_index, update_local_database
+
+CONFIG = SyntheticDatabaseConfig(database_count=2, patient_count=3, roi_count=4, dvh_points=5, beam_count=1,
+                                 qcl_count=1)
+
+
+def return_folder_files(path: str) -> dict:
+    """
+    Relative path to contents of every file under path, the sync manifest and update stamp left out
+    """
+    files = {}
+    for root, _, file_names in os.walk(path):
+        for file_name in file_names:
+            if file_name in (SYNC_MANIFEST_NAME, 'Last_Updated.txt'):
+                continue
+            with open(os.path.join(root, file_name), 'rb') as in_file:
+                files[os.path.relpath(os.path.join(root, file_name), path)] = in_file.read()
+    return files
+
+
+def return_scanned_patients(header_databases: PatientHeaderDatabases, roi_names=None, roi_types=None,
+                            body_sites=None) -> set:
+    """
+    What RoiIndex.return_patients should give, from a scan of every case
+    """
+    patients = set()
+    for db_name, header_database in header_databases.HeaderDatabases.items():
+        for rs_uid, patient_header in header_database.PatientHeaders.items():
+            for case in patient_header.Cases:
+                if body_sites is not None and case.BodySite.lower() not in [i.lower() for i in body_sites]:
+                    continue
+                if roi_names is None and roi_types is None:
+                    patients.add((db_name, rs_uid))
+                elif any((roi_names is None or roi.Name.lower() in roi_names) and
+                         (roi_types is None or roi.Type.lower() in [i.lower() for i in roi_types])
+                         for roi in case.ROIS):
+                    patients.add((db_name, rs_uid))
+    return patients
+
+
+class TestRoiIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        write_synthetic_databases(self.temp_directory.name, CONFIG, save_mode='serial')
+        self.header_databases = PatientHeaderDatabases()
+        self.header_databases.build_from_folder(self.temp_directory.name, load_mode='serial')
+        self.db_name = sorted(self.header_databases.HeaderDatabases)[0]
+        self.header_database = self.header_databases.HeaderDatabases[self.db_name]
+        self.patient_header = next(iter(self.header_database.PatientHeaders.values()))
+        roi = StrippedDownRegionOfInterest()
+        roi.Name = 'Lens_R'
+        roi.Type = 'Avoidance'
+        self.patient_header.Cases[0].ROIS.append(roi)
+        self.roi_index = RoiIndex()
+        self.roi_index.build(self.header_databases)
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def check_queries(self):
+        queries = [{}, {'roi_names': ['lens_r']}, {'roi_names': ['parotid_l']}, {'roi_types': ['AVOIDANCE']},
+                   {'roi_types': ['Organ'], 'body_sites': ['Head']}, {'roi_names': ['lens_r'], 'body_sites': ['head']},
+                   {'roi_names': ['lens_r'], 'roi_types': ['Organ']}, {'body_sites': ['Pelvis', 'thorax']}]
+        for query in queries:
+            self.assertEqual(self.roi_index.return_patients(**query),
+                             return_scanned_patients(self.header_databases, **query), query)
+
+    def test_queries(self):
+        self.check_queries()
+        self.assertEqual(self.roi_index.return_patients(roi_names=['lens_r']),
+                         {(self.db_name, self.patient_header.RS_UID)})
+        wanted = identify_wanted_headers(self.header_databases, ['lens_r'], ['avoidance'], self.roi_index)
+        self.assertEqual({key: list(value.PatientHeaders) for key, value in wanted.HeaderDatabases.items()
+                          if value.PatientHeaders}, {self.db_name: [self.patient_header.RS_UID]})
+
+    def test_update(self):
+        self.assertEqual(self.roi_index.update(self.header_databases), 0)
+        self.patient_header.Cases[0].ROIS[-1].Name = 'Lens_L'
+        removed = next(i for i in self.header_database.PatientHeaders if i != self.patient_header.RS_UID)
+        self.header_database.PatientHeaders.pop(removed)
+        self.assertEqual(self.roi_index.update(self.header_databases), 1)
+        self.assertNotIn('lens_r', self.roi_index.ROINames)
+        self.assertNotIn((self.db_name, removed), self.roi_index.return_patients())
+        self.check_queries()
+
+    def test_saved_index(self):
+        index_path = os.path.join(self.temp_directory.name, 'RoiIndex.json')
+        roi_index = return_roi_index(self.header_databases, index_path)
+        modified = os.stat(index_path).st_mtime_ns
+        loaded = return_roi_index(self.header_databases, index_path)
+        self.assertEqual(os.stat(index_path).st_mtime_ns, modified)
+        self.assertEqual(loaded.__dict__, roi_index.__dict__)
+        self.assertEqual(loaded.__dict__, self.roi_index.__dict__)
+
+    def test_find_all_rois(self):
+        self.assertEqual(sorted(find_all_rois(self.header_databases, self.roi_index)),
+                         ['brainstem', 'external', 'lens_r', 'parotid_l', 'spinalcord'])
+        other = PatientHeaderDatabases()
+        other.HeaderDatabases = {key: value for key, value in self.header_databases.HeaderDatabases.items()
+                                 if key != self.db_name}
+        self.assertNotIn('lens_r', find_all_rois(other, self.roi_index))
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.network_path = os.path.join(self.temp_directory.name, 'Network')
+        self.local_path = os.path.join(self.temp_directory.name, 'Local')
+        write_synthetic_databases(self.network_path, CONFIG, save_mode='serial')
+        self.db_name = sorted(os.listdir(self.network_path))[0]
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def return_plan(self):
+        return plan_database_sync(os.path.join(self.network_path, self.db_name),
+                                  os.path.join(self.local_path, self.db_name))
+
+    def test_sync(self):
+        update_local_database(self.local_path, self.network_path)
+        self.assertEqual(return_folder_files(self.local_path), return_folder_files(self.network_path))
+        plan = self.return_plan()
+        self.assertEqual((plan.CopyFiles, plan.DeleteFiles), ([], []))
+        with open(os.path.join(self.local_path, self.db_name, SYNC_MANIFEST_NAME)) as json_file:
+            manifest = json.load(json_file)
+        self.assertEqual(set(manifest), set(os.listdir(os.path.join(self.network_path, self.db_name))))
+        local = PatientDatabases()
+        local.build_from_folder(self.local_path, load_mode='serial')
+        self.assertEqual(sum(len(i.Patients) for i in local.Databases.values()),
+                         CONFIG.DatabaseCount * CONFIG.PatientCount)
+
+    def test_changed_and_removed_files(self):
+        update_local_database(self.local_path, self.network_path)
+        db_path = os.path.join(self.network_path, self.db_name)
+        file_names = sorted(os.listdir(db_path))
+        changed_file, removed_file = file_names[0], file_names[1]
+        with open(os.path.join(db_path, changed_file), 'a') as json_file:
+            json_file.write(' ')
+        os.remove(os.path.join(db_path, removed_file))
+        plan = self.return_plan()
+        self.assertEqual([os.path.basename(i[0]) for i in plan.CopyFiles], [changed_file])
+        self.assertEqual(plan.DeleteFiles, [removed_file])
+        update_local_database(self.local_path, self.network_path)
+        self.assertEqual(return_folder_files(self.local_path), return_folder_files(self.network_path))
+        self.assertEqual(self.return_plan().CopyFiles, [])
+
+    def test_hash_skips_touched_files(self):
+        update_local_database(self.local_path, self.network_path, use_hash=True)
+        file_path = os.path.join(self.network_path, self.db_name, sorted(os.listdir(
+            os.path.join(self.network_path, self.db_name)))[0])
+        stat = os.stat(file_path)
+        os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        plan = plan_database_sync(os.path.join(self.network_path, self.db_name),
+                                  os.path.join(self.local_path, self.db_name), use_hash=True)
+        self.assertEqual(plan.CopyFiles, [])
+        self.assertEqual(len(self.return_plan().CopyFiles), 1)
+
+    def test_path_like(self):
+        update_local_database(pathlib.Path(self.local_path), pathlib.Path(self.network_path))
+        self.assertEqual(return_folder_files(self.local_path), return_folder_files(self.network_path))
+        manifest = SyncManifest(pathlib.Path(self.local_path, self.db_name))
+        self.assertTrue(manifest.load())
+        manifest.save()
+        index_path = pathlib.Path(self.temp_directory.name, 'RoiIndex.json')
+        RoiIndex().save(index_path)
+        self.assertEqual(RoiIndex.load(index_path).ROINames, {})
+
+    def test_failed_copy_leaves_no_part_file(self):
+        source = pathlib.Path(self.temp_directory.name, 'source.json')
+        source.write_text('{"a": 1}')
+        destination = pathlib.Path(self.temp_directory.name, 'destination.json')
+
+        def copy_half(source_path, destination_path):
+            with open(destination_path, 'w') as out_file:
+                out_file.write('{"a"')
+            raise OSError('network gone')
+
+        with mock.patch.object(shutil, 'copyfile', copy_half):
+            with self.assertRaises(OSError):
+                copy_file_atomic(source, destination)
+        self.assertFalse(os.path.exists(str(destination) + '.part'))
+        self.assertFalse(destination.exists())
+        copy_file_atomic(source, destination)
+        self.assertEqual(destination.read_text(), '{"a": 1}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import json
+import tempfile
+import unittest
+from ..AbstractBase import FieldProjection, PatientClass, PatientDatabases, PatientHeaderDatabases
+from ..BenchmarkTools import SyntheticDatabaseConfig, make_synthetic_patient, write_synthetic_databases
+
+CONFIG = SyntheticDatabaseConfig(database_count=1, patient_count=3, roi_count=4, dvh_points=5, beam_count=1,
+                                 qcl_count=1)
+
+
+def return_json(value) -> dict:
+    return json.loads(value.to_json(exclude=['FilePath']))
+
+
+class TestFieldProjection(unittest.TestCase):
+    def setUp(self):
+        self.patient = make_synthetic_patient(1, CONFIG)
+        self.data = json.loads(self.patient.to_json())
+
+    def test_include(self):
+        loaded = PatientClass.from_json(self.data, ['Cases.TreatmentPlans'])
+        self.assertEqual(loaded.MRN, self.patient.MRN)
+        self.assertEqual(len(loaded.Cases), len(self.patient.Cases))
+        for case, original in zip(loaded.Cases, self.patient.Cases):
+            self.assertEqual(case.CaseName, original.CaseName)
+            self.assertEqual(case.Examinations, [])
+            self.assertEqual(case.Base_ROIs, [])
+            self.assertEqual([return_json(i) for i in case.TreatmentPlans],
+                             [return_json(i) for i in original.TreatmentPlans])
+
+    def test_exclude(self):
+        loaded = PatientClass.from_json(self.data, ['!Cases.Examinations'])
+        for case, original in zip(loaded.Cases, self.patient.Cases):
+            self.assertEqual(case.Examinations, [])
+            self.assertEqual([return_json(i) for i in case.Base_ROIs], [return_json(i) for i in original.Base_ROIs])
+            self.assertEqual([return_json(i) for i in case.TreatmentPlans],
+                             [return_json(i) for i in original.TreatmentPlans])
+
+    def test_everything(self):
+        self.assertTrue(FieldProjection().Everything)
+        self.assertFalse(FieldProjection(['Cases'], PatientClass).Everything)
+        loaded = PatientClass.from_json(self.data, [])
+        self.assertEqual(return_json(loaded), return_json(self.patient))
+
+    def test_unknown_path(self):
+        with self.assertRaises(ValueError):
+            FieldProjection(['Cases.NotAnAttribute'], PatientClass)
+        with self.assertRaises(ValueError):
+            FieldProjection(['MRN.Something'], PatientClass)
+
+
+class TestProjectedLoading(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        write_synthetic_databases(self.temp_directory.name, CONFIG, save_mode='serial')
+        self.header_databases = PatientHeaderDatabases()
+        self.header_databases.build_from_folder(self.temp_directory.name, load_mode='serial')
+        self.header_database = next(iter(self.header_databases.HeaderDatabases.values()))
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def test_projected_patients_are_not_saved(self):
+        databases = PatientDatabases()
+        databases.build_from_folder(self.temp_directory.name, load_mode='serial', fields=['!Cases.Examinations'])
+        database = next(iter(databases.Databases.values()))
+        self.assertEqual(len(database.Patients), CONFIG.PatientCount)
+        patient = next(iter(database.Patients.values()))
+        self.assertTrue(all(case.Examinations == [] for case in patient.Cases))
+        with self.assertRaises(ValueError):
+            patient.save_to_directory(self.temp_directory.name)
+
+    def test_proxy_load_case(self):
+        fields = ['!Cases.Examinations']
+        lazy = self.header_database.return_patient_database(lazy=True, fields=fields)
+        eager = self.header_database.return_patient_database(load_mode='serial', fields=fields)
+        symbol_table = self.header_database.SymbolTable
+        for rs_uid, proxy in lazy.Patients.items():
+            case = proxy.load_case(0)
+            self.assertFalse(proxy.is_loaded())
+            self.assertEqual(case.Examinations, [])
+            self.assertEqual(return_json(case), return_json(eager.Patients[rs_uid].Cases[0]))
+            self.assertIs(case.BodySite, symbol_table.intern(case.BodySite))
+            self.assertIs(case.TreatmentPlans[0].PlannedBy, symbol_table.intern(case.TreatmentPlans[0].PlannedBy))
+
+    def test_proxy_load_case_without_cases(self):
+        lazy = self.header_database.return_patient_database(lazy=True, fields=['!Cases'])
+        proxy = next(iter(lazy.Patients.values()))
+        with self.assertRaises(IndexError):
+            proxy.load_case(0)
+        self.assertEqual(proxy.Cases, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import json
+import os
+import tempfile
+import unittest
+from ..AbstractBase import LoadReport, PatientHeader, PatientHeaderDatabase
+from ..BenchmarkTools import SyntheticDatabaseConfig, return_synthetic_databases
+from ..HeaderCache import load_header_database_from_cache, return_cache_file_path, update_header_cache
+
+
+def return_header_json(header: PatientHeader) -> dict:
+    return json.loads(header.to_json(exclude=['FilePath']))
+
+
+class TestHeaderCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.cache_directory = os.path.join(self.temp_directory.name, 'Cache')
+        config = SyntheticDatabaseConfig(database_count=1, patient_count=4, roi_count=4, dvh_points=5, beam_count=1,
+                                         qcl_count=1)
+        databases = return_synthetic_databases(config)
+        self.db_name = next(iter(databases.Databases))
+        self.database_path = os.path.join(self.temp_directory.name, self.db_name)
+        databases.save(self.temp_directory.name, save_mode='serial')
+        self.header_files = sorted(i for i in os.listdir(self.database_path) if i.endswith('_Header.json'))
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def return_json_headers(self) -> dict:
+        return {file_name: return_header_json(PatientHeader.from_json_file(os.path.join(self.database_path, file_name)))
+                for file_name in self.header_files}
+
+    def return_cached_headers(self, cache) -> dict:
+        return {cache.return_string('FileName', row): return_header_json(cache.return_header(row))
+                for row in range(len(cache))}
+
+    def test_round_trip(self):
+        expected = self.return_json_headers()
+        self.assertTrue(any(plan['Review'] and plan['Review'].get('ReviewerName')
+                            for header in expected.values() for case in header['Cases']
+                            for plan in case['TreatmentPlans']))
+        self.assertTrue(all(header['TreatmentNotes'] for header in expected.values()))
+        cache = update_header_cache(self.database_path, self.cache_directory)
+        try:
+            self.assertEqual(self.return_cached_headers(cache), expected)
+            self.assertTrue(all(cache.check_exact(row) for row in range(len(cache))))
+        finally:
+            cache.close()
+        """
+        Rows carried over from the previous cache are as exact as the ones parsed from json
+        """
+        os.utime(os.path.join(self.database_path, self.header_files[0]), ns=(0, 0))
+        cache = update_header_cache(self.database_path, self.cache_directory)
+        try:
+            self.assertEqual(self.return_cached_headers(cache), expected)
+        finally:
+            cache.close()
+
+    def test_unchanged_cache_is_reused(self):
+        update_header_cache(self.database_path, self.cache_directory).close()
+        cache_file_path = return_cache_file_path(self.database_path, self.cache_directory)
+        cache_mtime = os.stat(cache_file_path).st_mtime_ns
+        update_header_cache(self.database_path, self.cache_directory).close()
+        self.assertEqual(os.stat(cache_file_path).st_mtime_ns, cache_mtime)
+
+    def test_unreadable_header(self):
+        broken_file = self.header_files[0]
+        with open(os.path.join(self.database_path, broken_file), 'w') as header_file:
+            header_file.write('{broken')
+        report = LoadReport('test')
+        cache = update_header_cache(self.database_path, self.cache_directory, report=report)
+        try:
+            self.assertEqual(len(report.Failures), 1)
+            self.assertEqual(len(cache), len(self.header_files) - 1)
+            self.assertNotIn(broken_file, cache.return_file_mtimes())
+        finally:
+            cache.close()
+        header_database = PatientHeaderDatabase(self.db_name)
+        report = load_header_database_from_cache(header_database, self.database_path,
+                                                 cache_directory=self.cache_directory)
+        self.assertEqual((report.Total, report.Succeeded, len(report.Failures)),
+                         (len(self.header_files), len(self.header_files) - 1, 1))
+
+    def test_inexact_header(self):
+        """
+        A value the columns cannot hold as it is, the header is read from its json file instead
+        """
+        file_path = os.path.join(self.database_path, self.header_files[0])
+        with open(file_path) as header_file:
+            header_dict = json.load(header_file)
+        plan = next(plan for case in header_dict['Cases'] for plan in case['TreatmentPlans'] if plan['Review'])
+        plan['Review']['ApprovalStatus'] = 1
+        with open(file_path, 'w') as header_file:
+            json.dump(header_dict, header_file)
+        expected = self.return_json_headers()
+        cache = update_header_cache(self.database_path, self.cache_directory)
+        try:
+            exact = {cache.return_string('FileName', row): cache.check_exact(row) for row in range(len(cache))}
+        finally:
+            cache.close()
+        self.assertEqual(exact, {file_name: file_name != self.header_files[0] for file_name in self.header_files})
+        header_database = PatientHeaderDatabase(self.db_name)
+        report = load_header_database_from_cache(header_database, self.database_path,
+                                                 cache_directory=self.cache_directory)
+        self.assertEqual(report.Succeeded, len(self.header_files))
+        loaded = {os.path.basename(header.FilePath): return_header_json(header)
+                  for header in header_database.PatientHeaders.values()}
+        self.assertEqual(loaded, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import json
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+from .. import AbstractBase
+from ..AbstractBase import JSON_CODECS, PatientClass, PatientDatabases, return_json_codec, set_default_json_codec
+from ..BenchmarkTools import SyntheticDatabaseConfig, make_synthetic_patient, write_synthetic_databases
+
+CONFIG = SyntheticDatabaseConfig(database_count=1, patient_count=3, roi_count=4, dvh_points=5, beam_count=1,
+                                 qcl_count=1)
+
+
+class TestJsonCodec(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.patient = make_synthetic_patient(1, CONFIG)
+        self.expected = json.loads(self.patient.to_json(codec='json'))
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def test_round_trip(self):
+        """
+        Every installed codec reads what every other one wrote
+        """
+        for writer in JSON_CODECS:
+            file_path = os.path.join(self.temp_directory.name, f"{writer}.json")
+            self.patient.to_json_file(file_path, codec=writer)
+            for reader in JSON_CODECS:
+                loaded = PatientClass.from_json_file(file_path, codec=reader)
+                self.assertEqual(json.loads(loaded.to_json(codec='json')), self.expected, (writer, reader))
+
+    def test_memory_mapped_read(self):
+        file_path = os.path.join(self.temp_directory.name, 'patient.json')
+        self.patient.to_json_file(file_path)
+        with open(file_path, 'ab') as json_file:
+            json_file.write(b'\nnot json')
+        for name, codec in JSON_CODECS.items():
+            with mock.patch.object(AbstractBase, 'MMAP_MIN_BYTES', 1):
+                loaded = PatientClass.from_json_file(file_path, codec=codec)
+            self.assertEqual(json.loads(loaded.to_json(codec='json')), self.expected, name)
+
+    def test_non_finite_values(self):
+        """
+        The default writer keeps NaN and Infinity
+        """
+        data = {'a': float('nan'), 'b': [float('inf'), 1]}
+        loaded = return_json_codec().loads(return_json_codec().dumps(data))
+        self.assertNotEqual(loaded['a'], loaded['a'])
+        self.assertEqual(loaded['b'], [float('inf'), 1])
+        self.assertEqual(return_json_codec('json').loads(b'[NaN, 1]')[1], 1)
+        for codec in JSON_CODECS.values():
+            self.assertEqual(codec.loads(b'[Infinity, 100000000000000000000000]')[1], 10 ** 23)
+
+    def test_names(self):
+        self.assertIs(return_json_codec('json'), JSON_CODECS['json'])
+        self.assertIs(return_json_codec(JSON_CODECS['json']), JSON_CODECS['json'])
+        self.assertIs(return_json_codec(), JSON_CODECS[AbstractBase.DEFAULT_JSON_CODEC])
+        with self.assertRaises(ValueError):
+            return_json_codec('simplejson')
+        default = AbstractBase.DEFAULT_JSON_CODEC
+        with self.assertRaises(ValueError):
+            set_default_json_codec('simplejson')
+        self.assertEqual(AbstractBase.DEFAULT_JSON_CODEC, default)
+        try:
+            set_default_json_codec('json')
+            self.assertIs(return_json_codec(), JSON_CODECS['json'])
+        finally:
+            set_default_json_codec(default)
+        for codec in JSON_CODECS.values():
+            self.assertIs(pickle.loads(pickle.dumps(codec)), codec)
+
+    def test_database_codec(self):
+        write_synthetic_databases(self.temp_directory.name, CONFIG, save_mode='serial')
+        loaded = {}
+        for codec in JSON_CODECS:
+            databases = PatientDatabases()
+            databases.build_from_folder(self.temp_directory.name, load_mode='process', codec=codec)
+            loaded[codec] = {key: json.loads(patient.to_json(codec='json'))
+                             for database in databases.Databases.values()
+                             for key, patient in database.Patients.items()}
+        self.assertEqual(len(loaded['json']), CONFIG.PatientCount)
+        for codec in JSON_CODECS:
+            self.assertEqual(loaded[codec], loaded['json'], codec)
+
+
+if __name__ == '__main__':
+    unittest.main()
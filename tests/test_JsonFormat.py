@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+import unittest
+from ..AbstractBase import FORMAT_VERSION_KEY, JSON_FORMAT_VERSION, PatientClass, PatientHeader, QCLListClass, \
+    migrate_legacy_directory, migrate_legacy_file, return_class_for_file
+from ..BenchmarkTools import SyntheticDatabaseConfig, make_synthetic_patient
+
+CONFIG = SyntheticDatabaseConfig(roi_count=4, dvh_points=5, beam_count=1, qcl_count=1)
+
+
+def return_patient_json(patient) -> dict:
+    return json.loads(patient.to_json(exclude=['FilePath']))
+
+
+def return_legacy_data(data):
+    """
+    A version 2 dictionary as version 1 wrote it, every child object an escaped json string inside of its parent
+    """
+    def encode(value):
+        if isinstance(value, dict) and any(key.startswith('__') and key.endswith('__') for key in value):
+            return json.dumps(return_legacy_data(value))
+        if isinstance(value, list):
+            return [encode(i) for i in value]
+        if isinstance(value, dict):
+            return {key: encode(dict_value) for key, dict_value in value.items()}
+        return value
+    return {key: encode(value) for key, value in data.items() if key != FORMAT_VERSION_KEY}
+
+
+class TestJsonFormat(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.patient = make_synthetic_patient(1, CONFIG)
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def test_nested_round_trip(self):
+        data = json.loads(self.patient.to_json())
+        self.assertEqual(data[FORMAT_VERSION_KEY], JSON_FORMAT_VERSION)
+        self.assertIsInstance(data['Cases'][0], dict)
+        self.assertIsInstance(data['Cases'][0]['TreatmentPlans'][0], dict)
+        loaded = PatientClass.from_json(self.patient.to_json())
+        self.assertEqual(return_patient_json(loaded), return_patient_json(self.patient))
+
+    def test_legacy_round_trip(self):
+        legacy_json = json.dumps(return_legacy_data(self.patient.to_dict()))
+        self.assertIsInstance(json.loads(legacy_json)['Cases'][0], str)
+        loaded = PatientClass.from_json(legacy_json)
+        self.assertEqual(return_patient_json(loaded), return_patient_json(self.patient))
+
+    def test_class_for_file(self):
+        stem = f"{self.patient.RS_UID}_2023.1.2.3.4"
+        self.assertIs(return_class_for_file(stem + '.json'), PatientClass)
+        self.assertIs(return_class_for_file(stem + '_Header.json.gz'), PatientHeader)
+        self.assertIs(return_class_for_file(stem + 'QCLs.json'), QCLListClass)
+        for file_name in ('SyncManifest.json', 'BenchmarkResults.json', 'notes_final.json'):
+            self.assertIsNone(return_class_for_file(file_name))
+
+    def test_migrate_directory(self):
+        directory_path = self.temp_directory.name
+        self.patient.save_to_directory(directory_path)
+        patient_files = sorted(os.listdir(directory_path))
+        self.assertEqual(len(patient_files), 3)
+        for file_name in patient_files:
+            file_path = os.path.join(directory_path, file_name)
+            with open(file_path) as json_file:
+                data = json.load(json_file)
+            with open(file_path, 'w') as json_file:
+                json.dump(return_legacy_data(data), json_file)
+        other_files = {'SyncManifest.json': '{"version": 1, "Files": {}}', 'BenchmarkResults.json': '{"a": 1}'}
+        for file_name, text in other_files.items():
+            with open(os.path.join(directory_path, file_name), 'w') as json_file:
+                json_file.write(text)
+        self.assertEqual(migrate_legacy_directory(directory_path), 3)
+        self.assertEqual(migrate_legacy_directory(directory_path), 0)
+        for file_name, text in other_files.items():
+            with open(os.path.join(directory_path, file_name)) as json_file:
+                self.assertEqual(json_file.read(), text)
+        patient_file = next(i for i in patient_files if return_class_for_file(i) is PatientClass)
+        with open(os.path.join(directory_path, patient_file)) as json_file:
+            data = json.load(json_file)
+        self.assertEqual(data[FORMAT_VERSION_KEY], JSON_FORMAT_VERSION)
+        self.assertIsInstance(data['Cases'][0], dict)
+        loaded = PatientClass.from_json(data)
+        self.assertEqual(json.loads(loaded.to_json(exclude=['FilePath', 'QCL_List'])),
+                         json.loads(self.patient.to_json(exclude=['FilePath', 'QCL_List'])))
+        with self.assertRaises(ValueError):
+            migrate_legacy_file(os.path.join(directory_path, 'SyncManifest.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
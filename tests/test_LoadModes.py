@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+import unittest
+from ..AbstractBase import PatientDatabases, PatientHeaderDatabases
+from ..BenchmarkTools import SyntheticDatabaseConfig, write_synthetic_databases
+
+CONFIG = SyntheticDatabaseConfig(database_count=2, patient_count=4, roi_count=4, dvh_points=5, beam_count=1,
+                                 qcl_count=1)
+
+
+def return_patients_json(databases: PatientDatabases) -> dict:
+    return {db_name: {key: json.loads(patient.to_json(exclude=['FilePath']))
+                      for key, patient in database.Patients.items()}
+            for db_name, database in databases.Databases.items()}
+
+
+def return_headers_json(header_databases: PatientHeaderDatabases) -> dict:
+    return {db_name: {key: json.loads(header.to_json(exclude=['FilePath']))
+                      for key, header in database.PatientHeaders.items()}
+            for db_name, database in header_databases.HeaderDatabases.items()}
+
+
+class TestProcessLoading(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        write_synthetic_databases(self.temp_directory.name, CONFIG, save_mode='serial')
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def return_databases(self, load_mode: str) -> PatientDatabases:
+        databases = PatientDatabases()
+        databases.build_from_folder(self.temp_directory.name, load_mode=load_mode)
+        return databases
+
+    def test_patients(self):
+        serial = self.return_databases('serial')
+        process = self.return_databases('process')
+        self.assertEqual(return_patients_json(process), return_patients_json(serial))
+        for database in process.Databases.values():
+            self.assertEqual(database.LastLoadReport.WorkerKind, 'process')
+            self.assertEqual(database.LastLoadReport.Succeeded, CONFIG.PatientCount)
+            """
+            Patients built in a worker process are interned into the database's table once they are back
+            """
+            for patient in database.Patients.values():
+                for case in patient.Cases:
+                    self.assertIs(case.BodySite, database.SymbolTable.intern(case.BodySite))
+
+    def test_headers(self):
+        serial = PatientHeaderDatabases()
+        serial.build_from_folder(self.temp_directory.name, load_mode='serial')
+        process = PatientHeaderDatabases()
+        process.build_from_folder(self.temp_directory.name, load_mode='process')
+        self.assertEqual(return_headers_json(process), return_headers_json(serial))
+        self.assertEqual({key: len(value) for key, value in return_headers_json(process).items()},
+                         {key: CONFIG.PatientCount for key in process.HeaderDatabases})
+
+    def test_damaged_file(self):
+        db_name = sorted(os.listdir(self.temp_directory.name))[0]
+        database_path = os.path.join(self.temp_directory.name, db_name)
+        file_name = sorted(i for i in os.listdir(database_path) if i.endswith('.json') and '_Header' not in i
+                           and 'QCLs' not in i)[0]
+        with open(os.path.join(database_path, file_name), 'w') as json_file:
+            json_file.write('{"broken')
+        report = self.return_databases('process').Databases[db_name].LastLoadReport
+        self.assertEqual((report.Succeeded, list(report.Failures)),
+                         (CONFIG.PatientCount - 1, [os.path.join(database_path, file_name)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from ..AbstractBase import LoadPredicate, PatientDatabases, PatientHeaderDatabases, return_date_tuple
+from ..BenchmarkTools import SyntheticDatabaseConfig, write_synthetic_databases
+
+CONFIG = SyntheticDatabaseConfig(database_count=2, patient_count=5, roi_count=4, dvh_points=5, beam_count=1,
+                                 qcl_count=0)
+PREDICATES = [LoadPredicate(approved_only=True), LoadPredicate(body_sites=['HEAD', 'pelvis']),
+              LoadPredicate(modified_after=(2023, 2), modified_before=(2023, 4, 30)),
+              LoadPredicate(roi_names=['parotid_l', 'BRAINSTEM']), LoadPredicate(roi_names=['Lens_R']),
+              LoadPredicate(approved_only=True, body_sites=['Thorax'], modified_before=(2023, 3))]
+
+
+def return_json(databases) -> dict:
+    if isinstance(databases, PatientHeaderDatabases):
+        return {db_name: {key: json.loads(value.to_json(exclude=['FilePath']))
+                          for key, value in database.PatientHeaders.items()}
+                for db_name, database in databases.HeaderDatabases.items()}
+    return {db_name: {key: json.loads(value.to_json(exclude=['FilePath']))
+                      for key, value in database.Patients.items()}
+            for db_name, database in databases.Databases.items()}
+
+
+class TestLoadPredicate(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        write_synthetic_databases(self.temp_directory.name, CONFIG, save_mode='serial')
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def return_filtered(self, databases, predicate: LoadPredicate):
+        """
+        Everything loaded first, then pruned by filter_object
+        """
+        if isinstance(databases, PatientHeaderDatabases):
+            objects_by_database = [i.PatientHeaders for i in databases.HeaderDatabases.values()]
+        else:
+            objects_by_database = [i.Patients for i in databases.Databases.values()]
+        rejected = 0
+        for objects in objects_by_database:
+            for key in list(objects):
+                if not predicate.filter_object(objects[key]):
+                    objects.pop(key)
+                    rejected += 1
+        return databases, rejected
+
+    def test_patients(self):
+        for predicate in PREDICATES:
+            databases = PatientDatabases()
+            databases.build_from_folder(self.temp_directory.name, load_mode='serial')
+            expected, rejected = self.return_filtered(databases, predicate)
+            loaded = PatientDatabases()
+            reports = loaded.build_from_folder(self.temp_directory.name, load_mode='thread', predicate=predicate)
+            self.assertEqual(return_json(loaded), return_json(expected))
+            self.assertEqual(sum(i.Rejected for i in reports.values()), rejected)
+            self.assertFalse([i for i in reports.values() if i.Failures])
+
+    def test_headers(self):
+        for predicate in PREDICATES:
+            header_databases = PatientHeaderDatabases()
+            header_databases.build_from_folder(self.temp_directory.name, load_mode='serial')
+            expected, _ = self.return_filtered(header_databases, predicate)
+            loaded = PatientHeaderDatabases()
+            loaded.build_from_folder(self.temp_directory.name, load_mode='serial', predicate=predicate)
+            self.assertEqual(return_json(loaded), return_json(expected))
+
+    def test_rejected_by_header(self):
+        """
+        A patient its header rules out is never read, a broken patient file behind it is not a failure
+        """
+        predicate = LoadPredicate(modified_after=(2023, 2))
+        db_name = sorted(os.listdir(self.temp_directory.name))[0]
+        database_path = os.path.join(self.temp_directory.name, db_name)
+        oldest = sorted(i for i in os.listdir(database_path) if i.startswith('00000000_') and '_Header' not in i)[0]
+        with open(os.path.join(database_path, oldest), 'w') as json_file:
+            json_file.write('{"broken')
+        databases = PatientDatabases()
+        report = databases.build_from_folder(self.temp_directory.name, load_mode='serial', predicate=predicate)[db_name]
+        self.assertEqual((report.Rejected, report.Failures), (1, {}))
+        self.assertEqual(len(databases.Databases[db_name].Patients), CONFIG.PatientCount - 1)
+
+    def test_dates(self):
+        predicate = LoadPredicate(modified_after=datetime(2023, 2, 2), modified_before=(2023, 3))
+        self.assertTrue(predicate.accepts_date(return_date_tuple((2023, 2, 2, 1, 1))))
+        self.assertTrue(predicate.accepts_date(return_date_tuple((2023, 3))))
+        self.assertFalse(predicate.accepts_date(return_date_tuple({'year': 2023, 'month': 3, 'day': 1, 'minute': 1})))
+        self.assertFalse(predicate.accepts_date(return_date_tuple(datetime(2023, 2, 1, 23, 59))))
+        self.assertFalse(predicate.accepts_date(None))
+        self.assertTrue(LoadPredicate(body_sites=['Head']).accepts_date(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
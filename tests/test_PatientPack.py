@@ -0,0 +1,176 @@
+import json
+import os
+import tempfile
+import unittest
+from threading import Thread
+from ..AbstractBase import PatientDatabase, PatientDatabases, PatientHeader, PatientHeaderDatabases, \
+    return_content_hash
+from ..BenchmarkTools import SyntheticDatabaseConfig, return_synthetic_databases
+from ..PatientPack import PatientPack, PatientPackWriter, clear_patient_packs, pack_directory, read_packed_file, \
+    return_patient_pack, PACK_SUFFIX
+
+
+def return_patients_json(database: PatientDatabase) -> dict:
+    return {key: json.loads(patient.to_json(exclude=['FilePath'])) for key, patient in database.Patients.items()}
+
+
+class TestPatientPackWriter(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.pack_path = os.path.join(self.temp_directory.name, 'Pack_000001.pack')
+
+    def tearDown(self):
+        clear_patient_packs()
+        self.temp_directory.cleanup()
+
+    def test_round_trip(self):
+        files = {'A_2023.1.1.0.0.json': b'{"a": 1}', 'A_2023.1.1.0.0_Header.json': b'{"b": [1, 2]}',
+                 'B_2023.2.1.0.0QCLs.json': b'[]'}
+        for compression in (None, 'gz', 'xz'):
+            writer = PatientPackWriter(self.pack_path, compression)
+            for file_name, data in files.items():
+                writer.add_file(file_name + ('.' + compression if compression else ''), data)
+            writer.close()
+            self.assertFalse(os.path.exists(self.pack_path + '.tmp'))
+            patient_pack = PatientPack(self.pack_path)
+            try:
+                self.assertEqual(set(patient_pack.Files), set(files))
+                for file_name, data in files.items():
+                    self.assertEqual(patient_pack.return_bytes(file_name), data)
+                with self.assertRaises(FileNotFoundError):
+                    patient_pack.return_bytes('missing.json')
+            finally:
+                patient_pack.close()
+
+    def test_abort(self):
+        writer = PatientPackWriter(self.pack_path)
+        writer.add_file('A_2023.1.1.0.0.json', b'{}')
+        writer.abort()
+        self.assertEqual(os.listdir(self.temp_directory.name), [])
+
+    def test_clear_while_reading(self):
+        writer = PatientPackWriter(self.pack_path, 'gz')
+        files = {f"A_2023.1.{i}.0.0.json": json.dumps({'a': i}).encode('utf-8') for i in range(1, 20)}
+        for file_name, data in files.items():
+            writer.add_file(file_name, data)
+        writer.close()
+        patient_pack = return_patient_pack(self.pack_path)
+        clear_patient_packs()
+        self.assertIsNone(patient_pack.return_record('A_2023.1.1.0.0.json'))
+        with self.assertRaises(ValueError):
+            patient_pack.return_bytes('A_2023.1.1.0.0.json')
+        self.assertEqual(read_packed_file(self.pack_path, 'A_2023.1.1.0.0.json.gz'), files['A_2023.1.1.0.0.json'])
+        errors = []
+
+        def read_files():
+            try:
+                for _ in range(50):
+                    for file_name, data in files.items():
+                        if read_packed_file(self.pack_path, file_name) != data:
+                            errors.append(file_name)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [Thread(target=read_files) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            clear_patient_packs()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_not_a_pack(self):
+        with open(self.pack_path, 'wb') as pack_file:
+            pack_file.write(b'junk' * 20)
+        with self.assertRaises(ValueError):
+            PatientPack(self.pack_path)
+
+
+class TestPackDirectory(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        config = SyntheticDatabaseConfig(database_count=1, patient_count=3, roi_count=4, dvh_points=5, beam_count=1,
+                                         qcl_count=1)
+        self.databases = return_synthetic_databases(config)
+        self.database = next(iter(self.databases.Databases.values()))
+        self.database_path = os.path.join(self.temp_directory.name, self.database.DBName)
+        self.databases.save(self.temp_directory.name, save_mode='serial')
+
+    def tearDown(self):
+        clear_patient_packs()
+        self.temp_directory.cleanup()
+
+    def return_loaded_database(self) -> PatientDatabase:
+        databases = PatientDatabases()
+        databases.build_from_folder(self.temp_directory.name, load_mode='serial')
+        databases.load_qcls(load_mode='serial')
+        return databases.Databases[self.database.DBName]
+
+    def test_round_trip(self):
+        expected = return_patients_json(self.return_loaded_database())
+        packs = pack_directory(self.database_path, compression='gz')
+        self.assertEqual(sorted(os.listdir(self.database_path)), packs)
+        self.assertEqual(return_patients_json(self.return_loaded_database()), expected)
+        header_databases = PatientHeaderDatabases()
+        header_databases.build_from_folder(self.temp_directory.name, load_mode='serial')
+        self.assertEqual(set(header_databases.HeaderDatabases[self.database.DBName].PatientHeaders), set(expected))
+
+    def test_newest_version(self):
+        """
+        October is newer than September, though '2023.9' sorts after '2023.10' as a string
+        """
+        patient = next(iter(self.database.Patients.values()))
+        for month, name in ((9, 'September'), (10, 'October')):
+            patient.DateLastModified.month = month
+            patient.Name_First = name
+            patient.save_to_directory(self.database_path)
+        packs = pack_directory(self.database_path, remove_files=False)
+        patient_pack = PatientPack(os.path.join(self.database_path, packs[0]))
+        try:
+            self.assertEqual(patient_pack.load_patient(patient.RS_UID).Name_First, 'October')
+        finally:
+            patient_pack.close()
+        """
+        Both versions in one pack, only the name dates can tell them apart
+        """
+        pack_path = os.path.join(self.temp_directory.name, 'Pack_000001' + PACK_SUFFIX)
+        writer = PatientPackWriter(pack_path)
+        for month, name in ((10, 'October'), (9, 'September')):
+            patient.DateLastModified.month = month
+            patient.Name_First = name
+            stem = f"{patient.RS_UID}_2023.{month}.1.0.0"
+            writer.add_file(stem + '.json', patient.to_json(exclude=['FilePath']).encode('utf-8'))
+            header = PatientHeader()
+            header.build(patient)
+            writer.add_file(stem + '_Header.json', header.to_json(exclude=['FilePath']).encode('utf-8'))
+        writer.close()
+        patient_pack = PatientPack(pack_path)
+        try:
+            self.assertEqual(patient_pack.return_patient_file_names(patient.RS_UID)['Header'],
+                             f"{patient.RS_UID}_2023.10.1.0.0_Header.json")
+            self.assertEqual(patient_pack.load_patient(patient.RS_UID).Name_First, 'October')
+            self.assertEqual(patient_pack.load_patient_header(patient.RS_UID).Name_First, 'October')
+            with self.assertRaises(KeyError):
+                patient_pack.load_patient('missing')
+        finally:
+            patient_pack.close()
+
+    def test_repack(self):
+        expected = return_patients_json(self.return_loaded_database())
+        first_packs = pack_directory(self.database_path)
+        patient = next(iter(self.database.Patients.values()))
+        patient.DateLastModified.year += 1
+        patient.Name_First = 'Edited'
+        patient.save_to_directory(self.database_path)
+        expected[patient.RS_UID]['Name_First'] = 'Edited'
+        expected[patient.RS_UID]['DateLastModified']['year'] += 1
+        packs = pack_directory(self.database_path, repack=True)
+        self.assertFalse(set(first_packs) & set(packs))
+        self.assertEqual(sorted(os.listdir(self.database_path)), packs)
+        loaded = return_patients_json(self.return_loaded_database())
+        self.assertEqual(return_content_hash(loaded), return_content_hash(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import os
+import pickle
+import tempfile
+import unittest
+from ..AbstractBase import PatientDatabases, PatientHeaderDatabases, PatientProxy
+from ..BenchmarkTools import SyntheticDatabaseConfig, write_synthetic_databases
+
+
+def return_patients_json(database) -> dict:
+    return {key: json.loads(patient.to_json(exclude=['FilePath'])) for key, patient in database.Patients.items()}
+
+
+class TestPatientProxy(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.config = SyntheticDatabaseConfig(database_count=1, patient_count=4, roi_count=4, dvh_points=5,
+                                              beam_count=1, qcl_count=2)
+        write_synthetic_databases(self.temp_directory.name, self.config, save_mode='serial')
+        self.header_databases = PatientHeaderDatabases()
+        self.header_databases.build_from_folder(self.temp_directory.name, load_mode='serial')
+        self.db_name = next(iter(self.header_databases.HeaderDatabases))
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def return_lazy_database(self, **kwargs):
+        return self.header_databases.return_patient_databases(lazy=True, **kwargs).Databases[self.db_name]
+
+    def test_lazy_matches_eager(self):
+        lazy = self.return_lazy_database()
+        eager = self.header_databases.return_patient_databases(load_mode='serial').Databases[self.db_name]
+        self.assertTrue(all(isinstance(i, PatientProxy) for i in lazy.Patients.values()))
+        self.assertEqual([i.MRN for i in lazy.Patients.values()], [i.MRN for i in eager.Patients.values()])
+        self.assertFalse(any(i.is_loaded() for i in lazy.Patients.values()))
+        self.assertEqual(return_patients_json(lazy), return_patients_json(eager))
+
+    def test_load_qcls_stays_lazy(self):
+        lazy = self.return_lazy_database()
+        report = lazy.load_qcls(load_mode='serial')
+        self.assertEqual(report.Succeeded, len(lazy.Patients))
+        self.assertFalse(any(i.is_loaded() for i in lazy.Patients.values()))
+        self.assertTrue(all(len(i.QCL_List.QCLs) == self.config.QCLCount for i in lazy.Patients.values()))
+        proxy = next(iter(lazy.Patients.values()))
+        self.assertEqual(len(proxy.load().QCL_List.QCLs), self.config.QCLCount)
+
+    def test_eviction_keeps_qcls(self):
+        lazy = self.return_lazy_database(max_loaded_patients=1)
+        lazy.load_qcls(load_mode='serial')
+        proxies = list(lazy.Patients.values())
+        for proxy in proxies:
+            proxy.load()
+        self.assertEqual(sum(i.is_loaded() for i in proxies), 1)
+        self.assertTrue(all(len(i.load().QCL_List.QCLs) == self.config.QCLCount for i in proxies))
+
+    def test_pickle(self):
+        lazy = self.return_lazy_database(max_loaded_patients=2)
+        proxies = list(lazy.Patients.values())
+        proxies[0].Name_First = 'Edited'
+        for proxy in proxies[:2]:
+            copy = pickle.loads(pickle.dumps(proxy))
+            self.assertIsNone(copy.LoadedCache)
+            self.assertEqual(copy.is_loaded(), proxy.is_loaded())
+            self.assertEqual(copy.Name_First, proxy.Name_First)
+        self.assertEqual(pickle.loads(pickle.dumps(proxies[0])).Name_First, 'Edited')
+
+    def test_process_save(self):
+        lazy = self.return_lazy_database()
+        lazy.load_qcls(load_mode='serial')
+        proxy = next(iter(lazy.Patients.values()))
+        proxy.Name_First = 'Edited'
+        expected = return_patients_json(lazy)
+        out_path = os.path.join(self.temp_directory.name, 'Saved')
+        os.makedirs(out_path)
+        report = lazy.save_to_directory(out_path, save_mode='process', worker_count=2)
+        self.assertEqual((report.Succeeded, len(report.Failures)), (len(lazy.Patients), 0))
+        databases = PatientDatabases()
+        databases.build_from_folder(self.temp_directory.name, load_mode='serial', specific_folders=['Saved'])
+        databases.load_qcls(load_mode='serial')
+        self.assertEqual(return_patients_json(databases.Databases['Saved']), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import json
+import os
+import tempfile
+import unittest
+from ..AbstractBase import PatientDatabase, recompress_file
+from ..BenchmarkTools import SyntheticDatabaseConfig, make_synthetic_patient
+from ..PatientStore import PatientStore, import_directory_to_store, load_database_from_store, return_segment_name
+
+
+def return_patient_json(patient) -> dict:
+    return json.loads(patient.to_json(exclude=['FilePath']))
+
+
+class TestPatientStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.store_path = os.path.join(self.temp_directory.name, 'Store')
+        config = SyntheticDatabaseConfig(patient_count=4, roi_count=4, dvh_points=5, beam_count=1, qcl_count=1)
+        self.patients = [make_synthetic_patient(i, config) for i in range(config.PatientCount)]
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def test_round_trip(self):
+        store = PatientStore(self.store_path)
+        for patient in self.patients:
+            store.append(patient)
+        store.save_index()
+        store = PatientStore(self.store_path)
+        self.assertEqual(len(store), len(self.patients))
+        for patient in self.patients:
+            self.assertEqual(return_patient_json(store.get(patient.RS_UID)), return_patient_json(patient))
+        self.assertEqual([i.RS_UID for i in store.iter_latest()], [i.RS_UID for i in self.patients])
+        self.assertIsNone(store.get('missing'))
+
+    def test_recover(self):
+        store = PatientStore(self.store_path)
+        store.append(self.patients[0])
+        store.save_index()
+        for patient in self.patients[1:]:
+            store.append(patient)
+        """
+        The index was not saved after the last appends and the last record was cut off part way through its header
+        """
+        segment_path = os.path.join(self.store_path, return_segment_name(1))
+        complete_length = os.path.getsize(segment_path)
+        with open(segment_path, 'ab') as segment_file:
+            segment_file.write(b'{"RS_UID": "00000099", "Len')
+        store = PatientStore(self.store_path)
+        self.assertEqual(os.path.getsize(segment_path), complete_length)
+        self.assertEqual(store.Segments, {1: complete_length})
+        for patient in self.patients:
+            self.assertEqual(return_patient_json(store.get(patient.RS_UID)), return_patient_json(patient))
+        self.assertEqual(store.recover(), 0)
+
+    def test_recover_partial_body(self):
+        store = PatientStore(self.store_path)
+        store.append(self.patients[0])
+        store.save_index()
+        store.append(self.patients[1])
+        segment_path = os.path.join(self.store_path, return_segment_name(1))
+        with open(segment_path, 'rb+') as segment_file:
+            segment_file.truncate(os.path.getsize(segment_path) - 10)
+        store = PatientStore(self.store_path)
+        self.assertEqual(store.recover(), 0)
+        self.assertNotIn(self.patients[1].RS_UID, store)
+        self.assertEqual(return_patient_json(store.get(self.patients[0].RS_UID)), return_patient_json(self.patients[0]))
+
+    def test_compact(self):
+        store = PatientStore(self.store_path, max_segment_bytes=1)
+        for patient in self.patients:
+            store.append(patient)
+        store.save_index()
+        self.assertEqual(store.return_dead_bytes(), 0)
+        self.assertEqual(store.compact(), 0)
+        patient = self.patients[0]
+        year = patient.DateLastModified.year
+        patient.Name_First = 'Newest'
+        patient.DateLastModified.year = year + 1
+        store.append(patient)
+        """
+        Appended later but modified earlier, not the latest version
+        """
+        patient.Name_First = 'Older'
+        patient.DateLastModified.year = year - 1
+        store.append(patient)
+        store.save_index()
+        self.assertEqual(len(store.Versions[patient.RS_UID]), 3)
+        old_segments = set(store.Segments)
+        dead_bytes = store.return_dead_bytes()
+        self.assertGreater(dead_bytes, 0)
+        self.assertEqual(store.compact(), dead_bytes)
+        self.assertEqual(store.return_dead_bytes(), 0)
+        self.assertFalse(old_segments & set(store.Segments))
+        self.assertFalse(any(os.path.exists(store.return_segment_path(i)) for i in old_segments))
+        store = PatientStore(self.store_path)
+        self.assertEqual(len(store.Versions[patient.RS_UID]), 1)
+        self.assertEqual(store.get(patient.RS_UID).Name_First, 'Newest')
+        for other in self.patients[1:]:
+            self.assertEqual(return_patient_json(store.get(other.RS_UID)), return_patient_json(other))
+
+    def test_import_directory(self):
+        database = PatientDatabase('Synthetic')
+        for patient in self.patients:
+            database.Patients[patient.RS_UID] = patient
+        for compression in (None, 'gz', 'xz'):
+            directory_path = os.path.join(self.temp_directory.name, str(compression))
+            os.makedirs(directory_path)
+            database.save_to_directory(directory_path, save_mode='serial', compression=compression)
+            """
+            The QCL files need not share the compression of their patient file
+            """
+            for file_name in os.listdir(directory_path):
+                if 'QCLs.json' in file_name:
+                    recompress_file(os.path.join(directory_path, file_name), 'xz' if compression is None else None)
+            store_path = os.path.join(self.temp_directory.name, f"Store_{compression}")
+            report = import_directory_to_store(directory_path, store_path)
+            self.assertEqual(report.Succeeded, len(self.patients))
+            stored = load_database_from_store(store_path)
+            for patient in self.patients:
+                self.assertEqual(len(stored.Patients[patient.RS_UID].QCL_List.QCLs), len(patient.QCL_List.QCLs))
+                self.assertEqual(return_patient_json(stored.Patients[patient.RS_UID]), return_patient_json(patient))
+
+
+if __name__ == '__main__':
+    unittest.main()
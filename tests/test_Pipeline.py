@@ -0,0 +1,158 @@
+import json
+import os
+import tempfile
+import unittest
+from threading import Lock
+from ..AbstractBase import LoadReport, PatientDatabases, PatientHeaderDatabases, iterate_pipeline, run_pipeline
+from ..BenchmarkTools import SyntheticDatabaseConfig, write_synthetic_databases
+
+
+def return_square(item: int) -> int:
+    if item % 5 == 0:
+        raise ValueError(f"bad item {item}")
+    return item * item
+
+
+class TestRunPipeline(unittest.TestCase):
+    def setUp(self):
+        self.items = list(range(1, 41))
+        self.expected = {i: i * i for i in self.items if i % 5 != 0}
+
+    def test_worker_kinds(self):
+        for worker_kind in ('serial', 'thread', 'process'):
+            results = {}
+            report = run_pipeline(self.items, return_square, results.__setitem__, worker_count=3,
+                                  worker_kind=worker_kind, queue_size=2, chunk_size=4, description=worker_kind)
+            self.assertEqual(results, self.expected, worker_kind)
+            self.assertEqual((report.Total, report.Succeeded), (len(self.items), len(self.expected)))
+            self.assertEqual(set(report.Failures), {str(i) for i in self.items if i % 5 == 0})
+            self.assertEqual(report.Failures['5'], 'ValueError: bad item 5')
+            self.assertEqual((report.WorkerKind, report.WorkerCount),
+                             (worker_kind, 1 if worker_kind == 'serial' else 3))
+
+    def test_bounded_queue(self):
+        """
+        With a queue of one item and one worker, the producer is never more than a couple of items ahead
+        """
+        lock = Lock()
+        started = []
+        finished = []
+
+        def work(item):
+            with lock:
+                started.append(item)
+                self.assertLessEqual(len(started) - len(finished), 1)
+            return item
+
+        def keep(item, result):
+            finished.append(result)
+
+        report = run_pipeline(self.items, work, keep, worker_count=1, worker_kind='thread', queue_size=1)
+        self.assertEqual(finished, self.items)
+        self.assertEqual(report.Succeeded, len(self.items))
+
+    def test_result_function_failure(self):
+        def keep(item, result):
+            if item == 2:
+                raise KeyError(item)
+
+        for worker_kind in ('serial', 'thread', 'process'):
+            report = run_pipeline([1, 2, 3], return_square, keep, worker_count=2, worker_kind=worker_kind)
+            self.assertEqual((report.Succeeded, list(report.Failures)), (2, ['2']), worker_kind)
+
+    def test_unknown_worker_kind(self):
+        with self.assertRaises(ValueError):
+            run_pipeline(self.items, return_square, worker_kind='fiber')
+
+    def test_merge(self):
+        report = run_pipeline([1, 2, 5], return_square, worker_kind='serial', description='Headers')
+        other = run_pipeline([3, 10], return_square, worker_count=2, worker_kind='thread')
+        other.Rejected = 1
+        report.merge(other)
+        self.assertEqual((report.Total, report.Succeeded, report.Rejected), (5, 3, 1))
+        self.assertEqual(set(report.Failures), {'5', '10'})
+        self.assertEqual((report.WorkerKind, report.WorkerCount), ('thread', 2))
+        self.assertEqual(report.Description, 'Headers')
+        self.assertEqual(report.merge(LoadReport()).WorkerKind, 'thread')
+        loaded = LoadReport.from_json(report.to_json())
+        self.assertEqual(loaded.Failures, report.Failures)
+
+
+class TestIteratePipeline(unittest.TestCase):
+    def setUp(self):
+        self.items = list(range(1, 41))
+
+    def test_order_and_failures(self):
+        for worker_kind in ('serial', 'thread', 'process'):
+            report = LoadReport()
+            results = list(iterate_pipeline(self.items, return_square, worker_count=3, worker_kind=worker_kind,
+                                            prefetch=4, chunk_size=3, report=report))
+            self.assertEqual(results, [(i, i * i) for i in self.items if i % 5 != 0], worker_kind)
+            self.assertEqual((report.Total, report.Succeeded, len(report.Failures)), (40, 32, 8))
+
+    def test_prefetch(self):
+        lock = Lock()
+        started = []
+
+        def work(item):
+            with lock:
+                started.append(item)
+            return item
+
+        for consumed, (item, result) in enumerate(iterate_pipeline(self.items, work, worker_count=2, prefetch=3), 1):
+            with lock:
+                self.assertLessEqual(len(started), consumed + 3)
+        self.assertEqual(sorted(started), self.items)
+
+    def test_stop_early(self):
+        generator = iterate_pipeline(self.items, return_square, worker_count=2, worker_kind='thread', prefetch=2)
+        self.assertEqual(next(generator), (1, 1))
+        generator.close()
+
+
+class TestIterPatients(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.config = SyntheticDatabaseConfig(database_count=2, patient_count=4, roi_count=4, dvh_points=5,
+                                              beam_count=1, qcl_count=0)
+        write_synthetic_databases(self.temp_directory.name, self.config, save_mode='serial')
+        self.databases = PatientDatabases()
+        self.databases.build_from_folder(self.temp_directory.name, load_mode='serial')
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def return_expected(self, mrns=None) -> dict:
+        return {(db_name, key): json.loads(patient.to_json())
+                for db_name, database in self.databases.Databases.items()
+                for key, patient in database.Patients.items() if mrns is None or patient.MRN in mrns}
+
+    def test_iter_patients(self):
+        for load_mode in ('serial', 'thread', 'process'):
+            streamed = {(db_name, patient.RS_UID): json.loads(patient.to_json())
+                        for db_name, patient in PatientDatabases().iter_patients(self.temp_directory.name,
+                                                                                 load_mode=load_mode, prefetch=2)}
+            self.assertEqual(streamed, self.return_expected(), load_mode)
+        streamed = {(db_name, patient.RS_UID): json.loads(patient.to_json())
+                    for db_name, patient in PatientDatabases().iter_patients(self.temp_directory.name,
+                                                                             specific_mrns=['1', '000002'])}
+        self.assertEqual(streamed, self.return_expected(['00000001', '00000002']))
+
+    def test_iter_headers_and_patients(self):
+        header_databases = PatientHeaderDatabases()
+        header_databases.build_from_folder(self.temp_directory.name, load_mode='serial')
+        for db_name, header_database in header_databases.HeaderDatabases.items():
+            database_path = os.path.join(self.temp_directory.name, db_name)
+            headers = list(header_database.iter_headers(database_path, load_mode='thread'))
+            self.assertEqual(sorted(i.RS_UID for i in headers), sorted(header_database.PatientHeaders))
+            mrn = sorted(i.MRN for i in headers)[-1]
+            report = LoadReport()
+            patients = list(header_database.iter_patients(specific_mrns=[mrn.lstrip('0')], report=report))
+            self.assertEqual([i.MRN for i in patients], [mrn])
+            self.assertEqual(json.loads(patients[0].to_json()),
+                             self.return_expected()[(db_name, patients[0].RS_UID)])
+            self.assertEqual((report.Total, report.Succeeded), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+import unittest
+from collections import Counter
+from ..AbstractBase import PatientDatabases, PatientHeaderDatabases
+from ..BenchmarkTools import SyntheticDatabaseConfig, write_synthetic_databases
+from ..EvaluationTools import check_is_plan_approved, check_patient_has_approved, return_plan_names_by_contains
+from ..SQLiteTools import PatientSQLiteDatabase, export_to_sqlite, return_date_string
+
+CONFIG = SyntheticDatabaseConfig(database_count=2, patient_count=5, roi_count=4, dvh_points=5, beam_count=2,
+                                 qcl_count=1)
+
+
+class TestSQLite(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.database_path = os.path.join(self.temp_directory.name, 'Databases')
+        self.sqlite_path = os.path.join(self.temp_directory.name, 'Patients.sqlite')
+        write_synthetic_databases(self.database_path, CONFIG, save_mode='serial')
+        self.header_databases = PatientHeaderDatabases()
+        self.header_databases.build_from_folder(self.database_path, load_mode='serial')
+        self.patient_databases = PatientDatabases()
+        self.patient_databases.build_from_folder(self.database_path, load_mode='serial')
+        self.sqlite_database = export_to_sqlite(self.header_databases, self.sqlite_path, self.patient_databases)
+
+    def tearDown(self):
+        self.sqlite_database.close()
+        self.temp_directory.cleanup()
+
+    def return_headers(self):
+        for db_name, header_database in self.header_databases.HeaderDatabases.items():
+            for rs_uid, patient_header in header_database.PatientHeaders.items():
+                yield db_name, rs_uid, patient_header
+
+    def test_round_trip(self):
+        for db_name, rs_uid, patient_header in self.return_headers():
+            self.assertEqual(self.sqlite_database.return_patient_header(db_name, rs_uid).to_json(exclude=['QCL_List']),
+                             patient_header.to_json(exclude=['QCL_List']))
+            patient = self.patient_databases.Databases[db_name].Patients[rs_uid]
+            self.assertEqual(self.sqlite_database.return_patient(db_name, rs_uid).to_json(exclude=['FilePath']),
+                             patient.to_json(exclude=['FilePath']))
+        self.assertIsNone(self.sqlite_database.return_patient_header('Missing', '1'))
+        beam_counts = self.sqlite_database.query("SELECT BeamCount FROM beam_sets")
+        self.assertTrue(beam_counts)
+        self.assertEqual({i[0] for i in beam_counts}, {CONFIG.BeamCount})
+
+    def test_reexport(self):
+        self.sqlite_database.close()
+        self.sqlite_database = PatientSQLiteDatabase(self.sqlite_path)
+        written = self.sqlite_database.export_header_databases(self.header_databases)
+        self.assertEqual(written, {key: 0 for key in self.header_databases.HeaderDatabases})
+        self.assertEqual(self.sqlite_database.export_patient_databases(self.patient_databases, remove_missing=False),
+                         {key: 0 for key in self.patient_databases.Databases})
+        db_name, rs_uid, _ = next(self.return_headers())
+        self.header_databases.HeaderDatabases[db_name].PatientHeaders.pop(rs_uid)
+        self.sqlite_database.export_header_databases(self.header_databases, remove_missing=False)
+        self.assertIsNotNone(self.sqlite_database.return_patient_header(db_name, rs_uid))
+        self.sqlite_database.export_header_databases(self.header_databases)
+        self.assertIsNone(self.sqlite_database.return_patient_header(db_name, rs_uid))
+        self.assertEqual(self.sqlite_database.query("SELECT COUNT(*) FROM cases c LEFT JOIN patients p "
+                                                    "ON p.PatientId = c.PatientId WHERE p.PatientId IS NULL"), [(0,)])
+
+    def test_queries(self):
+        for db_name, header_database in self.header_databases.HeaderDatabases.items():
+            approved = [i.RS_UID for i in header_database.PatientHeaders.values() if check_patient_has_approved(i)]
+            self.assertEqual(sorted(self.sqlite_database.return_approved_rs_uids(db_name)), sorted(approved))
+            self.assertEqual(sorted(self.sqlite_database.return_approved_db(db_name).PatientHeaders), sorted(approved))
+            self.assertEqual(self.sqlite_database.return_plan_names_by_contains('plan', db_name),
+                             return_plan_names_by_contains(header_database.PatientHeaders.values(), 'plan'))
+        self.assertEqual(self.sqlite_database.return_case_counts_by_body_site(),
+                         dict(Counter(case.BodySite for _, _, patient_header in self.return_headers()
+                                      for case in patient_header.Cases)))
+        self.assertEqual(sorted(self.sqlite_database.return_patients_by_roi_type('ORGAN')),
+                         sorted((db_name, rs_uid) for db_name, rs_uid, patient_header in self.return_headers()
+                                if any(roi.Type.lower() == 'organ' for case in patient_header.Cases
+                                       for roi in case.ROIS)))
+
+    def test_approved_plans(self):
+        start_date, end_date = '2023-02-01 00:00:00', '2023-03-31 23:59:59'
+        expected = sorted((db_name, rs_uid, case.CaseName, plan.PlanName)
+                          for db_name, rs_uid, patient_header in self.return_headers()
+                          for case in patient_header.Cases for plan in case.TreatmentPlans
+                          if check_is_plan_approved(plan) and plan.PlannedBy == 'Dr B' and
+                          start_date <= return_date_string(plan.Review.ReviewTime) <= end_date)
+        rows = self.sqlite_database.return_approved_plans('Dr B', start_date, end_date)
+        self.assertTrue(expected)
+        self.assertEqual(sorted(i[:4] for i in rows), expected)
+        self.assertEqual([i[5] for i in rows], sorted(i[5] for i in rows))
+
+    def test_date_string(self):
+        patient_header = next(self.return_headers())[2]
+        self.assertEqual(return_date_string(patient_header.DateLastModified),
+                         self.sqlite_database.query("SELECT DateLastModified FROM patients WHERE RS_UID = ?",
+                                                    (patient_header.RS_UID,))[0][0])
+        self.assertIsNone(return_date_string(None))
+        self.assertEqual(json.loads(self.sqlite_database.query("SELECT HeaderJson FROM patients LIMIT 1")[0][0])
+                         ['RS_UID'], self.sqlite_database.query("SELECT RS_UID FROM patients LIMIT 1")[0][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
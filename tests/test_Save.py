@@ -0,0 +1,109 @@
+import json
+import os
+import tempfile
+import unittest
+from ..AbstractBase import PatientDatabases, write_file_atomic
+from ..BenchmarkTools import SyntheticDatabaseConfig, return_synthetic_databases
+
+CONFIG = SyntheticDatabaseConfig(database_count=2, patient_count=3, roi_count=4, dvh_points=5, beam_count=1,
+                                 qcl_count=1)
+
+
+def return_databases_json(databases: PatientDatabases) -> dict:
+    return {db_name: {key: json.loads(patient.to_json(exclude=['FilePath']))
+                      for key, patient in database.Patients.items()}
+            for db_name, database in databases.Databases.items()}
+
+
+class TestSave(unittest.TestCase):
+    def setUp(self):
+        self.temp_directory = tempfile.TemporaryDirectory()
+        self.databases = return_synthetic_databases(CONFIG)
+
+    def tearDown(self):
+        self.temp_directory.cleanup()
+
+    def return_loaded_databases(self, path: str) -> PatientDatabases:
+        databases = PatientDatabases()
+        databases.build_from_folder(path, load_mode='serial')
+        databases.load_qcls(load_mode='serial')
+        return databases
+
+    def return_file_times(self, path: str, qcls: bool = True) -> dict:
+        return {os.path.join(root, file_name): os.stat(os.path.join(root, file_name)).st_mtime_ns
+                for root, _, file_names in os.walk(path) for file_name in file_names
+                if qcls or 'QCLs.json' not in file_name}
+
+    def test_save_modes(self):
+        expected = return_databases_json(self.databases)
+        file_names = None
+        for save_mode in ('serial', 'thread', 'process'):
+            path = os.path.join(self.temp_directory.name, save_mode)
+            reports = self.databases.save(path, save_mode=save_mode, worker_count=2)
+            self.assertEqual({key: (report.Succeeded, len(report.Failures)) for key, report in reports.items()},
+                             {key: (CONFIG.PatientCount, 0) for key in self.databases.Databases})
+            self.assertEqual(return_databases_json(self.return_loaded_databases(path)), expected)
+            names = sorted(os.path.relpath(i, path) for i in self.return_file_times(path))
+            self.assertFalse([i for i in names if i.endswith('.tmp')])
+            if file_names is not None:
+                self.assertEqual(names, file_names)
+            file_names = names
+
+    def test_skip_unchanged(self):
+        path = self.temp_directory.name
+        self.databases.save(path, save_mode='serial')
+        """
+        The QCLs are not part of the ContentHash, their files are always written
+        """
+        file_times = self.return_file_times(path, qcls=False)
+        self.databases.save(path, save_mode='thread', skip_unchanged=True)
+        self.assertEqual(self.return_file_times(path, qcls=False), file_times)
+        database = next(iter(self.databases.Databases.values()))
+        patient = next(iter(database.Patients.values()))
+        patient.Name_First = 'Edited'
+        self.databases.save(path, save_mode='thread', skip_unchanged=True)
+        changed = {i for i in file_times if self.return_file_times(path, qcls=False).get(i) != file_times[i]}
+        self.assertTrue(changed)
+        self.assertTrue(all(os.path.basename(i).startswith(patient.RS_UID) for i in changed))
+        loaded = self.return_loaded_databases(path)
+        self.assertEqual(loaded.Databases[database.DBName].Patients[patient.RS_UID].Name_First, 'Edited')
+
+    def test_skip_unchanged_damaged_header(self):
+        """
+        A truncated compressed header is rewritten, not a failure of the save
+        """
+        path = self.temp_directory.name
+        for compression in ('gz', 'xz'):
+            self.databases.save(path, save_mode='serial', compression=compression)
+            database = next(iter(self.databases.Databases.values()))
+            database_path = os.path.join(path, database.DBName)
+            header_file = sorted(i for i in os.listdir(database_path) if '_Header.json' in i)[0]
+            with open(os.path.join(database_path, header_file), 'rb+') as damaged_file:
+                damaged_file.truncate(20)
+            report = database.save_to_directory(database_path, save_mode='serial', skip_unchanged=True,
+                                                compression=compression)
+            self.assertEqual((report.Succeeded, len(report.Failures)), (CONFIG.PatientCount, 0))
+            self.assertEqual(return_databases_json(self.return_loaded_databases(path)),
+                             return_databases_json(self.databases))
+
+    def test_failed_patient(self):
+        database = next(iter(self.databases.Databases.values()))
+        patient = next(iter(database.Patients.values()))
+        patient.Name_First = object()
+        reports = self.databases.save(self.temp_directory.name, save_mode='thread')
+        self.assertEqual(list(reports[database.DBName].Failures), [patient.RS_UID])
+        self.assertEqual(reports[database.DBName].Succeeded, CONFIG.PatientCount - 1)
+        self.assertFalse([i for i in self.return_file_times(self.temp_directory.name) if i.endswith('.tmp')])
+
+    def test_write_file_atomic(self):
+        file_path = os.path.join(self.temp_directory.name, 'file.json')
+        write_file_atomic(file_path, '{"a": 1}')
+        with self.assertRaises(UnicodeEncodeError):
+            write_file_atomic(file_path, '{"a": "\ud800"}')
+        with open(file_path) as json_file:
+            self.assertEqual(json_file.read(), '{"a": 1}')
+        self.assertEqual(os.listdir(self.temp_directory.name), ['file.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import json
+import unittest
+from unittest import mock
+from .. import AbstractBase
+from ..AbstractBase import CaseClass, PatientClass, RegionOfInterestBase, SerializerPlan
+from ..BenchmarkTools import SyntheticDatabaseConfig, make_synthetic_patient
+
+CONFIG = SyntheticDatabaseConfig(patient_count=2, roi_count=4, dvh_points=5, beam_count=1, qcl_count=1)
+
+
+class TestSerializerPlan(unittest.TestCase):
+    def setUp(self):
+        self.patient = make_synthetic_patient(1, CONFIG)
+
+    def test_plan_is_cached(self):
+        self.assertIs(PatientClass.return_serializer_plan(), PatientClass.return_serializer_plan())
+        data = self.patient.to_json()
+        PatientClass.from_json(data)
+        with mock.patch.object(AbstractBase, 'SerializerPlan', wraps=SerializerPlan) as plan_class:
+            loaded = PatientClass.from_json(data)
+            loaded.to_json()
+        self.assertEqual(plan_class.call_count, 0)
+
+    def test_subclass_has_its_own_plan(self):
+        class ExtendedCase(CaseClass):
+            Extra: str
+
+            def __init__(self):
+                super().__init__()
+                self.Extra = 'extra'
+
+        parent_plan = CaseClass.return_serializer_plan()
+        plan = ExtendedCase.return_serializer_plan()
+        self.assertIsNot(plan, parent_plan)
+        self.assertEqual(plan.Marker, '__ExtendedCase__')
+        self.assertIn('Extra', [i[0] for i in plan.Encoders])
+        self.assertNotIn('Extra', [i[0] for i in parent_plan.Encoders])
+        self.assertIs(CaseClass.return_serializer_plan(), parent_plan)
+        case = ExtendedCase()
+        case.Extra = 'changed'
+        self.assertEqual(ExtendedCase.from_json(case.to_json()).Extra, 'changed')
+        self.assertIsNone(CaseClass.from_json(case.to_json()))
+
+    def test_decoders_follow_annotations(self):
+        plan = RegionOfInterestBase.return_serializer_plan()
+        self.assertEqual([i[0] for i in plan.Encoders], list(RegionOfInterestBase.__annotations__))
+        self.assertEqual({i[0] for i in plan.Decoders if i[1] == AbstractBase.DECODE_INTERN}, {'Name', 'Type'})
+        self.assertEqual(PatientClass.return_serializer_plan().SubTypes['Cases'], CaseClass)
+
+    def test_round_trip(self):
+        data = json.loads(self.patient.to_json())
+        loaded = PatientClass.from_json(data)
+        self.assertEqual(json.loads(loaded.to_json()), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import json
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from ..AbstractBase import PatientClass, PatientDatabases, SymbolTable, set_decode_symbol_table
+from ..BenchmarkTools import SyntheticDatabaseConfig, make_synthetic_patient, write_synthetic_databases
+
+CONFIG = SyntheticDatabaseConfig(database_count=1, patient_count=4, roi_count=4, dvh_points=5, beam_count=1,
+                                 qcl_count=1)
+
+
+def return_interned_values(patient: PatientClass) -> list:
+    """
+    Values of categorical fields, taken from the decoded json strings
+    """
+    values = []
+    for case in patient.Cases:
+        values.append(case.BodySite)
+        values += [roi.Name for roi in case.Base_ROIs]
+        for plan in case.TreatmentPlans:
+            values.append(plan.PlannedBy)
+            for beam_set in plan.BeamSets:
+                values += [beam.BeamQualityId for beam in beam_set.Beams]
+    return values
+
+
+class TestSymbolTable(unittest.TestCase):
+    def test_codes(self):
+        symbol_table = SymbolTable(['Organ', 'External'])
+        self.assertEqual((symbol_table.return_code('Organ'), symbol_table.return_code('PTV')), (0, 2))
+        self.assertEqual(symbol_table.return_code(None), -1)
+        self.assertIsNone(symbol_table.return_value(-1))
+        self.assertEqual(symbol_table.return_value(2), 'PTV')
+        self.assertEqual(len(symbol_table), 3)
+        value = ''.join(['Org', 'an'])
+        self.assertIsNot(value, symbol_table.Values[0])
+        self.assertIs(symbol_table.intern(value), symbol_table.Values[0])
+        self.assertEqual(symbol_table.intern(['PTV', 'Organ']), ['PTV', 'Organ'])
+        self.assertEqual(symbol_table.intern(5), 5)
+        self.assertIsNone(symbol_table.intern(None))
+
+    def test_concurrent_adds(self):
+        symbol_table = SymbolTable()
+        values = [f"ROI {i % 50}" for i in range(2000)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            codes = list(executor.map(symbol_table.add, values))
+        self.assertEqual(len(symbol_table), 50)
+        self.assertTrue(all(symbol_table.Values[code] == value for code, value in zip(codes, values)))
+
+    def test_decode_interns(self):
+        data = make_synthetic_patient(1, CONFIG).to_json()
+        symbol_table = SymbolTable()
+        previous = set_decode_symbol_table(symbol_table)
+        try:
+            patients = [PatientClass.from_json(data) for _ in range(2)]
+        finally:
+            self.assertIs(set_decode_symbol_table(previous), symbol_table)
+        for value1, value2 in zip(*[return_interned_values(i) for i in patients]):
+            self.assertIs(value1, value2)
+            self.assertIs(value1, symbol_table.intern(value1))
+        self.assertEqual(json.loads(patients[0].to_json()), json.loads(data))
+
+    def test_intern_object(self):
+        symbol_table = SymbolTable()
+        patients = [PatientClass.from_json(make_synthetic_patient(1, CONFIG).to_json()) for _ in range(2)]
+        symbol_table.intern_object(patients)
+        for value1, value2 in zip(*[return_interned_values(i) for i in patients]):
+            self.assertIs(value1, value2)
+
+    def test_loaded_databases(self):
+        with tempfile.TemporaryDirectory() as temp_directory:
+            write_synthetic_databases(temp_directory, CONFIG, save_mode='serial')
+            for load_mode in ('thread', 'process'):
+                databases = PatientDatabases()
+                databases.build_from_folder(temp_directory, load_mode=load_mode)
+                database = next(iter(databases.Databases.values()))
+                for patient in database.Patients.values():
+                    for value in return_interned_values(patient):
+                        self.assertIs(value, database.SymbolTable.intern(value), load_mode)
+
+
+if __name__ == '__main__':
+    unittest.main()